@@ -6,8 +6,30 @@ import json
 from json import JSONEncoder
 import serial
 import time
+import zlib
+import numpy as np
 from V5Position import Position
-    
+from V5LinkStats import V5LinkStats
+
+# Packet type of a serialized AIRecord
+MAP_PACKET_TYPE = 0x0001
+# Packet type of an AIRecord with quantized detections, see AIRecord.pack_compact_into
+COMPACT_PACKET_TYPE = 0x0002
+# Packet type of a serialized AIRecord whose detections also carry their track ID and age
+TRACKED_PACKET_TYPE = 0x0003
+
+# Every byte value with its bits in reverse order
+_BIT_REVERSE = bytes(int('{:08b}'.format(i)[::-1], 2) for i in range(256))
+
+def crc32(data, accumulator = 0):
+    # CRC32 of data with polynomial 0x04C11DB7, MSB first (not reflected), no final XOR, as the V5 Brain checks it.
+    # zlib's CRC32 uses the same polynomial LSB first, so the same CRC comes out of zlib for the data with every
+    # byte's bits reversed, reversing the bits of the result. Both steps run in C instead of a Python loop per byte.
+    # zlib also starts from and ends with all ones, which the XORs with 0xFFFFFFFF undo.
+    reflected = int('{:032b}'.format(accumulator & 0xFFFFFFFF)[::-1], 2)
+    reflected = zlib.crc32(bytes(data).translate(_BIT_REVERSE), reflected ^ 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int('{:032b}'.format(reflected)[::-1], 2)
+
 class ImageDetection:
     def __init__(self, x: int, y: int, width: int, height: int):
         # Initialize properties of ImageDetection class for x, y coordinates, width, and height
@@ -40,19 +62,28 @@ class MapDetection:
         return self.__dict__
     
 class Detection:
-    def __init__(self, classID: int, probability: float, depth: float, screenLocation: ImageDetection, mapLocation: MapDetection):
+    def __init__(self, classID: int, probability: float, depth: float, screenLocation: ImageDetection, mapLocation: MapDetection,
+                 trackID: int = -1, age: int = 0, depthConfidence: float = 1.0):
         # Initialize properties of Detection class, including class ID, probability, depth, and locations on screen and on the field
+        # trackID stays the same for an object across frames (-1 if untracked), age counts the detector runs it has been tracked for
+        # depthConfidence (0 to 1, see DepthEstimator) is only shown on the dashboard, it is not sent to the Brain
         self.classID = classID
         self.probability = probability
         self.depth = depth
         self.screenLocation = screenLocation
         self.mapLocattion = mapLocation
+        self.trackID = trackID
+        self.age = age
+        self.depthConfidence = depthConfidence
 
-    def to_Serial(self):
+    def to_Serial(self, tracked = False):
         # Convert Detection properties to serialized binary format
+        # tracked appends the track ID and age, the layout of TRACKED_PACKET_TYPE packets
         data = struct.pack('<iff', self.classID, self.probability, self.depth)
         data += self.screenLocation.to_Serial()
         data += self.mapLocattion.to_Serial()
+        if tracked:
+            data += struct.pack('<ii', self.trackID, self.age)
         return data
     
     def to_JSON(self):
@@ -63,23 +94,127 @@ class Detection:
         outData['depth'] = self.depth
         outData['screenLocation'] = self.screenLocation.to_JSON()
         outData['mapLocation'] = self.mapLocattion.to_JSON()
+        outData['trackID'] = self.trackID
+        outData['age'] = self.age
+        outData['depthConfidence'] = self.depthConfidence
         return outData
 
 
 class AIRecord:
     # The AIRecord is what is communicated from the Jetson to the V5 Brain as a detection
+
+    # Layouts of the serialized record, the same as the to_Serial methods of its parts produce
+    __COUNT = struct.Struct('<i')
+    __POSITION = struct.Struct('<iiffffff')
+    __DETECTION = struct.Struct('<iffiiiifff')  # Detection, ImageDetection and MapDetection
+    __TRACKED_DETECTION = struct.Struct('<iffiiiifffii')  # The same followed by the track ID and age
+
+    # Compact layout: detection count, flags and the position, then per detection the class, the probability in 1/255,
+    # the depth in millimeters, the map location in millimeters, the track ID (0xFFFF if untracked) and the age
+    # (saturating at 255), optionally followed by the screen box. 13 bytes per detection, 21 with screen boxes, instead of 40.
+    COMPACT_SCREEN_BOXES = 0x01  # Flag: every detection carries its screen box
+    COMPACT_MAX_DETECTIONS = 50  # MAX_DETECTIONS of the V5 Brain, it drops any detection past that
+    __COMPACT_HEADER = struct.Struct('<BBiiffffff')
+    __COMPACT_DETECTION = struct.Struct('<BBHhhhHB')
+    __COMPACT_SCREEN = struct.Struct('<hhhh')
+    __COMPACT_DTYPE = np.dtype([('classID', 'u1'), ('probability', 'u1'), ('depth', '<u2'), ('map', '<i2', 3), ('trackID', '<u2'), ('age', 'u1')])
+    __COMPACT_DTYPE_BOXES = np.dtype(__COMPACT_DTYPE.descr + [('screen', '<i2', 4)])
+
     def __init__(self, position: Position, detections: "list[Detection]"):
         # Initialize properties of AIRecord class, including position and detections list
         self.position = position
         self.detections = detections
 
-    def to_Serial(self):
-        # Convert AIRecord properties to serialized binary format
-        data = struct.pack('<i', len(self.detections))
-        data += self.position.to_Serial()
+    def serialSize(self, tracked = False):
+        # Number of bytes of the serialized record, tracked for the TRACKED_PACKET_TYPE layout
+        detection = AIRecord.__TRACKED_DETECTION if tracked else AIRecord.__DETECTION
+        return AIRecord.__COUNT.size + AIRecord.__POSITION.size + detection.size * len(self.detections)
+
+    def pack_into(self, buffer, offset = 0, tracked = False):
+        # Serialize the record straight into buffer (a bytearray or writable memoryview) at offset, in one pass
+        # without building intermediate bytes objects. Returns the offset just past the record.
+        # tracked adds every detection's track ID and age, the layout of TRACKED_PACKET_TYPE packets.
+        AIRecord.__COUNT.pack_into(buffer, offset, len(self.detections))
+        offset += AIRecord.__COUNT.size
+        pos = self.position
+        AIRecord.__POSITION.pack_into(buffer, offset, pos.frameCount, pos.status, pos.x, pos.y, pos.z, pos.azimuth, pos.elevation, pos.rotation)
+        offset += AIRecord.__POSITION.size
+        if tracked:
+            pack_detection = AIRecord.__TRACKED_DETECTION.pack_into
+            detection_size = AIRecord.__TRACKED_DETECTION.size
+            for det in self.detections:
+                screen = det.screenLocation
+                field = det.mapLocattion
+                pack_detection(buffer, offset, det.classID, det.probability, det.depth, screen.x, screen.y, screen.width, screen.height,
+                               field.x, field.y, field.z, det.trackID, det.age)
+                offset += detection_size
+            return offset
+        pack_detection = AIRecord.__DETECTION.pack_into
+        detection_size = AIRecord.__DETECTION.size
         for det in self.detections:
-            data += det.to_Serial()
-        return data
+            screen = det.screenLocation
+            field = det.mapLocattion
+            pack_detection(buffer, offset, det.classID, det.probability, det.depth, screen.x, screen.y, screen.width, screen.height,
+                           field.x, field.y, field.z)
+            offset += detection_size
+        return offset
+
+    def to_Serial(self, tracked = False):
+        # Convert AIRecord properties to serialized binary format
+        data = bytearray(self.serialSize(tracked))
+        self.pack_into(data, 0, tracked)
+        return bytes(data)
+
+    def compactSerialSize(self, screenBoxes = False):
+        # Number of bytes of the record in the compact layout
+        detectionSize = AIRecord.__COMPACT_DETECTION.size + (AIRecord.__COMPACT_SCREEN.size if screenBoxes else 0)
+        return AIRecord.__COMPACT_HEADER.size + detectionSize * min(len(self.detections), AIRecord.COMPACT_MAX_DETECTIONS)
+
+    def pack_compact_into(self, buffer, offset = 0, screenBoxes = False):
+        # Serialize the record in the compact layout into buffer at offset and return the offset just past it.
+        # Values are rounded to the nearest step and clamped to the range of their field, all detections at once.
+        detections = self.detections[:AIRecord.COMPACT_MAX_DETECTIONS]
+        pos = self.position
+        AIRecord.__COMPACT_HEADER.pack_into(buffer, offset, len(detections), AIRecord.COMPACT_SCREEN_BOXES if screenBoxes else 0,
+                                            pos.frameCount, pos.status, pos.x, pos.y, pos.z, pos.azimuth, pos.elevation, pos.rotation)
+        offset += AIRecord.__COMPACT_HEADER.size
+        if len(detections) == 0:
+            return offset
+
+        values = np.array([(det.classID, det.probability * 255, det.depth * 1000, det.mapLocattion.x * 1000, det.mapLocattion.y * 1000,
+                            det.mapLocattion.z * 1000, det.trackID, det.age) for det in detections], dtype=np.float64)
+        dtype = AIRecord.__COMPACT_DTYPE_BOXES if screenBoxes else AIRecord.__COMPACT_DTYPE
+        packed = np.empty(len(detections), dtype=dtype)
+        packed['classID'] = np.clip(values[:, 0], 0, 255)
+        packed['probability'] = np.clip(np.rint(values[:, 1]), 0, 255)
+        packed['depth'] = np.clip(np.rint(values[:, 2]), 0, 65535)
+        packed['map'] = np.clip(np.rint(values[:, 3:6]), -32768, 32767)
+        packed['trackID'] = np.where(values[:, 6] < 0, 0xFFFF, np.mod(values[:, 6], 0xFFFF))
+        packed['age'] = np.clip(values[:, 7], 0, 255)
+        if screenBoxes:
+            screens = np.array([(det.screenLocation.x, det.screenLocation.y, det.screenLocation.width, det.screenLocation.height)
+                                for det in detections], dtype=np.int64)
+            packed['screen'] = np.clip(screens, -32768, 32767)
+        end = offset + packed.nbytes
+        memoryview(buffer)[offset:end] = packed.tobytes()
+        return end
+
+    @staticmethod
+    def from_Compact(data):
+        # Decode a record in the compact layout, the way the V5 Brain does. Missing screen boxes decode as zeros.
+        count, flags, *position = AIRecord.__COMPACT_HEADER.unpack_from(data, 0)
+        offset = AIRecord.__COMPACT_HEADER.size
+        detections = []
+        for _ in range(count):
+            classID, probability, depth, x, y, z, trackID, age = AIRecord.__COMPACT_DETECTION.unpack_from(data, offset)
+            offset += AIRecord.__COMPACT_DETECTION.size
+            screen = ImageDetection(0, 0, 0, 0)
+            if flags & AIRecord.COMPACT_SCREEN_BOXES:
+                screen = ImageDetection(*AIRecord.__COMPACT_SCREEN.unpack_from(data, offset))
+                offset += AIRecord.__COMPACT_SCREEN.size
+            detections.append(Detection(classID, probability / 255.0, depth / 1000.0, screen, MapDetection(x / 1000.0, y / 1000.0, z / 1000.0),
+                                        -1 if trackID == 0xFFFF else trackID, age))
+        return AIRecord(Position(*position), detections)
     
     def to_JSON(self):
         # Convert AIRecord properties to JSON format
@@ -90,60 +225,87 @@ class AIRecord:
 
     POLYNOMIAL_CRC32 = 0x04C11DB7
 
-    __crc32_table = [0] * 256
-    __table32Generated = 0
-
-    def __Crc32GenerateTable(self):
-        for i in range(256):
-            crc_accum = i << 24
-            for j in range(8):
-                if crc_accum & 0x80000000:
-                    crc_accum = (crc_accum << 1) ^ AIRecord.POLYNOMIAL_CRC32
-                else:
-                    crc_accum = crc_accum << 1
-            AIRecord.__crc32_table[i] = crc_accum
-        AIRecord.__table32Generated = 1
-
-    def __Crc32Generate(self, data, accumulator):
-        i, j = 0, 0
-        if not AIRecord.__table32Generated:
-            self.__Crc32GenerateTable()
-        for j in range(len(data)):
-            i = ((accumulator >> 24) ^ data[j]) & 0xFF
-            accumulator = (accumulator << 8) ^ AIRecord.__crc32_table[i]
-        return accumulator
-
     def getCRC32(self):
-        data = self.to_Serial()
-        crc = self.__Crc32Generate(data, 0) & 0xFFFFFFFF
-        return crc
+        return crc32(self.to_Serial())
     
 
 class V5SerialPacket:
-    def __init__(self, type: int, detections: AIRecord):
+    # Packet layout: the AA 55 CC 33 header, the payload length, type and CRC32, then the payload
+    HEADER = bytes([0xAA, 0x55, 0xCC, 0x33])
+    __LENGTH_TYPE_CRC = struct.Struct('<HHI')
+    HEADER_SIZE = len(HEADER) + __LENGTH_TYPE_CRC.size
+
+    def __init__(self, type: int, detections: AIRecord, screenBoxes: bool = False):
         # Initialize properties of V5SerialPacket class, including type and detections
-        self.__length = len(detections.to_Serial())
+        # screenBoxes selects whether a COMPACT_PACKET_TYPE packet carries the screen boxes
+        if type not in (MAP_PACKET_TYPE, COMPACT_PACKET_TYPE, TRACKED_PACKET_TYPE):
+            raise Exception("Invalid argument: Packet type not accepted")
         self.__type = type        # 2 bytes
         self.__detections = detections
+        self.__screenBoxes = screenBoxes
+
+    def serialSize(self):
+        # Number of bytes of the whole packet
+        if self.__type == COMPACT_PACKET_TYPE:
+            return V5SerialPacket.HEADER_SIZE + self.__detections.compactSerialSize(self.__screenBoxes)
+        return V5SerialPacket.HEADER_SIZE + self.__detections.serialSize(self.__type == TRACKED_PACKET_TYPE)
+
+    def pack_into(self, buffer, offset = 0):
+        # Serialize the packet into buffer at offset, serializing the record only once, and return the packet length.
+        # buffer must hold at least serialSize() bytes from offset, it can be reused for the next packet.
+        view = memoryview(buffer)
+        start = offset + V5SerialPacket.HEADER_SIZE
+        if self.__type == COMPACT_PACKET_TYPE:
+            end = self.__detections.pack_compact_into(view, start, self.__screenBoxes)
+        else:
+            end = self.__detections.pack_into(view, start, self.__type == TRACKED_PACKET_TYPE)
+        view[offset:offset + len(V5SerialPacket.HEADER)] = V5SerialPacket.HEADER
+        V5SerialPacket.__LENGTH_TYPE_CRC.pack_into(view, offset + len(V5SerialPacket.HEADER), end - start, self.__type, crc32(view[start:end]))
+        return end - offset
 
     def to_Serial(self):
         # Convert V5SerialPacket properties to serialized binary format
-        data = bytearray([0xAA, 0x55, 0xCC, 0x33])
-        data += struct.pack('<HHI', self.__length, self.__type, self.__detections.getCRC32())
-        data += self.__detections.to_Serial()
+        data = bytearray(self.serialSize())
+        self.pack_into(data)
         return data
 
 class V5SerialComms:
+    # Answers the V5 Brain's requests with the latest detections.
+    # setDetectionData encodes the reply packet right away, into whichever of two buffers is not being sent, and then
+    # swaps the buffers. A request from the Brain is answered with those ready-made bytes, so no serialization or CRC
+    # happens between the request and the reply. Requests that queued up while a reply was being written are answered
+    # by a single reply with the latest data.
+    #
+    # A request is "AA55CC33" followed by the Brain's capability flags as two hex digits. "01" asks for the full
+    # MAP_PACKET_TYPE packet, flag 0x02 for the COMPACT_PACKET_TYPE packet and flag 0x04 for screen boxes in it.
+    # Flag 0x08 asks for the TRACKED_PACKET_TYPE packet instead of MAP_PACKET_TYPE, which Brains built before track IDs
+    # existed could not parse. The compact packet always carries the track IDs.
+    # The packet is pre-encoded in the format the Brain asked for last.
+    # With a prioritizer (see prioritizer.py) only the most important detections that fit its budget are sent, best first.
 
-    __MAP_PACKET_TYPE = 0x0001
+    __MAP_PACKET_TYPE = MAP_PACKET_TYPE
+    __REQUEST = b"AA55CC33"
+    CAPABILITY_MAP = 0x01
+    CAPABILITY_COMPACT = 0x02
+    CAPABILITY_SCREEN_BOXES = 0x04
+    CAPABILITY_TRACKS = 0x08
+    __MAX_PENDING = 256  # Bytes kept of an unfinished request line, anything longer is garbage
 
-    def __init__(self, port = None):
+    def __init__(self, port = None, prioritizer = None):
         # Initialize properties of V5SerialComms class, including port, started status, and lock
         self.__dev = port
+        self.__prioritizer = prioritizer
         self.__started = False
         self.__ser = None
-        self.__detections = AIRecord(Position(0, 0, 0, 0, 0, 0, 0, 0), [])
-        self.__detectionLock = Lock()
+        self.__detectionLock = Lock()  # Guards the swap of the front (ready to send) and back buffers
+        self.__encodeLock = Lock()  # Only one thread encodes into the back buffer at a time
+        self.__buffers = [bytearray(4096), bytearray(4096)]
+        self.__front = 0
+        self.__frontLength = 0
+        self.__stats = V5LinkStats(115200)
+        self.__capabilities = V5SerialComms.CAPABILITY_MAP
+        self.__replyLayout = self.getReplyLayout()
+        self.setDetectionData(AIRecord(Position(0, 0, 0, 0, 0, 0, 0, 0), []))
 
     def start(self):
         # Start serial communication thread
@@ -180,18 +342,41 @@ class V5SerialComms:
                 self.__ser = serial.Serial(port, 115200, timeout=10)
                 self.__ser.flushInput()
                 self.__ser.flushOutput()
+                self.__stats.recordConnect()
 
+                pending = bytearray()
                 while self.__started:  # Continue reading while thread is started
-                    # Read data from the serial port
-                    data = self.__ser.readline().decode("utf-8").rstrip()
-                    # print(data)
-                    if(data == "AA55CC3301"):
-                        #send data
-                        self.__detectionLock.acquire()
-                        myPacket = V5SerialPacket(self.__MAP_PACKET_TYPE, self.__detections)
-                        self.__detectionLock.release()
-                        data = myPacket.to_Serial()
-                        self.__ser.write(data)  # Write serialized data to the serial port
+                    # Read everything that arrived, waiting for at least one byte
+                    chunk = self.__ser.read(max(1, self.__ser.in_waiting))
+                    readTime = time.perf_counter()
+                    self.__stats.recordReceived(len(chunk))
+                    pending += chunk
+                    lines = pending.split(b"\n")
+                    pending = lines.pop()  # Unfinished line
+                    if len(pending) > self.__MAX_PENDING:
+                        self.__stats.recordGarbage(len(pending))
+                        pending = bytearray()
+                    requests = 0
+                    capabilities = None
+                    for line in lines:
+                        line = line.strip()
+                        if len(line) == len(self.__REQUEST) + 2 and line.startswith(self.__REQUEST):
+                            try:
+                                capabilities = int(line[len(self.__REQUEST):], 16)
+                                requests += 1
+                                continue
+                            except ValueError:
+                                pass
+                        if len(line) > 0:
+                            self.__stats.recordGarbage(len(line) + 1)
+                    # Any number of queued requests get one reply with the latest data, in the format of the last one
+                    if requests > 0:
+                        self.__stats.recordRequests(requests)
+                        if capabilities != self.__capabilities:
+                            self.__setCapabilities(capabilities)
+                        reply = self.__getReply()
+                        self.__ser.write(reply)  # Write the pre-encoded packet to the serial port
+                        self.__stats.recordReply(len(reply), time.perf_counter() - readTime)
 
 
             # To close the serial port gracefully, use Ctrl+C to break the loop
@@ -199,16 +384,61 @@ class V5SerialComms:
                 print("Could not connect to ", port, ". Exception: ", e)
                 time.sleep(1)    # Wait for 1 second before retrying
         
-            if(self.__ser.isOpen()):
+            if(self.__ser is not None and self.__ser.isOpen()):
                 self.__ser.close()    # Close the serial port if open
 
         print("V5SerialComms thread stopped.")
 
-    def setDetectionData(self, data: AIRecord):
-        # Aquire lock and set detection data
+    def __getReply(self):
+        # Copy of the latest encoded packet, a plain memory copy
         self.__detectionLock.acquire()
+        reply = bytes(memoryview(self.__buffers[self.__front])[:self.__frontLength])
+        self.__detectionLock.release()
+        return reply
+
+    def __setCapabilities(self, capabilities):
+        # Switch the reply format and encode the latest detections again in it
+        self.__encodeLock.acquire()
+        self.__capabilities = capabilities
+        self.__replyLayout = self.getReplyLayout()
+        self.__encodeLock.release()
+        self.setDetectionData(self.__detections)
+
+    def __makePacket(self, data):
+        # Reply packet in the format the Brain asked for
+        if self.__capabilities & V5SerialComms.CAPABILITY_COMPACT:
+            return V5SerialPacket(COMPACT_PACKET_TYPE, data, (self.__capabilities & V5SerialComms.CAPABILITY_SCREEN_BOXES) != 0)
+        if self.__capabilities & V5SerialComms.CAPABILITY_TRACKS:
+            return V5SerialPacket(TRACKED_PACKET_TYPE, data)
+        return V5SerialPacket(self.__MAP_PACKET_TYPE, data)
+
+    def getReplyLayout(self):
+        # Bytes of a reply without detections and bytes added per detection, in the current reply format
+        empty = AIRecord(Position(0, 0, 0, 0, 0, 0, 0, 0), [])
+        single = AIRecord(empty.position, [Detection(0, 0, 0, ImageDetection(0, 0, 0, 0), MapDetection(0, 0, 0))])
+        fixedBytes = self.__makePacket(empty).serialSize()
+        return fixedBytes, self.__makePacket(single).serialSize() - fixedBytes
+
+    def setDetectionData(self, data: AIRecord):
+        # Encode the reply packet into the back buffer, then swap it to the front under the lock
+        self.__encodeLock.acquire()
         self.__detections = data
+        if self.__prioritizer is not None:
+            data = self.__prioritizer.prioritize(data, *self.__replyLayout)
+        packet = self.__makePacket(data)
+        back = 1 - self.__front
+        if len(self.__buffers[back]) < packet.serialSize():
+            self.__buffers[back] = bytearray(packet.serialSize())
+        length = packet.pack_into(self.__buffers[back])
+        self.__detectionLock.acquire()
+        self.__front = back
+        self.__frontLength = length
         self.__detectionLock.release()
+        self.__encodeLock.release()
+
+    def getStats(self):
+        # Returns a snapshot of the link health counters, see V5LinkStats
+        return self.__stats.getSnapshot()
 
     def stop(self):
         # Stop the thread by setting started flag to False and join the thread
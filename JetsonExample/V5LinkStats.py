@@ -0,0 +1,146 @@
+from bisect import bisect_right
+from collections import deque
+from threading import Lock
+import time
+
+
+class Histogram:
+    # Counts of values falling into fixed buckets, bounds are the upper edges of all but the last (open ended) bucket
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect_right(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        # Upper edge of the bucket holding the given percentile, the largest value seen for the open ended bucket
+        if self.total == 0:
+            return 0.0
+        rank = percent / 100.0 * self.total
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_JSON(self):
+        outData = {}
+        outData['bounds'] = self.bounds
+        outData['counts'] = list(self.counts)
+        outData['mean'] = self.sum / self.total if self.total > 0 else 0.0
+        outData['p50'] = self.percentile(50)
+        outData['p95'] = self.percentile(95)
+        outData['max'] = self.max
+        return outData
+
+
+class V5LinkStats:
+    # Health counters of one serial link (the V5 Brain or the GPS sensor).
+    # Updated by the link's serial thread and read by the web dashboard through getSnapshot(), so every access holds the lock.
+    # Rates and the link utilization are measured over the last WINDOW events.
+    WINDOW = 64
+    LATENCY_BOUNDS_MS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100]
+    SIZE_BOUNDS = [64, 128, 256, 512, 1024, 2048, 4096]
+
+    def __init__(self, baudRate = 115200):
+        self.baudRate = baudRate
+        self.__lock = Lock()
+        self.__startTime = time.time()
+        self.connects = 0
+        self.requests = 0         # Requests from the V5 Brain
+        self.coalesced = 0        # Requests answered by the reply of another request
+        self.replies = 0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.garbageBytes = 0     # Received bytes that were not part of a valid request or frame
+        self.resyncs = 0          # Times the reader had to drop data to find the next request or frame
+        self.frames = 0           # Valid GPS frames
+        self.validStatusFrames = 0
+        self.replyLatency = Histogram(V5LinkStats.LATENCY_BOUNDS_MS)
+        self.packetSize = Histogram(V5LinkStats.SIZE_BOUNDS)
+        self.__requestTimes = deque(maxlen=V5LinkStats.WINDOW)
+        self.__frameTimes = deque(maxlen=V5LinkStats.WINDOW)
+        self.__sent = deque(maxlen=V5LinkStats.WINDOW)  # (time, bytes) of every write
+
+    def recordConnect(self):
+        with self.__lock:
+            self.connects += 1
+
+    def recordReceived(self, byteCount):
+        with self.__lock:
+            self.bytesReceived += byteCount
+
+    def recordGarbage(self, byteCount):
+        # Bytes dropped while looking for the next request or frame
+        with self.__lock:
+            self.garbageBytes += byteCount
+            self.resyncs += 1
+
+    def recordRequests(self, count, timestamp = None):
+        # count requests arrived together, they all get a single reply
+        with self.__lock:
+            self.requests += count
+            self.coalesced += count - 1
+            now = time.time() if timestamp is None else timestamp
+            self.__requestTimes.extend([now] * min(count, V5LinkStats.WINDOW))
+
+    def recordReply(self, byteCount, latency):
+        # A reply of byteCount bytes was written, latency seconds after its request was read
+        with self.__lock:
+            self.replies += 1
+            self.bytesSent += byteCount
+            self.replyLatency.record(latency * 1000.0)
+            self.packetSize.record(byteCount)
+            self.__sent.append((time.time(), byteCount))
+
+    def recordFrame(self, validStatus, timestamp = None):
+        # A GPS frame of the right length arrived, validStatus tells if the sensor reported a usable position
+        with self.__lock:
+            self.frames += 1
+            if validStatus:
+                self.validStatusFrames += 1
+            self.__frameTimes.append(time.time() if timestamp is None else timestamp)
+
+    @staticmethod
+    def __rate(times):
+        # Events per second over the window
+        if len(times) < 2 or times[-1] <= times[0]:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    def getSnapshot(self):
+        # Returns a consistent copy of all counters as a JSON ready dictionary
+        with self.__lock:
+            outData = {}
+            outData['upTime'] = time.time() - self.__startTime
+            outData['connects'] = self.connects
+            outData['reconnects'] = max(self.connects - 1, 0)
+            outData['requests'] = self.requests
+            outData['coalesced'] = self.coalesced
+            outData['replies'] = self.replies
+            outData['requestRate'] = V5LinkStats.__rate(self.__requestTimes)
+            outData['bytesSent'] = self.bytesSent
+            outData['bytesReceived'] = self.bytesReceived
+            outData['garbageBytes'] = self.garbageBytes
+            outData['resyncs'] = self.resyncs
+            outData['frames'] = self.frames
+            outData['frameRate'] = V5LinkStats.__rate(self.__frameTimes)
+            outData['validStatusRatio'] = self.validStatusFrames / self.frames if self.frames > 0 else 0.0
+            outData['replyLatencyMs'] = self.replyLatency.to_JSON()
+            outData['packetSize'] = self.packetSize.to_JSON()
+
+            # Share of the link's capacity used for sending, a byte takes 10 bits on the wire (start, 8 data, stop)
+            utilization = 0.0
+            if len(self.__sent) >= 2 and self.__sent[-1][0] > self.__sent[0][0]:
+                sentBytes = sum(byteCount for _, byteCount in list(self.__sent)[1:])
+                utilization = sentBytes / (self.__sent[-1][0] - self.__sent[0][0]) / (self.baudRate / 10.0)
+            outData['linkUtilization'] = utilization
+            return outData
@@ -71,7 +71,7 @@ class MapPosition:
         CAMERAOFFSETY = self.CAMERAOFFSETY
         CAMERAOFFSETZ = self.CAMERAOFFSETZ
         CAMERAHEADINGOFFSET = self.CAMERAHEADINGOFFSET
-        CAMERAELEVATIONOFFSET = self.CAMERAHEADINGOFFSET
+        CAMERAELEVATIONOFFSET = self.CAMERAELEVATIONOFFSET
 
         # Create a rotation matrix using azimuth, elevation, and rotation
         rot = MapPosition.azel2rot(math.radians(position.azimuth - CAMERAHEADINGOFFSET), math.radians(position.elevation - CAMERAELEVATIONOFFSET), math.radians(position.rotation))
@@ -103,3 +103,30 @@ class MapPosition:
         
         return mapLocation
 
+    def computeRotation(self, position):
+        # Rotation matrix of the camera for a robot position, the same for every detection of a frame
+        return MapPosition.azel2rot(math.radians(position.azimuth - self.CAMERAHEADINGOFFSET),
+                                    math.radians(position.elevation - self.CAMERAELEVATIONOFFSET),
+                                    math.radians(position.rotation))
+
+    def computeMapLocations(self, screenPoints, position):
+        # Batched computeMapLocation: screenPoints is an (N, 3) array of screen x, screen y and depth of each detection
+        # (x and y being the detection centers). Returns the (N, 3) field locations. The rotation is built once for
+        # all detections and every detection is transformed by a single matrix multiplication.
+        screenPoints = np.asarray(screenPoints, dtype=np.float64).reshape(-1, 3)
+        rot = self.computeRotation(position)
+
+        # Object location vectors in camera space, one row per detection
+        depth = screenPoints[:, 2]
+        vectors = np.empty((len(screenPoints), 3))
+        vectors[:, 0] = depth * (screenPoints[:, 0] - self.MAXSCREENX) / self.REALDIST
+        vectors[:, 1] = depth
+        vectors[:, 2] = depth * (self.MAXSCREENY - screenPoints[:, 1]) / self.REALDIST
+
+        # Robot position plus the rotated camera offset (Z subtracted since the camera is higher than the center of the robot),
+        # shared by all detections
+        rotatedCameraOffset = rot @ np.array([self.CAMERAOFFSETX, self.CAMERAOFFSETY, self.CAMERAOFFSETZ])
+        translation = np.array([position.x + rotatedCameraOffset[0], position.y + rotatedCameraOffset[1], position.z - rotatedCameraOffset[2]])
+
+        # Rotate every vector to world space (rot @ vector for each row) and translate to world coordinates
+        return vectors @ rot.T + translation
@@ -1,10 +1,13 @@
+from bisect import bisect_right
 import struct
 import threading
 from threading import Lock
 import serial
 import time
 import math
-from filter import LiveFilter
+from filter import create_filter
+from telemetry import TelemetryLogger
+from V5LinkStats import V5LinkStats
 import numpy as np 
 
 class Position:
@@ -50,18 +53,96 @@ class Position:
         outData['rotation'] = self.rotation
         return outData
 
+class PoseHistory:
+    # The latest positions with their monotonic timestamps (seconds), to look up where the robot was at any moment,
+    # e.g. when a camera frame was captured. Positions are kept in a ring of capacity entries that is stored twice
+    # over, so the valid entries are always one contiguous run and bisect finds a timestamp in O(log n).
+    def __init__(self, capacity = 256, maxExtrapolation = 0.1):
+        # maxExtrapolation (seconds) limits how far past the newest position the motion is extrapolated
+        if capacity < 2:
+            raise Exception("Invalid argument: Pose history needs room for at least 2 positions")
+        self.capacity = capacity
+        self.maxExtrapolation = maxExtrapolation
+        self.__times = [0.0] * (2 * capacity)
+        self.__positions = [None] * (2 * capacity)
+        self.clear()
+
+    def clear(self):
+        self.__start = 0
+        self.__size = 0
+
+    def __len__(self):
+        return self.__size
+
+    def append(self, timestamp, position):
+        # Adds a position, timestamps must increase, an older or equal one is ignored and False is returned
+        if self.__size > 0 and timestamp <= self.__times[self.__start + self.__size - 1]:
+            return False
+        if self.__size == self.capacity:
+            self.__start = (self.__start + 1) % self.capacity
+            self.__size -= 1
+        index = (self.__start + self.__size) % self.capacity
+        self.__times[index] = self.__times[index + self.capacity] = timestamp
+        self.__positions[index] = self.__positions[index + self.capacity] = position
+        self.__size += 1
+        return True
+
+    def latestTime(self):
+        return self.__times[self.__start + self.__size - 1] if self.__size > 0 else None
+
+    def getPositionAt(self, timestamp):
+        # Position at timestamp, interpolated between the positions around it. Past the newest position the motion of
+        # the last two is continued for up to maxExtrapolation seconds, before the oldest the oldest is returned.
+        # None if the history is empty.
+        if self.__size == 0:
+            return None
+        first = self.__start
+        last = self.__start + self.__size - 1
+        index = bisect_right(self.__times, timestamp, first, last + 1)
+        if index == first:
+            return self.__positions[first]
+        if index > last:
+            if self.__size == 1 or timestamp == self.__times[last]:
+                return self.__positions[last]
+            index = last
+            timestamp = min(timestamp, self.__times[last] + self.maxExtrapolation)
+        before = self.__positions[index - 1]
+        after = self.__positions[index]
+        fraction = (timestamp - self.__times[index - 1]) / (self.__times[index] - self.__times[index - 1])
+        return PoseHistory.interpolate(before, after, fraction)
+
+    @staticmethod
+    def interpolate(before, after, fraction):
+        # Position fraction of the way from before to after (beyond after for fraction > 1), angles the short way around
+        def angle(a, b, low):
+            return (a + fraction * ((b - a + 180.0) % 360.0 - 180.0) - low) % 360.0 + low
+        # Status and frame count of the position the result is closest to
+        nearest = before if fraction < 0.5 else after
+        return Position(nearest.frameCount, nearest.status,
+                        before.x + fraction * (after.x - before.x),
+                        before.y + fraction * (after.y - before.y),
+                        before.z + fraction * (after.z - before.z),
+                        angle(before.azimuth, after.azimuth, 0.0),
+                        angle(before.elevation, after.elevation, -180.0),
+                        angle(before.rotation, after.rotation, -180.0))
+
+
 class V5GPS:
     # Packet type identifier
     __MAP_PACKET_TYPE = 0x0001
 
 
-    def __init__(self, port = None):
+    def __init__(self, port = None, telemetryFile = "filtered_data_simple.txt", gpsFilter = "mean", filterOptions = None, historySize = 256):
         # Initialization of GPS attributes including port, position, and offsets
+        # The filtered positions are logged to telemetryFile in the background, None turns the log off
+        # gpsFilter names the filter smoothing the readings, one of filter.FILTERS, filterOptions go to its constructor
+        # historySize positions (about 5 seconds at 50 Hz) are kept to look up where the robot was at a given time
         self.__dev = port
         self.__started = False
         self.__ser = None
         self.__isConnected = False
         self.__position = Position(0, 0, 0, 0, 0, 0, 0, 0)
+        self.__history = PoseHistory(historySize)
         self.__positionLock = Lock()
         self.__HEADINGOFFSET =  0 # Degree offset of gps
         # When x and y offsets are updated, offsets are automatically converted to meters
@@ -69,7 +150,9 @@ class V5GPS:
         self.__GPSYOFFSET = 0  # GPS offset in default units (meters) (Y-axis)
         self.__OFFSETUNITS = "meters"
 
-        self.__filter = LiveFilter(10)
+        self.__telemetry = TelemetryLogger(telemetryFile) if telemetryFile is not None else None
+        self.__filter = create_filter(gpsFilter, self.__telemetry, **(filterOptions or {}))
+        self.__stats = V5LinkStats(115200)
 
     def start(self):
         # Starts the GPS thread
@@ -108,15 +191,22 @@ class V5GPS:
                 self.__ser = serial.Serial(port, 115200, timeout=10)
                 self.__ser.flushInput()
                 self.__ser.flushOutput()
+                self.__stats.recordConnect()
 
                 self.__frameCount = 0
 
                 while self.__started:
                     # Read data from the serial port
                     data = self.__ser.read_until(b'\xCC\x33')
+                    timestamp = time.monotonic()
+                    self.__stats.recordReceived(len(data))
+                    if(len(data) != 16 and len(data) > 0):
+                        # Not a whole frame, the reader skipped to the next frame end
+                        self.__stats.recordGarbage(len(data))
                     if(len(data) == 16):
                         self.__frameCount = self.__frameCount + 1
                         status = data[1]
+                        self.__stats.recordFrame(status == 20)
                         x, y, z, az, el, rot = struct.unpack('<hhhhhh', data[2:14])
                         # Converts the data into meters and degrees
                         x = x / 10000.0
@@ -141,19 +231,19 @@ class V5GPS:
                         # print( x, y, z, az, el, rot, " status: ", hex(status), " Local Status: ", hex(localStatus))
                         
                         # Apply filter to smooth x, y, and azimuth
+                        # The filter only uses frames with a valid status (the sensor's Kalman estimate) and restarts after jumps
+                        pose = self.__filter.update_pose(x, y, az, timestamp, (localStatus & Position.STATUS_KALMAN_EST) != 0,
+                                                         (localStatus & Position.STATUS_POSJUMP) != 0,
+                                                         (localStatus & Position.STATUS_ANGLEJUMP) != 0)
 
                         #save data if it is valid
-                        if(status == 20):
-                            x, y = self.__filter.update(x, y)
+                        if(pose is not None):
+                            x, y, az = pose
+                            # A new Position every frame, so a Position handed out is never changed under its reader
+                            position = Position(self.__frameCount, localStatus, x, y, z, az, el, rot)
                             self.__positionLock.acquire()
-                            self.__position.x = x
-                            self.__position.y = y
-                            self.__position.z = z
-                            self.__position.azimuth = az
-                            self.__position.elevation = el
-                            self.__position.rotation = rot
-                            self.__position.status = localStatus
-                            self.__position.frameCount = self.__frameCount
+                            self.__position = position
+                            self.__history.append(timestamp, position)
                             self.__positionLock.release()
 
             # To close the serial port gracefully, use Ctrl+C to break the loop
@@ -162,12 +252,14 @@ class V5GPS:
                 self.__isConnected = False
                 time.sleep(1)
         
-            if(self.__ser.isOpen()):
+            if(self.__ser is not None and self.__ser.isOpen()):
                 self.__ser.close()
 
             self.__frameCount = 0
             self.__positionLock.acquire()
-            self.__position.status = 0
+            old = self.__position
+            self.__position = Position(old.frameCount, 0, old.x, old.y, old.z, old.azimuth, old.elevation, old.rotation)
+            self.__history.clear()  # Positions from before the reconnect say nothing about the robot now
             self.__positionLock.release()
 
         print("V5SerialComms thread stopped.")
@@ -179,10 +271,28 @@ class V5GPS:
         self.__positionLock.release()
 
         return nowPosition
+
+    def getPositionAt(self, timestamp):
+        # Position at timestamp (seconds on the time.monotonic() clock), interpolated between the GPS frames around it.
+        # The current position if there is no history yet, e.g. while the GPS is disconnected.
+        self.__positionLock.acquire()
+        position = self.__history.getPositionAt(timestamp)
+        if position is None:
+            position = self.__position
+        self.__positionLock.release()
+
+        return position
     
     def isConnected(self):
         # Checks if the GPS is connected
         return self.__isConnected
+
+    def getStats(self):
+        # Returns a snapshot of the link health counters, see V5LinkStats, and of the telemetry log
+        stats = self.__stats.getSnapshot()
+        if self.__telemetry is not None:
+            stats['telemetry'] = self.__telemetry.get_stats()
+        return stats
     
     def updateOffset(self, newOffset):
         # Updates the offset values for GPS data
@@ -0,0 +1,294 @@
+# Simulated V5 Brain and GPS sensor on pseudo terminals, to exercise V5SerialComms and V5GPS without hardware.
+# Each simulator opens a pty pair and hands the device path of one end to the serial class under test:
+#
+#   brain = BrainSimulator(rate=30)
+#   comms = V5SerialComms(brain.devicePath)
+#
+# Usage: python3 V5Simulator.py [--duration S] [--brain-rate HZ] [--gps-rate HZ] [--detections N] ...
+# runs both simulators against V5SerialComms and V5GPS and prints the link statistics of both sides as JSON.
+# With --serve it only prints the device paths and keeps running, e.g. for pushback.py --brain-port/--gps-port.
+#
+# A pty moves data as fast as it is written, so the simulators pace what they send and receive to --baud (115200 like
+# the real links, 10 bits per byte). Without that, latencies and V5SerialComms' link utilization would be far too
+# optimistic for large replies; --baud 0 turns the pacing off.
+from abc import ABC, abstractmethod
+import argparse
+import json
+import math
+import os
+import pty
+import random
+import select
+import struct
+import threading
+import time
+import tty
+from V5Comm import V5SerialPacket, COMPACT_PACKET_TYPE, MAP_PACKET_TYPE, TRACKED_PACKET_TYPE, AIRecord, crc32
+from V5LinkStats import Histogram, V5LinkStats
+
+
+class PtySimulator(ABC):
+    # Pty pair in raw mode, the simulator works on the master side and devicePath is the slave side for pyserial.
+    # With a baud rate, data is written and handed to the simulator in chunks of about a millisecond of wire time,
+    # each no earlier than the link could have carried it. A baud rate of 0 moves data as fast as the pty does.
+    def __init__(self, baud = 115200):
+        self.__master, self.__slave = pty.openpty()
+        tty.setraw(self.__master)
+        tty.setraw(self.__slave)
+        self.devicePath = os.ttyname(self.__slave)
+        self.baud = baud
+        self.__chunk = max(1, baud // 10000) if baud > 0 else 65536
+        self.__txFree = 0.0   # Time the outgoing wire is done with the bytes written so far
+        self.__rxFree = 0.0   # Same for the incoming wire
+        self.started = False
+        self.__thread = None
+
+    def __pace(self, free, count):
+        # Wait until count more bytes made it over a wire that is busy until free, return when the wire is free again
+        if self.baud <= 0:
+            return free
+        free = max(time.perf_counter(), free) + count * 10.0 / self.baud
+        time.sleep(max(0.0, free - time.perf_counter()))
+        return free
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            written = os.write(self.__master, view[:self.__chunk])
+            view = view[written:]
+            self.__txFree = self.__pace(self.__txFree, written)
+
+    def read(self, timeout):
+        # Whatever arrived within timeout seconds, or b"" if nothing did
+        ready, _, _ = select.select([self.__master], [], [], timeout)
+        if not ready:
+            return b""
+        data = os.read(self.__master, self.__chunk)
+        self.__rxFree = self.__pace(self.__rxFree, len(data))
+        return data
+
+    def start(self):
+        self.started = True
+        self.__thread = threading.Thread(target=self.run, args=())
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    @abstractmethod
+    def run(self):
+        # Simulator loop, runs on its own thread until started is cleared
+        pass
+
+    def stop(self):
+        self.started = False
+        if self.__thread is not None:
+            self.__thread.join()
+        os.close(self.__master)
+        os.close(self.__slave)
+
+
+class BrainSimulator(PtySimulator):
+    # Polls for detections like the V5 Brain's ai::jetson class: sends a request at rate Hz, waits up to timeout seconds
+    # for the reply and checks its sync bytes, length, type and CRC32.
+    def __init__(self, rate = 30.0, capabilities = 0x01, timeout = 0.25, baud = 115200):
+        super().__init__(baud)
+        self.rate = rate
+        self.capabilities = capabilities
+        self.timeout = timeout
+        self.__lock = threading.Lock()
+        self.requests = 0
+        self.packets = 0        # Good packets
+        self.errors = 0         # Packets with a bad length, type or CRC
+        self.timeouts = 0
+        self.bytesReceived = 0
+        self.detections = 0
+        self.firstByteLatency = Histogram(V5LinkStats.LATENCY_BOUNDS_MS)
+        self.packetLatency = Histogram(V5LinkStats.LATENCY_BOUNDS_MS)
+        self.lastRecord = None
+
+    def run(self):
+        request = "AA55CC33{:02X}\r\n".format(self.capabilities).encode()
+        nextRequest = time.perf_counter()
+        while self.started:
+            nextRequest += 1.0 / self.rate
+            self.write(request)
+            self.__receive(time.perf_counter())
+            self.requests += 1
+            time.sleep(max(0.0, nextRequest - time.perf_counter()))
+
+    def __receive(self, requestTime):
+        # Collect one reply, byte latencies measured from the request
+        data = bytearray()
+        firstByteTime = None
+        length = None
+        deadline = requestTime + self.timeout
+        while length is None or len(data) < V5SerialPacket.HEADER_SIZE + length:
+            remaining = deadline - time.perf_counter()
+            chunk = self.read(remaining) if remaining > 0 else b""
+            if len(chunk) == 0:
+                with self.__lock:
+                    self.timeouts += 1
+                return
+            if firstByteTime is None:
+                firstByteTime = time.perf_counter()
+            data += chunk
+            if length is None and len(data) >= V5SerialPacket.HEADER_SIZE:
+                sync = data.find(V5SerialPacket.HEADER)
+                if sync < 0:
+                    del data[:-3]
+                    continue
+                del data[:sync]
+                if len(data) >= V5SerialPacket.HEADER_SIZE:
+                    length = struct.unpack_from('<H', data, 4)[0]
+        doneTime = time.perf_counter()
+
+        packetType, crc = struct.unpack_from('<HI', data, 6)
+        payload = bytes(data[V5SerialPacket.HEADER_SIZE:V5SerialPacket.HEADER_SIZE + length])
+        record = self.__decode(packetType, payload) if crc32(payload) == crc else None
+        with self.__lock:
+            self.bytesReceived += len(data)
+            if record is None:
+                self.errors += 1
+                return
+            self.packets += 1
+            self.detections += len(record.detections)
+            self.lastRecord = record
+            self.firstByteLatency.record((firstByteTime - requestTime) * 1000.0)
+            self.packetLatency.record((doneTime - requestTime) * 1000.0)
+
+    @staticmethod
+    def __decode(packetType, payload):
+        # AIRecord of a payload whose length matches its detection count, None otherwise
+        try:
+            if packetType == COMPACT_PACKET_TYPE:
+                record = AIRecord.from_Compact(payload)
+                return record if record.compactSerialSize(payload[1] & AIRecord.COMPACT_SCREEN_BOXES != 0) == len(payload) else None
+            if packetType in (MAP_PACKET_TYPE, TRACKED_PACKET_TYPE):
+                count = struct.unpack_from('<i', payload, 0)[0]
+                record = AIRecord(None, [None] * count)
+                return record if record.serialSize(packetType == TRACKED_PACKET_TYPE) == len(payload) else None
+        except struct.error:
+            pass
+        return None
+
+    def getStats(self):
+        with self.__lock:
+            outData = {}
+            outData['requests'] = self.requests
+            outData['packets'] = self.packets
+            outData['errors'] = self.errors
+            outData['timeouts'] = self.timeouts
+            outData['bytesReceived'] = self.bytesReceived
+            outData['detectionsPerPacket'] = self.detections / self.packets if self.packets > 0 else 0.0
+            outData['firstByteLatencyMs'] = self.firstByteLatency.to_JSON()
+            outData['packetLatencyMs'] = self.packetLatency.to_JSON()
+            return outData
+
+
+class GPSSimulator(PtySimulator):
+    # Streams 16 byte GPS frames ending in CC 33 at rate Hz for a robot driving a circle of radius meters.
+    # noise is the standard deviation in meters added to x and y, corruption the probability of a frame losing a byte,
+    # garbage the probability of random bytes between frames and invalidStatus the probability of a frame with status 0.
+    VALID_STATUS = 20
+
+    def __init__(self, rate = 50.0, radius = 1.0, speed = 0.5, noise = 0.0, corruption = 0.0, garbage = 0.0, invalidStatus = 0.0, seed = 0,
+                 baud = 115200):
+        super().__init__(baud)
+        self.rate = rate
+        self.radius = radius
+        self.speed = speed  # Meters per second along the circle
+        self.noise = noise
+        self.corruption = corruption
+        self.garbage = garbage
+        self.invalidStatus = invalidStatus
+        self.random = random.Random(seed)
+        self.frames = 0
+        self.corrupted = 0
+
+    def pose(self, t):
+        # True x, y (meters) and heading (degrees) at time t seconds
+        angle = self.speed * t / self.radius
+        return self.radius * math.cos(angle), self.radius * math.sin(angle), math.degrees(angle + math.pi / 2) % 360
+
+    def frame(self, t):
+        x, y, heading = self.pose(t)
+        x += self.random.gauss(0, self.noise)
+        y += self.random.gauss(0, self.noise)
+        status = 0 if self.random.random() < self.invalidStatus else GPSSimulator.VALID_STATUS
+        # Heading in the signed 1/32768 half turns the sensor sends
+        az = int(round(heading / 180.0 * 32768.0))
+        az = az - 65536 if az >= 32768 else az
+        clamp = lambda value: max(-32768, min(32767, int(round(value * 10000))))
+        return bytes([0x00, status]) + struct.pack('<hhhhhh', clamp(x), clamp(y), 0, az, 0, 0) + b'\xCC\x33'
+
+    def run(self):
+        startTime = time.perf_counter()
+        nextFrame = startTime
+        while self.started:
+            nextFrame += 1.0 / self.rate
+            data = self.frame(time.perf_counter() - startTime)
+            if self.random.random() < self.corruption:
+                drop = self.random.randrange(2, 14)
+                data = data[:drop] + data[drop + 1:]
+                self.corrupted += 1
+            if self.random.random() < self.garbage:
+                data = bytes(self.random.randrange(256) for _ in range(self.random.randrange(1, 8))) + data
+                self.corrupted += 1
+            self.write(data)
+            self.frames += 1
+            time.sleep(max(0.0, nextFrame - time.perf_counter()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated V5 Brain and GPS sensor on pseudo terminals")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run")
+    parser.add_argument("--brain-rate", type=float, default=30, help="requests per second of the simulated Brain")
+    parser.add_argument("--baud", type=int, default=115200, help="baud rate both links are paced to, 0 for no pacing")
+    parser.add_argument("--capabilities", type=lambda value: int(value, 16), default=0x01, help="capability flags of the requests, hex")
+    parser.add_argument("--gps-rate", type=float, default=50, help="frames per second of the simulated GPS")
+    parser.add_argument("--gps-noise", type=float, default=0.005, help="position noise of the simulated GPS in meters")
+    parser.add_argument("--gps-corruption", type=float, default=0.01, help="probability of a GPS frame losing a byte")
+    parser.add_argument("--gps-garbage", type=float, default=0.01, help="probability of garbage bytes before a GPS frame")
+    parser.add_argument("--gps-invalid", type=float, default=0.05, help="probability of a GPS frame with an invalid status")
+    parser.add_argument("--detections", type=int, default=20, help="detections per frame fed to V5SerialComms")
+    parser.add_argument("--frame-rate", type=float, default=30, help="frames per second fed to V5SerialComms")
+    parser.add_argument("--serve", action="store_true", help="only run the simulators and print their device paths")
+    args = parser.parse_args()
+
+    brain = BrainSimulator(args.brain_rate, args.capabilities, baud=args.baud)
+    gps = GPSSimulator(args.gps_rate, noise=args.gps_noise, corruption=args.gps_corruption, garbage=args.gps_garbage,
+                       invalidStatus=args.gps_invalid, baud=args.baud)
+    if args.serve:
+        print(json.dumps({'brainPort': brain.devicePath, 'gpsPort': gps.devicePath}), flush=True)
+        brain.start()
+        gps.start()
+        time.sleep(args.duration)
+        print(json.dumps({'brain': brain.getStats(), 'gpsFrames': gps.frames}, indent=2))
+        exit(0)
+
+    from V5Comm import V5SerialComms, Detection, ImageDetection, MapDetection
+    from V5Position import V5GPS
+    comms = V5SerialComms(brain.devicePath)
+    v5Pos = V5GPS(gps.devicePath, None)
+    comms.start()
+    v5Pos.start()
+    time.sleep(0.5)  # Let both serial classes open their ports
+    brain.start()
+    gps.start()
+
+    endTime = time.perf_counter() + args.duration
+    while time.perf_counter() < endTime:
+        # Detections like the camera loop would produce them
+        detections = [Detection(i % 2, 0.9, 1.0 + i * 0.05, ImageDetection(10 * i, 20, 30, 30), MapDetection(0.1 * i, 0.5, 0.1), i, 3)
+                      for i in range(args.detections)]
+        comms.setDetectionData(AIRecord(v5Pos.getPosition(), detections))
+        time.sleep(1.0 / args.frame_rate)
+
+    brain.started = False
+    gps.started = False
+    time.sleep(0.3)
+    outData = {}
+    outData['brain'] = brain.getStats()
+    outData['serialLink'] = comms.getStats()
+    outData['gps'] = {'frames': gps.frames, 'corrupted': gps.corrupted}
+    outData['gpsLink'] = v5Pos.getStats()
+    print(json.dumps(outData, indent=2))
@@ -13,8 +13,9 @@ import os
 # Statistics object to report info the the websocket
 class Statistics:
     # A class to contain statistics data
-    def __init__(self, fps: float, invokeTime: float, cpuTemp: float, videoWidth: int, videoHeight: int, runTime: int, gpsConnected: bool):
-        # Initialize statistics attributes such as FPS, CPU temperature, video dimensions, runtime, and GPS connection status
+    def __init__(self, fps: float, invokeTime: float, cpuTemp: float, videoWidth: int, videoHeight: int, runTime: int, gpsConnected: bool, skipRatio: float = 0.0):
+        # Initialize statistics attributes such as FPS, CPU temperature, video dimensions, runtime, GPS connection status
+        # and the fraction of frames that skipped inference because the scene did not change
         self.fps = fps
         self.invokeTime = invokeTime
         self.cpuTemp = cpuTemp
@@ -22,15 +23,21 @@ class Statistics:
         self.videoHeight = videoHeight
         self.runTime = runTime
         self.gpsConnected = gpsConnected
+        self.skipRatio = skipRatio
 
 class V5WebData:
 
     __DEFAULT_PORT = 3030
 
-    def __init__(self, v5Map, v5Pos, image_processor, port = None):
+    def __init__(self, v5Map, v5Pos, image_processor, port = None, previewScale = 1.0, v5Comms = None):
         # Constructor that initializes the server, offsets, and communication instances.
         # v5Map and v5Pos are objects to update the Intel RealSense Camera and GPS offsets.
+        # The link health of v5Pos and v5Comms (the V5 Brain link) is reported with the statistics
+        # previewScale shrinks the color and depth previews sent to the dashboard, e.g. 0.5 for half the resolution
         self.__serverPort = V5WebData.__DEFAULT_PORT
+        if previewScale <= 0:
+            raise Exception("Invalid argument: Preview scale must be positive")
+        self.__previewScale = previewScale
 
         if(port != None):
             self.__serverPort = port
@@ -48,6 +55,7 @@ class V5WebData:
         self.__v5Map = v5Map
         self.__v5Pos = v5Pos
         self.__image_processor = image_processor
+        self.__v5Comms = v5Comms
         # We host at 0.0.0.0 to broadcast to all IP addresses, so to connect from an external connection, it would be port 3030 at the IP address of the device running V5Web.py
         self.__server = WebsocketServer(host = '0.0.0.0', port = self.__serverPort, loglevel = logging.INFO) 
         self.__server.set_fn_new_client(self.__new_client)
@@ -59,6 +67,9 @@ class V5WebData:
         self.__detections = AIRecord(Position(0, 0, 0, 0, 0, 0, 0, 0), [])
         self.__colorImage = None 
         self.__depthImage = None 
+        # Encoded previews of the current images, built on the first request for them and reused until the next frame
+        self.__colorElement = None
+        self.__depthElement = None
         self.__stats = Statistics(0, 0, 0, 0, 0, 0, False)
         self.__dataLock = Lock()
 
@@ -98,7 +109,13 @@ class V5WebData:
         outData['VideoHeight'] = nowStats.videoHeight
         outData['RunTime'] = nowStats.runTime
         outData['GPSConnected'] = nowStats.gpsConnected
+        outData['SkipRatio'] = nowStats.skipRatio
         outData['CPUTempurature'] = nowStats.cpuTemp
+        # Link counters are only gathered when the dashboard asks for them
+        if(self.__v5Comms is not None):
+            outData['SerialLink'] = self.__v5Comms.getStats()
+        if(self.__v5Pos is not None):
+            outData['GPSLink'] = self.__v5Pos.getStats()
 
         return outData
     
@@ -133,20 +150,23 @@ class V5WebData:
 
         return outList
     
-    def __getColorElement(self):
-        # Returns the color image data encoded in base64
+    @staticmethod
+    def encodeImageElement(pixelData, swapRedBlue, scale = 1.0):
+        # Returns an image encoded as base64 JPEG the way the dashboard expects it
+        # swapRedBlue converts RGB images to the BGR order used by OpenCV before encoding
+        # scale shrinks the encoded image, Width and Height stay those of the full image since detections are given in its pixels
         outData = {}
         imageData = {}
-        
-        self.__dataLock.acquire()
-        pixelData = self.__colorImage
-        self.__dataLock.release()
 
-        if(len(pixelData) > 0):
+        if(pixelData is not None and len(pixelData) > 0):
             imageData['Valid'] = True
             imageData['Width'] = pixelData.shape[1]
             imageData['Height'] = pixelData.shape[0]
-            buffer = cv2.imencode(".jpeg", cv2.cvtColor(pixelData, cv2.COLOR_BGR2RGB))[1]
+            if scale != 1.0:
+                pixelData = cv2.resize(pixelData, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            if swapRedBlue:
+                pixelData = cv2.cvtColor(pixelData, cv2.COLOR_BGR2RGB)
+            buffer = cv2.imencode(".jpeg", pixelData)[1]
             imageData['Data'] = base64.b64encode(buffer).decode('utf-8')
         else:
             imageData['Valid'] = False
@@ -155,28 +175,53 @@ class V5WebData:
         outData['Image'] = imageData
 
         return outData
+
+    @staticmethod
+    def colorizeDepth(depthImage, scale = 1.0):
+        # Returns a raw depth image as a color mapped preview, shrunk by scale before coloring
+        if depthImage is None or len(depthImage) == 0:
+            return depthImage
+        if scale != 1.0:
+            # Nearest neighbour keeps invalid (zero) depth pixels from blending into valid ones
+            depthImage = cv2.resize(depthImage, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+        depthImage = cv2.normalize(depthImage, None, alpha=0.01, beta=255, norm_type=cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+        return cv2.applyColorMap(depthImage, cv2.COLORMAP_JET)
+
+    def __getColorElement(self):
+        # Returns the color image data encoded in base64, encoding it only once per frame
+        self.__dataLock.acquire()
+        pixelData = self.__colorImage
+        element = self.__colorElement
+        self.__dataLock.release()
+
+        if element is None:
+            element = V5WebData.encodeImageElement(pixelData, True, self.__previewScale)
+            self.__dataLock.acquire()
+            # Keep the encoding unless a new frame arrived in the meantime
+            if self.__colorImage is pixelData:
+                self.__colorElement = element
+            self.__dataLock.release()
+        return element
     
     def __getDepthElement(self):
-        # Returns the depth image data encoded in base64
-        outData = {}
-        imageData = {}
-        
+        # Returns the color mapped depth image encoded in base64, coloring and encoding it only once per frame
         self.__dataLock.acquire()
         pixelData = self.__depthImage
+        element = self.__depthElement
         self.__dataLock.release()
 
-        if(len(pixelData) > 0):
-            imageData['Valid'] = True
-            imageData['Width'] = pixelData.shape[1]
-            imageData['Height'] = pixelData.shape[0]
-            imageData['Data'] = base64.b64encode(np.array(cv2.imencode(".jpeg", pixelData)[1]).tobytes()).decode('utf-8')
-        else:
-            imageData['Valid'] = False
-            imageData['Error'] = "Image Unavailable"
-
-        outData['Image'] = imageData
-
-        return outData
+        if element is None:
+            preview = V5WebData.colorizeDepth(pixelData, self.__previewScale)
+            element = V5WebData.encodeImageElement(preview, False)
+            if element['Image']['Valid']:
+                # Report the full image size like the color preview does
+                element['Image']['Width'] = pixelData.shape[1]
+                element['Image']['Height'] = pixelData.shape[0]
+            self.__dataLock.acquire()
+            if self.__depthImage is pixelData:
+                self.__depthElement = element
+            self.__dataLock.release()
+        return element
 
     def __message_received(self, client, server, message):
         # Callback function for receiving a message from the client
@@ -252,15 +297,17 @@ class V5WebData:
         self.__dataLock.release()
 
     def setColorImage(self, image):
-        # Updates the color image data
+        # Updates the color image data, the preview is only encoded once a client asks for it
         self.__dataLock.acquire()
         self.__colorImage = image
+        self.__colorElement = None
         self.__dataLock.release()
 
     def setDepthImage(self, image):
-        # Updates the depth image data
+        # Updates the raw depth image data, the color mapped preview is only built once a client asks for it
         self.__dataLock.acquire()
         self.__depthImage = image
+        self.__depthElement = None
         self.__dataLock.release()
 
     def setStatistics(self, stats: Statistics):
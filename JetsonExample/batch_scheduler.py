@@ -0,0 +1,125 @@
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+
+class BatchScheduler:
+    # Collects inference requests from any number of callers into micro-batches for a ModelBackend.
+    # A batch is dispatched as soon as max_batch_size requests are pending, or max_delay seconds after
+    # the oldest pending request arrived, whichever comes first. Each caller gets its own outputs back.
+    #
+    # Requests are written straight into one of two batch buffers: callers fill one while the
+    # backend runs the other, so a request never waits for more than one batch in front of it.
+    def __init__(self, backend, max_batch_size=None, max_delay=0.005):
+        batch_sizes = sorted(size for size in backend.batch_sizes if max_batch_size is None or size <= max_batch_size)
+        if len(batch_sizes) == 0:
+            raise Exception("Invalid argument: Backend does not support a batch size up to " + str(max_batch_size))
+        self.backend = backend
+        self.batch_sizes = batch_sizes
+        self.max_batch_size = batch_sizes[-1]
+        self.max_delay = max_delay
+
+        input_shape = backend.input_buffer.shape[1:]
+        self.__buffers = [np.zeros((self.max_batch_size,) + input_shape, dtype=backend.input_buffer.dtype) for _ in range(2)]
+        self.__filling = 0
+        self.__pending = []
+        self.__firstRequestTime = 0
+        self.__cond = threading.Condition()
+        self.__started = False
+        self.__thread = None
+
+        # Statistics
+        self.batches = 0
+        self.requests = 0
+
+    def start(self):
+        self.__started = True
+        self.__thread = threading.Thread(target=self.__run, args=())
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def submit(self, fill):
+        # Queue one image and return a Future with its list of outputs.
+        # fill(slot) must write the preprocessed image into slot, a (1, height, width, 3) view of the next batch.
+        # It runs while the batch is locked, so preprocessing scratch buffers can be shared between callers.
+        future = Future()
+        with self.__cond:
+            while len(self.__pending) >= self.max_batch_size and self.__started:
+                self.__cond.wait()
+            if not self.__started:
+                future.set_exception(Exception("Batch scheduler is not running"))
+                return future
+            index = len(self.__pending)
+            fill(self.__buffers[self.__filling][index:index + 1])
+            if index == 0:
+                self.__firstRequestTime = time.perf_counter()
+            self.__pending.append(future)
+            self.__cond.notify_all()
+        return future
+
+    def submit_image(self, image):
+        # Queue an already preprocessed (1, height, width, 3) image, which is copied into the batch
+        return self.submit(lambda slot: np.copyto(slot, image.reshape(slot.shape)))
+
+    def __run(self):
+        while self.__started:
+            with self.__cond:
+                # Wait for the first request, then for a full batch or the deadline of the oldest request
+                while not self.__pending and self.__started:
+                    self.__cond.wait()
+                deadline = self.__firstRequestTime + self.max_delay
+                while len(self.__pending) < self.max_batch_size and self.__started:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self.__cond.wait(remaining)
+                if not self.__pending:
+                    continue
+
+                buffer = self.__buffers[self.__filling]
+                futures = self.__pending
+                self.__pending = []
+                self.__filling = 1 - self.__filling
+                self.__cond.notify_all()
+
+            self.__dispatch(buffer, futures)
+
+        # Fail anything still waiting so callers don't block forever
+        with self.__cond:
+            for future in self.__pending:
+                future.set_exception(Exception("Batch scheduler stopped"))
+            self.__pending = []
+
+    def __dispatch(self, buffer, futures):
+        # Run the smallest supported batch that holds every request, padding slots are left as they are
+        count = len(futures)
+        batch = next(size for size in self.batch_sizes if size >= count)
+        try:
+            outputs = self.backend.inference(buffer[:batch])
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        # Scatter, copying each image's rows since the backend reuses its output buffers
+        outputs = [np.reshape(output, (batch, -1)) for output in outputs]
+        for i, future in enumerate(futures):
+            future.set_result([output[i].copy() for output in outputs])
+
+        self.batches += 1
+        self.requests += count
+
+    def getStats(self):
+        outData = {}
+        outData['batches'] = self.batches
+        outData['requests'] = self.requests
+        outData['avgBatchSize'] = self.requests / self.batches if self.batches > 0 else 0.0
+        return outData
+
+    def stop(self):
+        with self.__cond:
+            self.__started = False
+            self.__cond.notify_all()
+        if self.__thread is not None:
+            self.__thread.join()
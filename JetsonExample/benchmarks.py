@@ -0,0 +1,589 @@
+# Micro benchmarks for the performance sensitive helpers of the detection pipeline.
+# These run without a camera, accelerator, V5 Brain or GPS attached.
+#
+# Usage: python3 benchmarks.py <name> [--repeat N]
+import argparse
+import struct
+import time
+import numpy as np
+
+
+def time_call(function, repeat):
+    # Return the average run time of function() in seconds
+    function()  # Warm up
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start_time) / repeat
+
+
+def random_candidates(count, rng, num_categories=2):
+    # Candidate boxes in x, y, width, height format clustered around a few objects, like a crowded frame would give
+    centers = rng.uniform(0, 600, size=(max(1, count // 8), 2))
+    boxes = np.empty((count, 4), dtype=np.float32)
+    boxes[:, :2] = centers[rng.integers(0, len(centers), count)] + rng.normal(0, 6, size=(count, 2))
+    boxes[:, 2:] = rng.uniform(20, 60, size=(count, 2))
+    confidences = rng.uniform(0.5, 1.0, size=count).astype(np.float32)
+    categories = rng.integers(0, num_categories, size=count)
+    return boxes, confidences, categories
+
+
+def benchmark_nms(repeat):
+    # Compare the per-category while loop NMS with the batched NMS for increasing candidate counts
+    from data_processing import PostprocessYOLO, batched_nms
+
+    postprocessor = PostprocessYOLO([], [], [0.5], 0.5, (320, 320))
+    rng = np.random.default_rng(0)
+
+    def per_category(boxes, confidences, categories):
+        keep = list()
+        for category in set(categories):
+            idxs = np.where(categories == category)[0]
+            keep.append(idxs[postprocessor._nms_boxes(boxes[idxs], confidences[idxs])])
+        return np.concatenate(keep)
+
+    print("{:>10} {:>14} {:>14} {:>8} {:>6}".format("candidates", "loop (us)", "batched (us)", "speedup", "same"))
+    for count in (10, 25, 50, 100, 200, 500, 1000):
+        boxes, confidences, categories = random_candidates(count, rng)
+        same = np.array_equal(per_category(boxes, confidences, categories),
+                              batched_nms(boxes, confidences, categories, 0.5))
+        loop_time = time_call(lambda: per_category(boxes, confidences, categories), repeat)
+        batched_time = time_call(lambda: batched_nms(boxes, confidences, categories, 0.5), repeat)
+        print("{:>10} {:>14.1f} {:>14.1f} {:>7.1f}x {:>6}".format(
+            count, loop_time * 1e6, batched_time * 1e6, loop_time / batched_time, str(same)))
+
+
+def random_int8_output(grid_hw, rng, objects=6):
+    # Quantized YOLO output for one scale with mostly background cells and a few confident objects
+    output = rng.integers(-128, -60, size=(grid_hw[0], grid_hw[1], 3, 7), dtype=np.int8)
+    output[..., :4] = rng.integers(-40, 40, size=(grid_hw[0], grid_hw[1], 3, 4), dtype=np.int8)
+    cells = rng.integers(0, grid_hw[0] * grid_hw[1] * 3, size=objects)
+    flat = output.reshape(-1, 7)
+    flat[cells, 4:] = rng.integers(-20, 127, size=(objects, 3), dtype=np.int8)
+    return output
+
+
+def benchmark_int8(repeat):
+    # Compare decoding int8 outputs through lookup tables with dequantizing them for the float decoder.
+    # Fails if the two decoders keep different boxes or classes, or their values differ by more than float rounding.
+    from data_processing import YOLODecoder, QuantizedYOLODecoder
+
+    rng = np.random.default_rng(0)
+    anchors = [(81, 82), (135, 169), (344, 319)]
+    quantization = (0.0625, -10)  # Typical output scale of the Edge TPU model
+
+    print("{:>8} {:>12} {:>12} {:>8} {:>6} {:>10}".format("grid", "float (us)", "int8 (us)", "speedup", "same", "max error"))
+    for grid_hw in ((10, 10), (20, 20), (40, 40)):
+        output = random_int8_output(grid_hw, rng)
+        float_decoder = YOLODecoder(grid_hw, anchors, [0.5, 0.5], (320, 320))
+        int8_decoder = QuantizedYOLODecoder(grid_hw, anchors, [0.5, 0.5], (320, 320), quantization)
+
+        def dequantized():
+            return float_decoder.decode((output.astype(np.float32) - quantization[1]) * np.float32(quantization[0]))
+
+        float_boxes, float_classes, float_scores = dequantized()
+        int8_boxes, int8_classes, int8_scores = int8_decoder.decode(output)
+        same = len(float_boxes) == len(int8_boxes) and np.array_equal(float_classes, int8_classes)
+        error = max(np.abs(float_boxes - int8_boxes).max(initial=0), np.abs(float_scores - int8_scores).max(initial=0)) if same else float("nan")
+
+        float_time = time_call(dequantized, repeat)
+        int8_time = time_call(lambda: int8_decoder.decode(output), repeat)
+        print("{:>8} {:>12.1f} {:>12.1f} {:>7.1f}x {:>6} {:>10.2e}".format(
+            "{}x{}".format(*grid_hw), float_time * 1e6, int8_time * 1e6, float_time / int8_time, str(same), error))
+        assert same, "int8 decoder kept different detections than the float decoder on a {}x{} grid".format(*grid_hw)
+        assert error <= 1e-4, "int8 decoder differs from the float decoder by {:.2e} on a {}x{} grid".format(error, *grid_hw)
+
+
+def benchmark_preprocess(repeat):
+    # Check PreprocessYOLO.process_into on the CPU for every input buffer type a backend may own, and time it.
+    # Fails if an output differs from the reference conversion, or the result is not written into the given buffer
+    # without allocating an image sized array (NumPy's small casting buffer of the float conversion is fine).
+    import cv2
+    import tracemalloc
+    from data_processing import PreprocessYOLO
+
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, size=(480, 640, 3), dtype=np.uint8)
+    preprocessor = PreprocessYOLO((320, 320))
+    resized = cv2.resize(image, (320, 320), interpolation=cv2.INTER_AREA)
+    references = {
+        np.float32: resized.astype(np.float32) / np.float32(255.0),
+        # The old int8 path cast the uint8 image to int8 and subtracted 128, both wrapping around
+        np.int8: (resized.astype(np.int8).astype(np.int16) - 128).astype(np.int8),
+        np.uint8: resized,
+    }
+
+    print("{:>8} {:>10} {:>6} {:>14}".format("buffer", "time (us)", "same", "allocated (B)"))
+    for dtype, reference in references.items():
+        buffer = np.zeros((1, 320, 320, 3), dtype=dtype)
+        preprocessor.process_into(image, buffer)  # Warm up
+        tracemalloc.start()
+        result = preprocessor.process_into(image, buffer)
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        same = result is buffer and np.array_equal(buffer[0], reference)
+        print("{:>8} {:>10.1f} {:>6} {:>14}".format(
+            np.dtype(dtype).name, time_call(lambda: preprocessor.process_into(image, buffer), repeat) * 1e6, str(same), allocated))
+        assert result is buffer, "process_into did not return the buffer it was given for " + np.dtype(dtype).name
+        assert np.array_equal(buffer[0], reference), "process_into output differs from the reference for " + np.dtype(dtype).name
+        assert allocated < buffer.nbytes // 4, "process_into allocated {} bytes for {}".format(allocated, np.dtype(dtype).name)
+
+
+def benchmark_tracker(repeat):
+    # Time the association of a frame's detections with the tracks, for up to MAX_DETECTIONS objects
+    import tracker
+    from model import rawDetection
+
+    rng = np.random.default_rng(0)
+
+    def make_detections(boxes, categories):
+        return [rawDetection(int(x), int(y), [x, y], int(w), int(h), 0.9, int(c)) for (x, y, w, h), c in zip(boxes, categories)]
+
+    print("{:>8} {:>14} {:>14} {:>14} {:>6}".format("objects", "update (us)", "scipy (us)", "numpy (us)", "same"))
+    for count in (5, 10, 25, 50):
+        boxes, _, categories = random_candidates(count, rng)
+        moved = boxes + rng.normal(0, 3, size=boxes.shape).astype(np.float32)
+        mot = tracker.MultiObjectTracker()
+        mot.update(make_detections(boxes, categories), 0.0)
+        detections = make_detections(moved, categories)
+        cost = mot.association_cost(mot.predicted_boxes(0.033), moved, categories)
+
+        def update():
+            # Associate against a copy so every iteration sees the same tracks
+            state = tracker.MultiObjectTracker()
+            state.__dict__.update({key: value.copy() if isinstance(value, np.ndarray) else value for key, value in mot.__dict__.items()})
+            state.update(detections, 0.033)
+
+        solvers = {}
+        for use_scipy in (True, False):
+            if use_scipy and not tracker.USE_SCIPY:
+                solvers[use_scipy] = (float("nan"), None)
+                continue
+            saved, tracker.USE_SCIPY = tracker.USE_SCIPY, use_scipy
+            rows, columns = tracker.linear_assignment(cost, 2.0)
+            solvers[use_scipy] = (time_call(lambda: tracker.linear_assignment(cost, 2.0), repeat), cost[rows, columns].sum())
+            tracker.USE_SCIPY = saved
+        same = solvers[True][1] is None or np.isclose(solvers[True][1], solvers[False][1])
+        print("{:>8} {:>14.1f} {:>14.1f} {:>14.1f} {:>6}".format(
+            count, time_call(update, repeat) * 1e6, solvers[True][0] * 1e6, solvers[False][0] * 1e6, str(same)))
+
+
+def synthetic_registration():
+    # Registration for a RealSense like camera pair without a camera attached: the color camera sits 15mm to the side of
+    # the depth camera, slightly rotated, with a different focal length. The depth image is a floor sloping away from
+    # the camera with a box standing 0.8m in front of it.
+    from types import SimpleNamespace
+    from registration import Registration
+
+    depth_intrin = SimpleNamespace(width=640, height=480, ppx=320.5, ppy=239.7, fx=385.2, fy=385.2)
+    color_intrin = SimpleNamespace(width=640, height=480, ppx=321.2, ppy=242.3, fx=610.98, fy=610.98)
+    angle = np.radians(0.5)
+    rotation = np.array([[np.cos(angle), 0, np.sin(angle)], [0, 1, 0], [-np.sin(angle), 0, np.cos(angle)]])
+    extrin = SimpleNamespace(rotation=rotation.T.reshape(-1).tolist(), translation=[-0.015, 0.0001, 0.0002])  # Column major
+
+    rows = np.arange(480)[:, None]
+    depth = np.broadcast_to(1.2 + (480 - rows) * 0.004, (480, 640)).copy()
+    depth[200:320, 260:380] = 0.8
+    depth[::37, ::23] = 0  # Missing readings
+    depth_image = np.round(depth / 0.001).astype(np.uint16)
+    return Registration(depth_intrin, color_intrin, extrin), depth_image, rotation, np.array(extrin.translation)
+
+
+def benchmark_registration(repeat):
+    # Check the registration against exact projections and time detection lookups and full frame alignment.
+    # Fails if a mapping is off by more than 0.1 px at a known depth or 0.5 px (p95) when the depth is looked up.
+    registration, depth_image, rotation, translation = synthetic_registration()
+    rng = np.random.default_rng(0)
+
+    # Ground truth: deproject depth pixels, move them into the color camera and project them there
+    depth_pixels = np.stack([rng.uniform(40, 600, 2000), rng.uniform(40, 440, 2000)], axis=-1)
+    z = depth_image[np.rint(depth_pixels[:, 1]).astype(int), np.rint(depth_pixels[:, 0]).astype(int)] * 0.001
+    depth_pixels, z = depth_pixels[z > 0], z[z > 0]
+    points = np.concatenate(((depth_pixels - registration.depth_center) / registration.depth_focal, np.ones((len(z), 1))), axis=-1) * z[:, None]
+    points = (points - translation) @ rotation  # Inverse of R * p + t
+    color_pixels = points[:, :2] / points[:, 2:3] * registration.color_focal + registration.color_center
+
+    exact = np.abs(registration.color_to_depth(color_pixels, z) - depth_pixels).max()
+    looked_up = np.linalg.norm(registration.color_to_depth(color_pixels, depth_image=depth_image) - depth_pixels, axis=-1)
+    print("known depth max error: {:.2e} px".format(exact))
+    print("depth image lookup error: median {:.2f} px, p95 {:.2f} px".format(np.median(looked_up), np.percentile(looked_up, 95)))
+    assert exact <= 0.1, "Registration at a known depth is off by {:.2e} px".format(exact)
+    assert np.percentile(looked_up, 95) <= 0.5, "Registration through the depth image is off by {:.2f} px (p95)".format(np.percentile(looked_up, 95))
+
+    boxes = np.stack([rng.uniform(0, 600, 100), rng.uniform(0, 440, 100)], axis=-1)
+    print("{:>28} {:>12}".format("operation", "time (us)"))
+    print("{:>28} {:>12.1f}".format("lookup 2 corners x 50 boxes", time_call(lambda: registration.color_to_depth(boxes, depth_image=depth_image), repeat) * 1e6))
+    print("{:>28} {:>12.1f}".format("align", time_call(lambda: registration.align(depth_image, refine=False), repeat) * 1e6))
+    print("{:>28} {:>12.1f}".format("align refined", time_call(lambda: registration.align(depth_image), repeat) * 1e6))
+
+
+def benchmark_depth(repeat):
+    # Compare the batched median depth estimate with the old per detection mean of the valid depth pixels
+    from depth_estimator import DepthEstimator
+    _, depth_image, _, _ = synthetic_registration()
+    estimator = DepthEstimator(0.001)
+    rng = np.random.default_rng(0)
+
+    def mean_depths(rois):
+        depths = []
+        for r1, c1, r2, c2 in rois:
+            region = depth_image[r1:r2, c1:c2] * 0.001
+            depths.append(np.nanmean(region[region != 0]) if np.any(region != 0) else np.nan)
+        return depths
+
+    # Regions straddling the 0.8m box's left edge, a quarter of their pixels see the floor behind it
+    straddling = np.array([[240, 255, 260, 275], [220, 256, 240, 276], [280, 255, 300, 275]])
+    depths, confidence = estimator.estimate(depth_image, straddling)
+    mean_error = np.abs(np.array(mean_depths(straddling)) - 0.8).max()
+    print("edge regions: mean error {:.3f} m, median error {:.3f} m, confidence {}".format(
+        mean_error, np.abs(depths - 0.8).max(), np.round(confidence, 2).tolist()))
+    print("empty region: depth {}, confidence {}".format(*estimator.estimate(depth_image, [[10, 10, 10, 20]])))
+
+    print("{:>8} {:>16} {:>16}".format("boxes", "mean loop (us)", "batched (us)"))
+    for count in (1, 10, 50):
+        corners = np.stack([rng.integers(0, 460, count), rng.integers(0, 620, count)], axis=-1)
+        rois = np.concatenate([corners, corners + rng.integers(2, 20, size=(count, 2))], axis=-1)
+        print("{:>8} {:>16.1f} {:>16.1f}".format(
+            count, time_call(lambda: mean_depths(rois), repeat) * 1e6, time_call(lambda: estimator.estimate(depth_image, rois), repeat) * 1e6))
+
+
+def benchmark_map(repeat):
+    # Compare the batched camera to field transform with one computeMapLocation call per detection
+    from types import SimpleNamespace
+    from V5MapPosition import MapPosition
+    from V5Position import Position
+    v5Map = MapPosition()
+    v5Map.updateOffset(SimpleNamespace(x=12.0, y=-4.0, z=30.0, unit="cm", heading_offset=8.0, elevation_offset=-15.0))
+    position = Position(1, Position.STATUS_CONNECTED, 0.4, -0.7, 0.2, 37.0, 2.0, -1.0)
+    rng = np.random.default_rng(0)
+
+    print("{:>8} {:>18} {:>16} {:>12}".format("boxes", "per detection (us)", "batched (us)", "max diff (m)"))
+    for count in (1, 10, 50):
+        screenPoints = np.stack([rng.uniform(0, 640, count), rng.uniform(0, 480, count), rng.uniform(0.3, 4.0, count)], axis=-1)
+        detections = [SimpleNamespace(Center=point[:2]) for point in screenPoints]
+
+        def per_detection():
+            return [v5Map.computeMapLocation(detection, point[2], position) for detection, point in zip(detections, screenPoints)]
+
+        difference = np.abs(np.concatenate(per_detection(), axis=1).T - v5Map.computeMapLocations(screenPoints, position)).max()
+        print("{:>8} {:>18.1f} {:>16.1f} {:>12.1e}".format(
+            count, time_call(per_detection, repeat) * 1e6, time_call(lambda: v5Map.computeMapLocations(screenPoints, position), repeat) * 1e6, difference))
+
+
+def crc32_table():
+    # Lookup table of the byte by byte CRC32 below
+    table = []
+    for i in range(256):
+        crc_accum = i << 24
+        for _ in range(8):
+            crc_accum = ((crc_accum << 1) ^ 0x04C11DB7) if crc_accum & 0x80000000 else (crc_accum << 1)
+        table.append(crc_accum & 0xFFFFFFFF)
+    return table
+
+
+CRC32_TABLE = crc32_table()
+
+
+def reference_crc32(data, accumulator=0):
+    # The byte by byte CRC32 the V5 Brain's decoder implements, to check V5Comm.crc32 against
+    for byte in data:
+        accumulator = ((accumulator << 8) ^ CRC32_TABLE[((accumulator >> 24) ^ byte) & 0xFF]) & 0xFFFFFFFF
+    return accumulator
+
+
+def random_record(count, rng):
+    # AIRecord with count random detections
+    import V5Comm
+    from V5Position import Position
+    detections = [V5Comm.Detection(int(rng.integers(0, 2)), float(rng.uniform(0.5, 1)), float(rng.uniform(0.3, 4)),
+                                   V5Comm.ImageDetection(*[int(v) for v in rng.integers(0, 640, 4)]),
+                                   V5Comm.MapDetection(*[float(v) for v in rng.uniform(-1.8, 1.8, 3)]), int(rng.integers(0, 1000)), int(rng.integers(0, 100)))
+                  for _ in range(count)]
+    return V5Comm.AIRecord(Position(12, Position.STATUS_CONNECTED, 0.4, -0.7, 0.2, 37.0, 2.0, -1.0), detections)
+
+
+def benchmark_packet(repeat):
+    # Check the CRC against the byte by byte algorithm and time building a serial packet
+    import V5Comm
+    rng = np.random.default_rng(0)
+    mismatches = 0
+    for size in list(range(0, 64)) + [1000, 4096]:
+        data = rng.integers(0, 256, size, dtype=np.uint8).tobytes()
+        accumulator = int(rng.integers(0, 2 ** 32))
+        mismatches += V5Comm.crc32(data) != reference_crc32(data) or V5Comm.crc32(data, accumulator) != reference_crc32(data, accumulator)
+    print("CRC mismatches against the byte by byte algorithm: {}".format(mismatches))
+
+    def reference_packet(record, packet_type=V5Comm.MAP_PACKET_TYPE):
+        # The packet as it used to be built: the record serialized per field, once for the length, once for the CRC and once for the payload
+        def serialize():
+            data = struct.pack('<i', len(record.detections)) + record.position.to_Serial()
+            for det in record.detections:
+                data += det.to_Serial(packet_type == V5Comm.TRACKED_PACKET_TYPE)
+            return data
+        length = len(serialize())
+        return bytearray([0xAA, 0x55, 0xCC, 0x33]) + struct.pack('<HHI', length, packet_type, reference_crc32(serialize())) + serialize()
+
+    print("{:>8} {:>16} {:>16} {:>16} {:>6}".format("boxes", "reference (us)", "to_Serial (us)", "pack_into (us)", "same"))
+    buffer = bytearray(4096)
+    for count in (0, 10, 50):
+        record = random_record(count, rng)
+        packet = V5Comm.V5SerialPacket(V5Comm.MAP_PACKET_TYPE, record)
+        tracked = V5Comm.V5SerialPacket(V5Comm.TRACKED_PACKET_TYPE, record)
+        same = reference_packet(record) == packet.to_Serial() and reference_packet(record, V5Comm.TRACKED_PACKET_TYPE) == tracked.to_Serial()
+        print("{:>8} {:>16.1f} {:>16.1f} {:>16.1f} {:>6}".format(
+            count, time_call(lambda: reference_packet(record), max(1, repeat // 10)) * 1e6, time_call(packet.to_Serial, repeat) * 1e6,
+            time_call(lambda: packet.pack_into(buffer), repeat) * 1e6, str(same)))
+
+
+def compact_payload(record, screenBoxes):
+    # Payload of a compact packet, without the packet header
+    buffer = bytearray(record.compactSerialSize(screenBoxes))
+    record.pack_compact_into(buffer, 0, screenBoxes)
+    return buffer
+
+
+def benchmark_compact(repeat):
+    # Round trip the compact packet layout: sizes, time on the wire and the quantization error of every field.
+    # Fails if a field exceeds its quantization bound or the encoding is not byte for byte reproducible.
+    import V5Comm
+    rng = np.random.default_rng(0)
+    record = random_record(50, rng)
+    decoded = V5Comm.AIRecord.from_Compact(compact_payload(record, True))
+
+    def max_error(field):
+        return max(abs(field(a) - field(b)) for a, b in zip(record.detections, decoded.detections))
+
+    print("{:>12} {:>10} {:>10}".format("field", "max error", "bound"))
+    exceeded = []
+    for name, field, bound in [("probability", lambda d: d.probability, 0.5 / 255), ("depth (m)", lambda d: d.depth, 0.0005),
+                               ("map x (m)", lambda d: d.mapLocattion.x, 0.0005), ("map y (m)", lambda d: d.mapLocattion.y, 0.0005),
+                               ("map z (m)", lambda d: d.mapLocattion.z, 0.0005), ("screen box", lambda d: d.screenLocation.width, 0),
+                               ("class", lambda d: d.classID, 0), ("track ID", lambda d: d.trackID, 0), ("age", lambda d: d.age, 0)]:
+        error = max_error(field)
+        print("{:>12} {:>10.2e} {:>10.2e} {}".format(name, error, bound, "ok" if error <= bound + 1e-9 else "EXCEEDED"))
+        if error > bound + 1e-9:
+            exceeded.append(name)
+    assert len(exceeded) == 0, "Quantization error above the bound for " + ", ".join(exceeded)
+
+    # Decoded values sit exactly on the quantization steps, so encoding them again must give the same bytes, and the
+    # packet must carry exactly the payload pack_compact_into writes
+    for screenBoxes in (False, True):
+        payload = compact_payload(record, screenBoxes)
+        packet = V5Comm.V5SerialPacket(V5Comm.COMPACT_PACKET_TYPE, record, screenBoxes).to_Serial()
+        assert compact_payload(V5Comm.AIRecord.from_Compact(payload), screenBoxes) == payload, "Compact round trip changed the payload"
+        assert packet[V5Comm.V5SerialPacket.HEADER_SIZE:] == payload, "Compact packet payload differs from pack_compact_into"
+        assert struct.unpack_from('<H', packet, 4)[0] == len(payload), "Compact packet length field differs from its payload"
+    capped = V5Comm.AIRecord.from_Compact(compact_payload(random_record(V5Comm.AIRecord.COMPACT_MAX_DETECTIONS + 10, rng), False))
+    assert len(capped.detections) == V5Comm.AIRecord.COMPACT_MAX_DETECTIONS, "Compact packet not capped at COMPACT_MAX_DETECTIONS"
+    print("compact encoding byte for byte reproducible, capped at {} detections".format(V5Comm.AIRecord.COMPACT_MAX_DETECTIONS))
+
+    print("{:>8} {:>12} {:>12} {:>18} {:>14}".format("boxes", "full (B)", "compact (B)", "with boxes (B)", "wire (ms)"))
+    for count in (0, 10, 50):
+        record = random_record(count, rng)
+        sizes = [V5Comm.V5SerialPacket(V5Comm.MAP_PACKET_TYPE, record).serialSize(),
+                 V5Comm.V5SerialPacket(V5Comm.COMPACT_PACKET_TYPE, record).serialSize(),
+                 V5Comm.V5SerialPacket(V5Comm.COMPACT_PACKET_TYPE, record, True).serialSize()]
+        # 10 bits per byte at 115200 baud
+        print("{:>8} {:>12} {:>12} {:>18} {:>6.1f} -> {:>4.1f}".format(count, *sizes, sizes[0] * 10 / 115.2, sizes[1] * 10 / 115.2))
+    packet = V5Comm.V5SerialPacket(V5Comm.COMPACT_PACKET_TYPE, random_record(50, rng))
+    buffer = bytearray(4096)
+    print("compact pack_into, 50 boxes: {:.1f} us".format(time_call(lambda: packet.pack_into(buffer), repeat) * 1e6))
+
+
+def benchmark_priority(repeat):
+    # Time ranking the detections of a reply and show how many fit into a reply time budget
+    from prioritizer import DetectionPrioritizer
+    rng = np.random.default_rng(0)
+    print("{:>8} {:>16} {:>22} {:>8}".format("boxes", "distance (us)", "class+confidence (us)", "sorted"))
+    for count in (10, 50, 200):
+        record = random_record(count, rng)
+        by_distance = DetectionPrioritizer(["distance"], max_detections=20)
+        by_class = DetectionPrioritizer(["class", "confidence"], class_priority=[1, 0], max_detections=20)
+        order = by_distance.select(record.detections, record.position)
+        distances = [np.hypot(det.mapLocattion.x - record.position.x, det.mapLocattion.y - record.position.y) for det in record.detections]
+        correct = [distances[i] for i in order] == sorted(distances)[:len(order)]
+        print("{:>8} {:>16.1f} {:>22.1f} {:>8}".format(
+            count, time_call(lambda: by_distance.select(record.detections, record.position), repeat) * 1e6,
+            time_call(lambda: by_class.select(record.detections, record.position), repeat) * 1e6, str(correct)))
+
+    # Detections kept of 50 for reply budgets at 115200 baud, full packet (12 + 36 + 40 per detection), tracked packet
+    # (12 + 36 + 48) and compact (12 + 34 + 13)
+    print("{:>12} {:>12} {:>12} {:>12}".format("budget (ms)", "full", "tracked", "compact"))
+    for budget_ms in (10, 20, 50, 100):
+        prioritizer = DetectionPrioritizer(budget_bytes=DetectionPrioritizer.budget_from_time(budget_ms))
+        print("{:>12} {:>12} {:>12} {:>12}".format(budget_ms, prioritizer.capacity(48, 40), prioritizer.capacity(48, 48), prioritizer.capacity(46, 13)))
+
+
+def benchmark_telemetry(repeat):
+    # Time logging one GPS sample on the producer thread: opening, appending and closing the file per sample as
+    # LiveFilter used to, against queueing it for TelemetryLogger's writer thread. Then check overflow and rotation.
+    import os
+    import tempfile
+    from telemetry import TelemetryLogger
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "telemetry.txt")
+
+    def append_line():
+        with open(path, "a") as f:
+            f.write(f"{0.1234}, {0.5678}\n")
+
+    append_time = time_call(append_line, repeat)
+    logger = TelemetryLogger(path, capacity=max(repeat * 2, 16))
+    log_time = time_call(lambda: logger.log(0.1234, 0.5678), repeat)
+    logger.close()
+    print("per sample append: {:.2f} us, TelemetryLogger.log: {:.2f} us, {:.0f}x faster".format(
+        append_time * 1e6, log_time * 1e6, append_time / log_time))
+    print("logged {logged}, written {written}, dropped {dropped}".format(**logger.get_stats()))
+
+    # A writer that never gets to run: the producer keeps going and the oldest rows are counted as dropped
+    logger = TelemetryLogger(path, capacity=100, flush_interval=3600)
+    for i in range(1000):
+        logger.log(i, i)
+    logger.close()
+    stats = logger.get_stats()
+    with open(path) as f:
+        last = f.read().splitlines()[-100:]
+    print("overflow: logged {}, dropped {}, kept the newest {}".format(stats["logged"], stats["dropped"], last[0] == "900, 900"))
+
+    # Rotation keeps every file near the size limit and at most backups old files
+    logger = TelemetryLogger(path, flush_interval=3600, max_bytes=4096, backups=2)
+    for i in range(2000):
+        logger.log(i, i)
+        if i % 100 == 99:
+            logger.flush()
+    logger.close()
+    sizes = {name: os.path.getsize(os.path.join(directory, name)) for name in sorted(os.listdir(directory))}
+    print("rotation: {} rotations, files {}".format(logger.get_stats()["rotations"], sizes))
+    for name in sizes:
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+
+
+def gps_replay(rng, seconds=30.0, rate=50.0, noise=0.005, heading_noise=0.5):
+    # Timestamps, true and measured x, y (m) and heading (degrees) of a robot driving at 1 m/s and steering left and
+    # right, sampled like the GPS sensor: jittered frame times, Gaussian noise and the sensor's 0.1 mm resolution
+    times = np.cumsum(rng.normal(1.0 / rate, 0.1 / rate, size=int(seconds * rate)))
+    turn_rate = 90.0 * np.sin(0.5 * times)  # Degrees per second
+    heading = np.cumsum(np.diff(times, prepend=0.0) * turn_rate) % 360.0
+    step = np.diff(times, prepend=0.0)
+    x = np.cumsum(step * np.cos(np.radians(heading)))
+    y = np.cumsum(step * np.sin(np.radians(heading)))
+    truth = np.stack([x, y, heading], axis=1)
+    measured = truth.copy()
+    measured[:, :2] = np.round((measured[:, :2] + rng.normal(0, noise, size=(len(times), 2))) * 10000) / 10000
+    measured[:, 2] = (measured[:, 2] + rng.normal(0, heading_noise, size=len(times))) % 360.0
+    return times, truth, measured
+
+
+def benchmark_gps(repeat):
+    # Replay a recorded-like GPS trace through LiveFilter and the V5GPS filters. The error to the true path is split
+    # into lag (the time shift that best lines the output up with the true path) and the noise left after removing it.
+    from filter import LiveFilter, create_filter
+    rng = np.random.default_rng(0)
+    times, truth, measured = gps_replay(rng)
+    dt = np.mean(np.diff(times))
+
+    def lag_and_noise(output):
+        # Best shift in samples of the output against the true path, its RMS error there and the plain RMS error
+        errors = [np.sqrt(np.mean(np.sum((output[shift:, :2] - truth[:len(truth) - shift, :2]) ** 2, axis=1))) for shift in range(20)]
+        shift = int(np.argmin(errors))
+        return shift * dt * 1000, errors[shift] * 1000, errors[0] * 1000
+
+    def heading_error(output):
+        residual = (output[:, 2] - truth[:, 2] + 180.0) % 360.0 - 180.0
+        return np.sqrt(np.mean(residual ** 2))
+
+    def run_live():
+        live = LiveFilter(10)
+        return np.array([live.update(x, y) + (heading,) for x, y, heading in measured.tolist()])
+
+    def run(name):
+        pose_filter = create_filter(name)
+        return np.array([pose_filter.update_pose(x, y, heading, t) for t, (x, y, heading) in zip(times.tolist(), measured.tolist())])
+
+    runs = [("raw", lambda: measured), ("LiveFilter", run_live)] + [(name, lambda name=name: run(name)) for name in ("mean", "exponential", "kalman")]
+    print("{:>12} {:>14} {:>10} {:>16} {:>14} {:>15}".format("filter", "us / sample", "lag (ms)", "noise (mm RMS)", "error (mm RMS)", "heading (deg)"))
+    for name, function in runs:
+        output = function()
+        lag, noise, error = lag_and_noise(output)
+        per_sample = time_call(function, max(1, repeat // 50)) / len(times) * 1e6 if name != "raw" else 0.0
+        print("{:>12} {:>14.2f} {:>10.0f} {:>16.2f} {:>14.2f} {:>15.2f}".format(name, per_sample, lag, noise, error, heading_error(output)))
+
+    # Gating: an outlier is rejected, and after a reported jump the filter restarts at the new position
+    kalman = create_filter("kalman")
+    for t, (x, y, heading) in zip(times[:100].tolist(), measured[:100].tolist()):
+        kalman.update_pose(x, y, heading, t)
+    x, y, heading = measured[100]
+    outlier = kalman.update_pose(x + 0.5, y, heading, times[100])
+    kalman.update_pose(0, 0, 0, times[101], valid=False, position_jump=True)
+    jumped = kalman.update_pose(x + 1.0, y, heading, times[102])
+    print("outlier rejected {}, restarted after jump {}".format(abs(outlier[0] - x) < 0.05, abs(jumped[0] - x - 1.0) < 1e-9))
+
+
+def benchmark_history(repeat):
+    # Time looking up the robot position at a frame's capture time in the GPS pose history, and show the map error of
+    # projecting a detection from the position after inference instead of the interpolated one at capture time
+    from V5MapPosition import MapPosition
+    from V5Position import Position, PoseHistory
+    rng = np.random.default_rng(0)
+    times, truth, measured = gps_replay(rng)
+
+    def position(pose):
+        return Position(1, Position.STATUS_CONNECTED | Position.STATUS_KALMAN_EST, pose[0], pose[1], 0.0, pose[2], 0.0, 0.0)
+
+    print("{:>10} {:>16}".format("history", "lookup (us)"))
+    for capacity in (16, 256, 4096):
+        history = PoseHistory(capacity)
+        for t, pose in zip(times.tolist(), truth.tolist()):
+            history.append(t, position(pose))
+        queries = rng.uniform(times[-min(capacity, len(times))], times[-1], size=64).tolist()
+        print("{:>10} {:>16.2f}".format(capacity, time_call(lambda: [history.getPositionAt(t) for t in queries], repeat) / len(queries) * 1e6))
+
+    # A detection in the middle of the image 1.5 m away, seen on every frame of a 30 fps camera and projected latency
+    # seconds later from the noisy GPS readings
+    history = PoseHistory(256)
+    v5Map = MapPosition()
+    point = np.array([[320.0, 240.0, 1.5]])
+    errors = {"latest": [], "interpolated": []}
+    latency = 0.08
+    frame_times = np.arange(times[300], times[-1] - latency, 1.0 / 30)
+    gps_index = 0
+    for frame_time in frame_times.tolist():
+        # The GPS frames that arrived before inference finished
+        while gps_index < len(times) and times[gps_index] <= frame_time + latency:
+            history.append(times[gps_index], position(measured[gps_index]))
+            gps_index += 1
+        true_pose = [np.interp(frame_time, times, truth[:, i]) for i in range(2)]
+        heading = np.degrees(np.unwrap(np.radians(truth[:, 2])))
+        true_position = position(true_pose + [np.interp(frame_time, times, heading) % 360.0])
+        expected = v5Map.computeMapLocations(point, true_position)[0]
+        errors["latest"].append(np.hypot(*(v5Map.computeMapLocations(point, position(measured[gps_index - 1]))[0] - expected)[:2]))
+        errors["interpolated"].append(np.hypot(*(v5Map.computeMapLocations(point, history.getPositionAt(frame_time))[0] - expected)[:2]))
+    for name, values in errors.items():
+        print("{} position, {:.0f} ms after capture: map error mean {:.1f} mm, max {:.1f} mm".format(
+            name, latency * 1000, np.mean(values) * 1000, np.max(values) * 1000))
+
+
+BENCHMARKS = {
+    "compact": benchmark_compact,
+    "depth": benchmark_depth,
+    "gps": benchmark_gps,
+    "history": benchmark_history,
+    "int8": benchmark_int8,
+    "map": benchmark_map,
+    "nms": benchmark_nms,
+    "packet": benchmark_packet,
+    "preprocess": benchmark_preprocess,
+    "priority": benchmark_priority,
+    "registration": benchmark_registration,
+    "telemetry": benchmark_telemetry,
+    "tracker": benchmark_tracker,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro benchmarks for the VEX AI detection pipeline")
+    parser.add_argument("name", choices=sorted(BENCHMARKS.keys()), help="benchmark to run")
+    parser.add_argument("--repeat", type=int, default=200, help="number of timed iterations per measurement")
+    args = parser.parse_args()
+    BENCHMARKS[args.name](args.repeat)
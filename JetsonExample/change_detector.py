@@ -0,0 +1,50 @@
+import cv2
+import numpy as np
+
+
+class ChangeDetector:
+    # Decides whether a frame differs enough from the last frame the model ran on to be worth running the model again.
+    # Frames are shrunk to a few hundred pixels, so the check costs a fraction of a millisecond. A frame counts as changed
+    # when more than area_threshold of its pixels moved by more than pixel_threshold gray levels, or, if depth_threshold
+    # is set, by more than depth_threshold meters in depth. Every max_skip frames the model runs anyway.
+    def __init__(self, pixel_threshold=12, area_threshold=0.01, depth_threshold=None, depth_scale=0.001, max_skip=30, size=(32, 24)):
+        self.pixel_threshold = pixel_threshold
+        self.area_threshold = area_threshold
+        self.depth_threshold = depth_threshold
+        self.depth_scale = depth_scale
+        self.max_skip = max_skip
+        self.size = size  # WH of the downsampled frames
+        self.reference = None
+        self.reference_depth = None
+        self.skipped = 0
+
+    def changed(self, color_image, depth_image=None):
+        # Compare a frame with the reference and make it the new reference if it changed
+        gray = cv2.cvtColor(cv2.resize(color_image, self.size, interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2GRAY)
+        depth = None
+        if self.depth_threshold is not None and depth_image is not None:
+            # Nearest neighbour keeps invalid (zero) depth pixels from blending into valid ones
+            depth = cv2.resize(depth_image, self.size, interpolation=cv2.INTER_NEAREST).astype(np.float32) * self.depth_scale
+
+        changed = self.reference is None or self.skipped >= self.max_skip or self.differs(gray, depth)
+        if changed:
+            self.reference = gray
+            self.reference_depth = depth
+            self.skipped = 0
+        else:
+            self.skipped += 1
+        return changed
+
+    def differs(self, gray, depth):
+        changed_pixels = np.count_nonzero(cv2.absdiff(gray, self.reference) > self.pixel_threshold)
+        if changed_pixels > self.area_threshold * gray.size:
+            return True
+        if depth is None or self.reference_depth is None:
+            return False
+        valid = (depth > 0) & (self.reference_depth > 0)
+        changed_depth = np.count_nonzero(valid & (np.abs(depth - self.reference_depth) > self.depth_threshold))
+        return changed_depth > self.area_threshold * depth.size
+
+    def reset(self):
+        # Force the model to run on the next frame
+        self.reference = None
@@ -57,8 +57,14 @@ def allocate_buffers(engine):
     outputs = []
     bindings = []
     stream = cuda.Stream()
+    # A dynamic batch dimension is sized for the largest batch of the first optimization profile
+    max_batch = 1
     for binding in engine:
-        size = trt.volume(engine.get_binding_shape(binding)) * engine.max_batch_size
+        if engine.binding_is_input(binding) and -1 in tuple(engine.get_binding_shape(binding)):
+            max_batch = max(max_batch, engine.get_profile_shape(0, binding)[2][0])
+    for binding in engine:
+        shape = [max_batch if dim == -1 else dim for dim in engine.get_binding_shape(binding)]
+        size = trt.volume(shape) * engine.max_batch_size
         dtype = trt.nptype(engine.get_binding_dtype(binding))
         # Allocate host and device buffers
         host_mem = cuda.pagelocked_empty(size, dtype)
@@ -15,8 +15,8 @@
 #
 
 import math
-from PIL import Image
 import numpy as np
+import cv2
 import os
 
 
@@ -37,8 +37,8 @@ assert CATEGORY_NUM == 2
 
 class PreprocessYOLO(object):
     """
-    A simple class for loading images with PIL and reshaping them to the specified
-    input resolution.
+    A simple class for resizing images to the specified input resolution and writing them
+    into the network input buffer.
     """
 
     def __init__(self, yolo_input_resolution):
@@ -50,57 +50,271 @@ class PreprocessYOLO(object):
         input resolution in HW order
         """
         self.yolo_input_resolution = yolo_input_resolution
+        # Reused resize target for process_into
+        self.resized = np.empty((yolo_input_resolution[0], yolo_input_resolution[1], 3), dtype=np.uint8)
 
-    def process(self, input_image, dtype):
+    def process_into(self, input_image, input_buffer):
         """
-        Load an image from the specified input array,
-        and return it together with a pre-processed version required for feeding it into a
-        YOLOv3 network.
+        Resize, convert and normalize an image in a single pass, writing the result straight into
+        a preallocated network input buffer. Nothing is allocated per frame. Return the input buffer.
 
         Keyword arguments:
-        input_image -- numpy array of the image to be processed
+        input_image -- numpy array of the image to be processed, uint8 in HWC format
+        input_buffer -- numpy array with shape (1,height,width,3) and dtype float32, int8 or uint8,
+        usually owned by the model backend
         """
-        image_raw, image_resized = self._load_and_resize(input_image, dtype)
-        image_preprocessed = self._shuffle_and_normalize(image_resized, dtype)
-        return image_raw, image_preprocessed
+        height, width = self.yolo_input_resolution
+        # INTER_AREA is the closest OpenCV match to the antialiased PIL BICUBIC downscale of the original preprocessing
+        cv2.resize(input_image, (width, height), dst=self.resized, interpolation=cv2.INTER_AREA)
+
+        output = input_buffer.reshape(height, width, 3)
+        if input_buffer.dtype == np.float32:
+            np.divide(self.resized, np.float32(255.0), out=output)
+        elif input_buffer.dtype == np.int8:
+            # uint8 - 128 as int8 is the same bit pattern as flipping the top bit
+            np.bitwise_xor(self.resized, 0x80, out=output.view(np.uint8))
+        else:
+            np.copyto(output, self.resized)
+        return input_buffer
+
+
+def _sigmoid(array):
+    """Return the sigmoid of the input."""
+    return np.reciprocal(np.exp(-array) + 1.0)
+
+
+def _logit(probability):
+    """Return the inverse sigmoid of a probability, mapping 0 and 1 to -inf and +inf."""
+    if probability <= 0.0:
+        return -np.inf
+    if probability >= 1.0:
+        return np.inf
+    return math.log(probability / (1.0 - probability))
+
+
+class YOLODecoder(object):
+    """Decoder for a single YOLO output scale.
+
+    The cell grid, anchor sizes and per-class thresholds only depend on the output shape,
+    so they are computed once here instead of on every frame. Cells are rejected by comparing
+    the raw objectness and class logits against the thresholds mapped into logit space, and boxes
+    are only decoded for the remaining candidates. The cost of a frame therefore scales with the
+    number of candidates rather than with the grid size.
+    """
+
+    # Margin subtracted from the logit thresholds so float rounding never rejects a cell
+    # that passes the exact score test
+    LOGIT_MARGIN = 1e-4
 
-    def _load_and_resize(self, input_image, dtype):
+    def __init__(self, grid_hw, anchors, obj_threshold, yolo_input_resolution, num_classes=CATEGORY_NUM):
+        """Initialize with everything that is fixed for this output scale.
+
+        Keyword arguments:
+        grid_hw -- two-dimensional tuple with the output grid size in HW order
+        anchors -- list of two-dimensional tuples with the anchors used by this scale
+        obj_threshold -- threshold for object coverage, given in an array where index is the class of the object
+        yolo_input_resolution -- two-dimensional tuple with the target network's (spatial)
+        input resolution in HW order
+        num_classes -- number of object classes the network predicts
         """
-        Load an image from the specified array and resize it to the input resolution.
-        Return the input image before resizing as a PIL Image (required for visualization),
-        and the resized image as a NumPy float array.
+        grid_h, grid_w = grid_hw
+        num_anchors = len(anchors)
+        self.grid_hw = (grid_h, grid_w)
+        self.num_anchors = num_anchors
+        self.num_classes = num_classes
+
+        # Cell offsets in the same (height, width, anchor) order as the flattened output
+        col, row = np.meshgrid(np.arange(grid_w), np.arange(grid_h))
+        grid = np.stack((col, row), axis=-1).reshape(grid_h, grid_w, 1, 2)
+        grid = np.broadcast_to(grid, (grid_h, grid_w, num_anchors, 2))
+        self.grid = np.ascontiguousarray(grid.reshape(-1, 2), dtype=np.float32)
+        self.grid_scale = np.array([grid_w, grid_h], dtype=np.float32)
+
+        # Anchor sizes relative to the network input, repeated for every cell
+        anchors = np.asarray(anchors, dtype=np.float32) / np.asarray(yolo_input_resolution, dtype=np.float32)
+        self.anchors = np.tile(anchors, (grid_h * grid_w, 1))
+
+        self.thresholds = np.asarray(obj_threshold, dtype=np.float32)
+        # Both sigmoids of a passing cell must reach the lowest class threshold on their own,
+        # since the final score is their product
+        self.min_logit = _logit(float(self.thresholds.min())) - YOLODecoder.LOGIT_MARGIN
+
+    def decode(self, output):
+        """Return the boxes, classes and scores of every cell in a YOLO output that passes
+        the object threshold of its most likely class.
 
         Keyword arguments:
-        input_image -- numpy array of the image to be loaded
+        output -- YOLO output for this scale as NumPy array that can be reshaped to (height,width,3,5+classes)
         """
+        feats = output.reshape(-1, 5 + self.num_classes)
+
+        # Early rejection on the raw objectness logit
+        candidates = np.flatnonzero(feats[:, 4] >= self.min_logit)
+        feats = feats[candidates]
+
+        # The class with the highest logit also has the highest score since objectness is shared
+        class_logits = feats[:, 5:]
+        classes = np.argmax(class_logits, axis=-1)
+        best_logits = class_logits[np.arange(len(classes)), classes]
+        passed = best_logits >= self.min_logit
+        candidates, feats, classes, best_logits = candidates[passed], feats[passed], classes[passed], best_logits[passed]
+
+        # Exact score test on the remaining candidates
+        scores = _sigmoid(feats[:, 4]) * _sigmoid(best_logits)
+        passed = scores >= self.thresholds[classes]
+        candidates, feats, classes, scores = candidates[passed], feats[passed], classes[passed], scores[passed]
+
+        # Decode only the surviving boxes
+        box_xy = (_sigmoid(feats[:, :2]) + self.grid[candidates]) / self.grid_scale
+        box_wh = np.exp(feats[:, 2:4]) * self.anchors[candidates]
+        box_xy -= box_wh / 2.0
+        boxes = np.concatenate((box_xy, box_wh), axis=-1)
+
+        return boxes, classes, scores
 
-        image_raw = Image.fromarray(input_image)
-        # Expecting yolo_input_resolution in (height, width) format, adjusting to PIL
-        # convention (width, height) in PIL:
-        new_resolution = (self.yolo_input_resolution[1], self.yolo_input_resolution[0])
-        image_resized = image_raw.resize(new_resolution, resample=Image.BICUBIC)
-        image_resized = np.array(image_resized, dtype=dtype, order="C")
-        return image_raw, image_resized
 
-    def _shuffle_and_normalize(self, image, dtype):
-        """Normalize a NumPy array representing an image to the range [0, 1], and
-        convert it from HWC format ("channels last") to NCHW format ("channels first"
-        with leading batch dimension).
+class QuantizedYOLODecoder(YOLODecoder):
+    """Decoder for a single int8 quantized YOLO output scale, as produced by the Coral Edge TPU.
+
+    The output is never dequantized as a whole. The logit thresholds are mapped onto the
+    quantized codes, so early rejection is a plain int8 comparison, and the surviving cells are
+    decoded through 256-entry lookup tables that combine dequantization with the sigmoid or
+    exponential for every possible code.
+    """
+
+    def __init__(self, grid_hw, anchors, obj_threshold, yolo_input_resolution, quantization, num_classes=CATEGORY_NUM):
+        """Initialize with everything that is fixed for this output scale.
+
+        Keyword arguments:
+        grid_hw -- two-dimensional tuple with the output grid size in HW order
+        anchors -- list of two-dimensional tuples with the anchors used by this scale
+        obj_threshold -- threshold for object coverage, given in an array where index is the class of the object
+        yolo_input_resolution -- two-dimensional tuple with the target network's (spatial)
+        input resolution in HW order
+        quantization -- two-dimensional tuple with the (scale, zero point) of the output tensor
+        num_classes -- number of object classes the network predicts
+        """
+        super().__init__(grid_hw, anchors, obj_threshold, yolo_input_resolution, num_classes)
+        scale, zero_point = quantization
+        if scale <= 0:
+            raise Exception("Invalid argument: Quantization scale must be positive")
+        self.quantization = (scale, zero_point)
+
+        # Tables are indexed by the raw byte of the code, i.e. the code viewed as uint8
+        codes = np.arange(256, dtype=np.uint8).view(np.int8).astype(np.float32)
+        values = (codes - zero_point) * np.float32(scale)
+        self.sigmoid_lut = _sigmoid(values).astype(np.float32)
+        self.exp_lut = np.exp(values).astype(np.float32)
+
+        # Smallest code whose value reaches the lowest logit threshold, codes only ever range from -128 to 127
+        min_code = math.ceil(self.min_logit / scale + zero_point) if np.isfinite(self.min_logit) else (128 if self.min_logit > 0 else -128)
+        self.min_code = np.int16(min(max(min_code, -128), 128))
+
+    def decode(self, output):
+        """Return the boxes, classes and scores of every cell in an int8 YOLO output that passes
+        the object threshold of its most likely class.
 
         Keyword arguments:
-        image -- image as three-dimensional NumPy float array, in HWC format
+        output -- int8 YOLO output for this scale as NumPy array that can be reshaped to (height,width,3,5+classes)
         """
-        if (dtype == np.float32):
-            image /= 255.0
-        elif (dtype == np.int8):
-            image -= 128
-        # HWC to CHW format:
-        #image = np.transpose(image, [2, 0, 1])
-        # CHW to NCHW format
-        image = np.expand_dims(image, axis=0)
-        # Convert the image to row-major order, also known as "C order":
-        image = np.array(image, dtype=dtype, order="C")
-        return image
+        feats = output.reshape(-1, 5 + self.num_classes)
+
+        # Early rejection on the raw objectness code
+        candidates = np.flatnonzero(feats[:, 4] >= self.min_code)
+        feats = feats[candidates]
+
+        # Dequantization is monotonic, so the highest class code is also the highest class score
+        class_codes = feats[:, 5:]
+        classes = np.argmax(class_codes, axis=-1)
+        best_codes = class_codes[np.arange(len(classes)), classes]
+        passed = best_codes >= self.min_code
+        candidates, feats, classes, best_codes = candidates[passed], feats[passed], classes[passed], best_codes[passed]
+
+        # Exact score test on the remaining candidates
+        feats = feats.view(np.uint8)
+        scores = self.sigmoid_lut[feats[:, 4]] * self.sigmoid_lut[best_codes.view(np.uint8)]
+        passed = scores >= self.thresholds[classes]
+        candidates, feats, classes, scores = candidates[passed], feats[passed], classes[passed], scores[passed]
+
+        # Decode only the surviving boxes
+        box_xy = (self.sigmoid_lut[feats[:, :2]] + self.grid[candidates]) / self.grid_scale
+        box_wh = self.exp_lut[feats[:, 2:4]] * self.anchors[candidates]
+        box_xy -= box_wh / 2.0
+        boxes = np.concatenate((box_xy, box_wh), axis=-1)
+
+        return boxes, classes, scores
+
+
+def batched_nms(boxes, confidences, categories, nms_threshold, top_k=None):
+    """Apply class-aware Non-Maximum Suppression to all categories in a single pass and return
+    the indexes of the bounding boxes to keep, grouped by category and ordered by confidence
+    within each category (the same order as running _nms_boxes once per category).
+
+    Every box is shifted by its category times the extent of all boxes, so boxes of different
+    categories never overlap and one IoU matrix covers all of them. The greedy suppression only
+    walks that precomputed matrix, which keeps the set of kept boxes identical to the per-category loop.
+
+    Keyword arguments:
+    boxes -- a NumPy array containing N bounding-box coordinates with shape (N,4); 4 for x,y,width,height
+    confidences -- a NumPy array containing the corresponding confidences with shape N
+    categories -- a NumPy array containing the corresponding categories with shape N
+    nms_threshold -- threshold for non-max suppression algorithm, float value between 0 and 1
+    top_k -- optional maximum number of candidates (highest confidences first) considered by the NMS
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    ordered = np.argsort(-confidences, kind="stable")
+    if top_k is not None:
+        ordered = ordered[:top_k]
+
+    boxes = boxes[ordered]
+    x_coord = boxes[:, 0]
+    y_coord = boxes[:, 1]
+    width = boxes[:, 2]
+    height = boxes[:, 3]
+
+    # Class offset, large enough that the +1 pixel in the intersection can't bridge two categories
+    extent = max(np.max(x_coord + width), np.max(y_coord + height)) - min(np.min(x_coord), np.min(y_coord)) + 2.0
+    offset = (categories[ordered] * extent).astype(boxes.dtype)
+    x1 = x_coord + offset
+    y1 = y_coord + offset
+    x2 = x1 + width
+    y2 = y1 + height
+    areas = width * height
+
+    # Pairwise IoU between all candidates, using the same pixel convention as _nms_boxes
+    intersection = np.minimum(x2[:, None], x2[None, :])
+    intersection -= np.maximum(x1[:, None], x1[None, :])
+    intersection += 1
+    np.maximum(intersection, 0.0, out=intersection)
+    height1 = np.minimum(y2[:, None], y2[None, :])
+    height1 -= np.maximum(y1[:, None], y1[None, :])
+    height1 += 1
+    np.maximum(height1, 0.0, out=height1)
+    intersection *= height1
+    union = np.add(areas[:, None], areas[None, :], out=height1)
+    union -= intersection
+    with np.errstate(divide="ignore", invalid="ignore"):
+        suppresses = ~(intersection / union <= nms_threshold)
+    # A box can only be suppressed by a box with a higher confidence
+    suppresses = np.triu(suppresses, 1)
+    overlaps_any = suppresses.any(axis=1).tolist()
+
+    # Greedy pass in confidence order, each kept box removes everything it overlaps
+    removed = np.zeros(len(ordered), dtype=bool)
+    keep = list()
+    for i in range(len(ordered)):
+        if removed[i]:
+            continue
+        keep.append(i)
+        if overlaps_any[i]:
+            removed |= suppresses[i]
+
+    keep = ordered[keep]
+    # Group by category while keeping the confidence order inside each category
+    keep = keep[np.argsort(categories[keep], kind="stable")]
+    return keep
 
 
 class PostprocessYOLO(object):
@@ -113,6 +327,8 @@ class PostprocessYOLO(object):
         obj_threshold,
         nms_threshold,
         yolo_input_resolution,
+        pre_nms_top_k=None,
+        num_classes=CATEGORY_NUM,
     ):
         """Initialize with all values that will be kept when processing several frames.
 
@@ -124,14 +340,20 @@ class PostprocessYOLO(object):
         float value between 0 and 1
         input_resolution_yolo -- two-dimensional tuple with the target network's (spatial)
         input resolution in HW order
+        pre_nms_top_k -- optional maximum number of candidates passed to the non-max suppression
+        num_classes -- number of object classes the network predicts
         """
         self.masks = yolo_masks
         self.anchors = yolo_anchors
         self.object_threshold = obj_threshold
         self.nms_threshold = nms_threshold
         self.input_resolution_yolo = yolo_input_resolution
+        self.pre_nms_top_k = pre_nms_top_k
+        self.num_classes = num_classes
+        # One decoder per output scale, built the first time an output of that shape is seen
+        self.decoders = dict()
 
-    def process(self, outputs, resolution_raw):
+    def process(self, outputs, resolution_raw, quantization=None):
         """Take the YOLOv3 outputs generated from a TensorRT forward pass, post-process them
         and return a list of bounding boxes for detected object together with their category
         and their confidences in separate lists.
@@ -139,13 +361,15 @@ class PostprocessYOLO(object):
         Keyword arguments:
         outputs -- outputs from a TensorRT engine in NCHW format
         resolution_raw -- the original spatial resolution from the input PIL image in WH order
+        quantization -- optional list with the (scale, zero point) of each output, for int8 outputs
+        that are decoded without dequantizing them first
         """
         outputs_reshaped = list()
         for output in outputs:
             outputs_reshaped.append(self._reshape_output(output))
 
         boxes, categories, confidences = self._process_yolo_output(
-            outputs_reshaped, resolution_raw
+            outputs_reshaped, resolution_raw, quantization
         )
 
         return boxes, categories, confidences
@@ -161,11 +385,32 @@ class PostprocessYOLO(object):
         _, height, width, _ = output.shape
         dim1, dim2 = height, width
         dim3 = 3
-        dim4 = 4 + 1 + CATEGORY_NUM
+        dim4 = 4 + 1 + self.num_classes
 
         return np.reshape(output, (dim1, dim2, dim3, dim4))
 
-    def _process_yolo_output(self, outputs_reshaped, resolution_raw):
+    def _get_decoder(self, index, output_reshaped, mask, quantization=None):
+        """Return the decoder for an output scale, creating it on first use.
+
+        Keyword arguments:
+        index -- position of the output in the list of outputs
+        output_reshaped -- reshaped YOLO output as NumPy array with shape (height,width,3,85)
+        mask -- 3-dimensional tuple with mask specification for this output
+        quantization -- optional (scale, zero point) of an int8 output
+        """
+        grid_hw = output_reshaped.shape[:2]
+        key = (index, grid_hw, quantization)
+        decoder = self.decoders.get(key)
+        if decoder is None:
+            anchors = [self.anchors[i] for i in mask]
+            if quantization is None:
+                decoder = YOLODecoder(grid_hw, anchors, self.object_threshold, self.input_resolution_yolo, self.num_classes)
+            else:
+                decoder = QuantizedYOLODecoder(grid_hw, anchors, self.object_threshold, self.input_resolution_yolo, quantization, self.num_classes)
+            self.decoders[key] = decoder
+        return decoder
+
+    def _process_yolo_output(self, outputs_reshaped, resolution_raw, quantization=None):
         """Take in a list of three reshaped YOLO outputs in (height,width,3,85) shape and return
         return a list of bounding boxes for detected object together with their category and their
         confidences in separate lists.
@@ -174,15 +419,18 @@ class PostprocessYOLO(object):
         outputs_reshaped -- list of three reshaped YOLO outputs as NumPy arrays
         with shape (height,width,3,85)
         resolution_raw -- the original spatial resolution from the input PIL image in WH order
+        quantization -- optional list with the (scale, zero point) of each int8 output
         """
+        if quantization is None:
+            quantization = [None] * len(outputs_reshaped)
 
         # There are three output tensors, which we associate with their
         # respective masks. Then we iterate through all output-mask pairs and generate candidates
         # for bounding boxes, their corresponding category predictions and their confidences:
         boxes, categories, confidences = list(), list(), list()
-        for output, mask in zip(outputs_reshaped, self.masks):
-            box, category, confidence = self._process_feats(output, mask)
-            box, category, confidence = self._filter_boxes(box, category, confidence)
+        for index, (output, mask) in enumerate(zip(outputs_reshaped, self.masks)):
+            decoder = self._get_decoder(index, output, mask, quantization[index])
+            box, category, confidence = decoder.decode(output)
             boxes.append(box)
             categories.append(category)
             confidences.append(confidence)
@@ -198,110 +446,25 @@ class PostprocessYOLO(object):
 
         # Using the candidates from the previous (loop) step, we apply the non-max suppression
         # algorithm that clusters adjacent bounding boxes to a single bounding box:
-        nms_boxes, nms_categories, nscores = list(), list(), list()
-        for category in set(categories):
-            idxs = np.where(categories == category)
-            box = boxes[idxs]
-            category = categories[idxs]
-            confidence = confidences[idxs]
+        keep = batched_nms(boxes, confidences, categories, self.nms_threshold, self.pre_nms_top_k)
 
-            keep = self._nms_boxes(box, confidence)
-
-            nms_boxes.append(box[keep])
-            nms_categories.append(category[keep])
-            nscores.append(confidence[keep])
-
-        if not nms_categories and not nscores:
+        if len(keep) == 0:
             return None, None, None
 
-        boxes = np.concatenate(nms_boxes)
-        categories = np.concatenate(nms_categories)
-        confidences = np.concatenate(nscores)
+        boxes = boxes[keep]
+        categories = categories[keep]
+        confidences = confidences[keep]
 
         return boxes, categories, confidences
 
-    def _process_feats(self, output_reshaped, mask):
-        """Take in a reshaped YOLO output in height,width,3,85 format together with its
-        corresponding YOLO mask and return the detected bounding boxes, the confidence,
-        and the class probability in each cell/pixel.
-
-        Keyword arguments:
-        output_reshaped -- reshaped YOLO output as NumPy arrays with shape (height,width,3,85)
-        mask -- 2-dimensional tuple with mask specification for this output
-        """
-
-        # Two in-line functions required for calculating the bounding box
-        # descriptors:
-        def sigmoid_v(array):
-            """Return the sigmoid of the input."""
-            return np.reciprocal(np.exp(-array) + 1.0)
-
-        def exponential_v(array):
-            """Return the exponential of the input."""
-            return np.exp(array)
-
-        grid_h, grid_w, _, _ = output_reshaped.shape
-
-        anchors = [self.anchors[i] for i in mask]
-
-        # Reshape to N, height, width, num_anchors, box_params:
-        anchors_tensor = np.reshape(anchors, [1, 1, len(anchors), 2])
-        box_xy = sigmoid_v(output_reshaped[..., :2])
-        box_wh = exponential_v(output_reshaped[..., 2:4]) * anchors_tensor
-        box_confidence = sigmoid_v(output_reshaped[..., 4])
-
-        box_confidence = np.expand_dims(box_confidence, axis=-1)
-        box_class_probs = sigmoid_v(output_reshaped[..., 5:])
-
-        col = np.tile(np.arange(0, grid_w), grid_w).reshape(-1, grid_w)
-        row = np.tile(np.arange(0, grid_h).reshape(-1, 1), grid_h)
-
-        col = col.reshape(grid_h, grid_w, 1, 1).repeat(3, axis=-2)
-        row = row.reshape(grid_h, grid_w, 1, 1).repeat(3, axis=-2)
-        grid = np.concatenate((col, row), axis=-1)
-
-        box_xy += grid
-        box_xy /= (grid_w, grid_h)
-        box_wh /= self.input_resolution_yolo
-        box_xy -= box_wh / 2.0
-        boxes = np.concatenate((box_xy, box_wh), axis=-1)
-
-        # boxes: centroids, box_confidence: confidence level, box_class_probs:
-        # class confidence
-        return boxes, box_confidence, box_class_probs
-
-    def _filter_boxes(self, boxes, box_confidences, box_class_probs):
-        """Take in the unfiltered bounding box descriptors and discard each cell
-        whose score is lower than the object threshold set during class initialization.
-
-        Keyword arguments:
-        boxes -- bounding box coordinates with shape (height,width,3,4); 4 for
-        x,y,height,width coordinates of the boxes
-        box_confidences -- bounding box confidences with shape (height,width,3,1); 1 for as
-        confidence scalar per element
-        box_class_probs -- class probabilities with shape (height,width,3,CATEGORY_NUM)
-
-        """
-        box_scores = box_confidences * box_class_probs
-        box_classes = np.argmax(box_scores, axis=-1)
-        box_class_scores = np.max(box_scores, axis=-1)
-
-        thresholds = [self.object_threshold[cls] for cls in box_classes.flatten()]
-        thresholds = np.reshape(thresholds, box_class_scores.shape)
-        pos = np.where(box_class_scores >= thresholds)
-
-
-        boxes = boxes[pos]
-        classes = box_classes[pos]
-        scores = box_class_scores[pos]
-
-        return boxes, classes, scores
-
     def _nms_boxes(self, boxes, box_confidences):
         """Apply the Non-Maximum Suppression (NMS) algorithm on the bounding boxes with their
         confidence scores and return an array with the indexes of the bounding boxes we want to
         keep (and display later).
 
+        This is the reference implementation for a single category, batched_nms is used
+        when processing frames.
+
         Keyword arguments:
         boxes -- a NumPy array containing N bounding-box coordinates that survived filtering,
         with shape (N,4); 4 for x,y,height,width coordinates of the boxes
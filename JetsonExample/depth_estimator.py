@@ -0,0 +1,61 @@
+import numpy as np
+
+
+class DepthEstimator:
+    # Robust depth of every detection in a frame from one call.
+    # The valid (non zero) depth pixels of all regions are gathered into a single padded array that is sorted once,
+    # so the median and the spread of every region come out of a few vectorized operations. The median ignores the
+    # stray background or edge pixels that pull a mean off, and an empty region reports itself invalid instead of NaN.
+    QUARTILES = np.array([0.25, 0.5, 0.75])
+
+    def __init__(self, depth_scale, min_valid=0.2, max_spread=0.1):
+        # depth_scale converts raw depth image values to meters
+        # min_valid is the smallest fraction of valid pixels a region needs for its depth to count as valid
+        # max_spread is the interquartile range, relative to the depth, at which the confidence drops to zero
+        self.depth_scale = depth_scale
+        self.min_valid = min_valid
+        self.max_spread = max_spread
+        self.__buffer = np.empty((0, 0), dtype=np.float32)  # Reused between frames, only grows
+
+    def estimate(self, depth_image, rois):
+        # rois is an (N, 4) array of top, left, bottom, right depth image pixels (bottom and right exclusive).
+        # Returns the depth in meters of each region (0 where invalid) and a confidence between 0 and 1 (0 where invalid).
+        rois = np.asarray(rois, dtype=int).reshape(-1, 4)
+        count = len(rois)
+        if count == 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+
+        height, width = depth_image.shape[:2]
+        top = np.minimum(np.maximum(rois[:, 0], 0), height)
+        left = np.minimum(np.maximum(rois[:, 1], 0), width)
+        bottom = np.minimum(np.maximum(rois[:, 2], top), height)
+        right = np.minimum(np.maximum(rois[:, 3], left), width)
+        sizes = (bottom - top) * (right - left)
+        size = max(int(sizes.max()), 1)
+
+        if self.__buffer.shape[0] < count or self.__buffer.shape[1] < size:
+            self.__buffer = np.empty((max(count, self.__buffer.shape[0]), max(size, self.__buffer.shape[1])), dtype=np.float32)
+        values = self.__buffer[:count, :size]
+        values.fill(np.inf)
+        for i, (r1, c1, r2, c2, pixels) in enumerate(zip(top.tolist(), left.tolist(), bottom.tolist(), right.tolist(), sizes.tolist())):
+            values[i, :pixels] = depth_image[r1:r2, c1:c2].ravel()
+
+        # Invalid pixels sort to the end behind the padding
+        values[values == 0] = np.inf
+        values.sort(axis=1)
+        valid_counts = np.count_nonzero(values < np.inf, axis=1)
+
+        # First quartile, median and third quartile of every region's valid pixels, all looked up at once
+        last = np.maximum(valid_counts, 1) - 1
+        indices = (last[:, None] * self.QUARTILES + 0.5).astype(int)
+        quartiles = values[np.arange(count)[:, None], indices] * self.depth_scale
+
+        valid_fraction = valid_counts / np.maximum(sizes, 1)
+        valid = (valid_counts > 0) & (valid_fraction >= self.min_valid)
+        # Regions without valid pixels only hold padding, their inf - inf is masked out below
+        with np.errstate(divide="ignore", invalid="ignore"):
+            spread = quartiles[:, 2] - quartiles[:, 0]
+            confidence = valid_fraction * np.minimum(np.maximum(1.0 - spread / (self.max_spread * quartiles[:, 1]), 0.0), 1.0)
+        depths = np.where(valid, quartiles[:, 1], 0.0).astype(np.float32)
+        confidence = np.where(valid, confidence, 0.0).astype(np.float32)
+        return depths, confidence
@@ -1,12 +1,15 @@
+from abc import ABC, abstractmethod
 from collections import deque
+import math
 import numpy as np
 
 class LiveFilter:
-    def __init__(self, window_size=5, output_file='filtered_data_simple.txt'):
+    def __init__(self, window_size=5, logger=None):
+        # logger is an optional TelemetryLogger that receives every filtered position
         self.window_size = window_size
         self.x_buffer = deque(maxlen=window_size)
         self.y_buffer = deque(maxlen=window_size)
-        self.output_file = output_file
+        self.logger = logger
 
     def update(self, x, y):
         # Update x and y buffers
@@ -17,8 +20,232 @@ class LiveFilter:
         filtered_x = np.mean(self.x_buffer)
         filtered_y = np.mean(self.y_buffer)
 
-        # Write the filtered data to an output file
-        with open(self.output_file, 'a') as f:
-            f.write(f"{filtered_x}, {filtered_y}\n")
+        # Queue the filtered data for the output file, written by the logger's own thread
+        if self.logger is not None:
+            self.logger.log(filtered_x, filtered_y)
 
-        return filtered_x, filtered_y
\ No newline at end of file
+        return filtered_x, filtered_y
+
+
+class PoseFilter(ABC):
+    # Interface of the filters V5GPS can select. update_pose() takes one GPS sample: x and y in meters, heading in
+    # degrees, a monotonic timestamp in seconds, whether the sensor reported a usable position (valid) and whether it
+    # reported a jump in position or heading. It returns the filtered x, y and heading, or None when the sample is not used.
+    def __init__(self, logger=None):
+        # logger is an optional TelemetryLogger that receives every filtered position
+        self.logger = logger
+
+    @abstractmethod
+    def update_pose(self, x, y, heading, timestamp, valid=True, position_jump=False, angle_jump=False):
+        pass
+
+    def log(self, x, y):
+        if self.logger is not None:
+            self.logger.log(x, y)
+
+
+class RunningMeanFilter(PoseFilter):
+    # Moving average of x and y over the last window_size valid samples, the same output as LiveFilter but O(1) per
+    # sample: running sums are updated with the new sample and the one leaving the window instead of summing the window.
+    # Like LiveFilter it keeps averaging across reported position jumps. The heading is passed through.
+    RESUM_INTERVAL = 10000  # Samples between exact re-summations, so rounding errors cannot pile up
+
+    def __init__(self, window_size=10, logger=None):
+        super().__init__(logger)
+        if window_size <= 0:
+            raise Exception("Invalid argument: Filter window size must be positive")
+        self.window_size = window_size
+        self.reset()
+
+    def reset(self):
+        self.x_buffer = deque(maxlen=self.window_size)
+        self.y_buffer = deque(maxlen=self.window_size)
+        self.x_sum = 0.0
+        self.y_sum = 0.0
+        self.__updates = 0
+
+    def update(self, x, y):
+        if len(self.x_buffer) == self.window_size:
+            self.x_sum -= self.x_buffer[0]
+            self.y_sum -= self.y_buffer[0]
+        self.x_buffer.append(x)
+        self.y_buffer.append(y)
+        self.x_sum += x
+        self.y_sum += y
+        self.__updates += 1
+        if self.__updates % self.RESUM_INTERVAL == 0:
+            self.x_sum = math.fsum(self.x_buffer)
+            self.y_sum = math.fsum(self.y_buffer)
+        count = len(self.x_buffer)
+        return self.x_sum / count, self.y_sum / count
+
+    def update_pose(self, x, y, heading, timestamp, valid=True, position_jump=False, angle_jump=False):
+        if not valid:
+            return None
+        x, y = self.update(x, y)
+        self.log(x, y)
+        return x, y, heading
+
+
+class ExponentialFilter(PoseFilter):
+    # Exponential moving average of x and y, O(1) per sample with no window to keep. alpha is the weight of the newest
+    # sample; 2 / (N + 1) has about the noise reduction of an N sample moving average. The heading is passed through.
+    def __init__(self, alpha=0.2, logger=None):
+        super().__init__(logger)
+        if alpha <= 0 or alpha > 1:
+            raise Exception("Invalid argument: Filter alpha must be in (0, 1]")
+        self.alpha = alpha
+        self.x = None
+        self.y = None
+
+    def update_pose(self, x, y, heading, timestamp, valid=True, position_jump=False, angle_jump=False):
+        if position_jump:
+            self.x = None
+        if not valid:
+            return None
+        if self.x is None:
+            self.x, self.y = x, y
+        else:
+            self.x += self.alpha * (x - self.x)
+            self.y += self.alpha * (y - self.y)
+        self.log(self.x, self.y)
+        return self.x, self.y, heading
+
+
+class ConstantVelocity:
+    # Kalman filter of one coordinate and its rate under a constant velocity model, on scalars since the 2x2
+    # covariance is cheaper to update by hand than with numpy. period is set for an angle in [0, period).
+    def __init__(self, measurement_noise, acceleration_noise, initial_rate_noise, period=None):
+        # Noise values are standard deviations: of a measurement, of the acceleration driving the model (per second
+        # squared) and of the rate when the filter starts
+        self.r = measurement_noise ** 2
+        self.q = acceleration_noise ** 2
+        self.initial_rate_variance = initial_rate_noise ** 2
+        self.period = period
+        self.value = None
+        self.rate = 0.0
+
+    def reset(self, measurement):
+        self.value = measurement
+        self.rate = 0.0
+        self.p00 = self.r
+        self.p01 = 0.0
+        self.p11 = self.initial_rate_variance
+
+    def predict(self, dt):
+        self.value += self.rate * dt
+        if self.period is not None:
+            self.value %= self.period
+        dt2 = dt * dt
+        self.p00 += dt * (2.0 * self.p01 + dt * self.p11) + self.q * dt2 * dt2 / 4.0
+        self.p01 += dt * self.p11 + self.q * dt2 * dt / 2.0
+        self.p11 += self.q * dt2
+
+    def innovation(self, measurement):
+        # Measurement minus prediction, the short way around for an angle, and its variance
+        residual = measurement - self.value
+        if self.period is not None:
+            residual = (residual + self.period / 2.0) % self.period - self.period / 2.0
+        return residual, self.p00 + self.r
+
+    def update(self, residual, variance):
+        k0 = self.p00 / variance
+        k1 = self.p01 / variance
+        self.value += k0 * residual
+        if self.period is not None:
+            self.value %= self.period
+        self.rate += k1 * residual
+        self.p11 -= k1 * self.p01
+        self.p00 -= k0 * self.p00
+        self.p01 -= k0 * self.p01
+
+
+class KalmanPoseFilter(PoseFilter):
+    # Constant velocity Kalman filter over x, y and heading. Unlike a moving average it follows the robot's motion
+    # instead of trailing half a window behind it, and it tracks the velocities.
+    # The sensor's flags gate the measurements: samples without a usable position are skipped, and
+    # after a reported position or heading jump the next sample restarts that part of the filter instead of being
+    # blended with the old estimate. A sample further than gate (normalized squared innovation) from the prediction is
+    # rejected as an outlier, unless max_rejects samples in a row were, which means the robot really is elsewhere.
+    def __init__(self, position_noise=0.01, heading_noise=0.5, acceleration_noise=2.0, angular_acceleration_noise=360.0,
+                 gate=16.0, max_rejects=5, logger=None):
+        # position_noise (m) and heading_noise (degrees) are the standard deviations of the GPS readings,
+        # acceleration_noise (m/s^2) and angular_acceleration_noise (degrees/s^2) how hard the robot can change its motion
+        super().__init__(logger)
+        self.x = ConstantVelocity(position_noise, acceleration_noise, 1.0)
+        self.y = ConstantVelocity(position_noise, acceleration_noise, 1.0)
+        self.heading = ConstantVelocity(heading_noise, angular_acceleration_noise, 180.0, 360.0)
+        self.gate = gate
+        self.max_rejects = max_rejects
+        self.position_rejects = 0
+        self.heading_rejects = 0
+        self.rejected = 0
+        self.__timestamp = None
+        self.__reset_position = True
+        self.__reset_heading = True
+
+    def update_pose(self, x, y, heading, timestamp, valid=True, position_jump=False, angle_jump=False):
+        self.__reset_position = self.__reset_position or position_jump
+        self.__reset_heading = self.__reset_heading or angle_jump
+        if not valid:
+            return None
+
+        if self.__timestamp is not None:
+            dt = max(timestamp - self.__timestamp, 0.0)
+            if not self.__reset_position:
+                self.x.predict(dt)
+                self.y.predict(dt)
+            if not self.__reset_heading:
+                self.heading.predict(dt)
+        self.__timestamp = timestamp
+
+        if self.__reset_position:
+            self.x.reset(x)
+            self.y.reset(y)
+            self.__reset_position = False
+        else:
+            x_residual, x_variance = self.x.innovation(x)
+            y_residual, y_variance = self.y.innovation(y)
+            if x_residual * x_residual / x_variance + y_residual * y_residual / y_variance <= self.gate:
+                self.x.update(x_residual, x_variance)
+                self.y.update(y_residual, y_variance)
+                self.position_rejects = 0
+            else:
+                self.rejected += 1
+                self.position_rejects += 1
+                if self.position_rejects >= self.max_rejects:
+                    self.x.reset(x)
+                    self.y.reset(y)
+                    self.position_rejects = 0
+
+        if self.__reset_heading:
+            self.heading.reset(heading % 360.0)
+            self.__reset_heading = False
+        else:
+            residual, variance = self.heading.innovation(heading)
+            if residual * residual / variance <= self.gate:
+                self.heading.update(residual, variance)
+                self.heading_rejects = 0
+            else:
+                self.rejected += 1
+                self.heading_rejects += 1
+                if self.heading_rejects >= self.max_rejects:
+                    self.heading.reset(heading % 360.0)
+                    self.heading_rejects = 0
+
+        self.log(self.x.value, self.y.value)
+        return self.x.value, self.y.value, self.heading.value
+
+
+FILTERS = {
+    "mean": RunningMeanFilter,
+    "exponential": ExponentialFilter,
+    "kalman": KalmanPoseFilter,
+}
+
+
+def create_filter(name, logger=None, **options):
+    # Filter for V5GPS by its name in FILTERS, options go to its constructor
+    if name not in FILTERS:
+        raise Exception("Invalid argument: GPS filter not accepted, expected one of " + ", ".join(FILTERS.keys()))
+    return FILTERS[name](logger=logger, **options)
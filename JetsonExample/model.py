@@ -1,8 +1,10 @@
 import numpy as np
 import sys
-from PIL import ImageDraw
-from data_processing import PreprocessYOLO, PostprocessYOLO, ALL_CATEGORIES
-from model_backend import CUDABackend, CoralBackend, USE_CUDA, USE_CORAL
+from data_processing import PreprocessYOLO, PostprocessYOLO
+from model_metadata import ModelMetadata
+from model_backend import CUDABackend, CoralBackend, ONNXRuntimeBackend, TFLiteBackend
+from model_backend import USE_CUDA, USE_CORAL, USE_ONNXRUNTIME, USE_TFLITE
+from batch_scheduler import BatchScheduler
 
 
 # Set print options for NumPy, allowing the full array to be printed
@@ -10,58 +12,114 @@ np.set_printoptions(threshold=sys.maxsize)
 
 class Model:
 
-    def __init__(self):
-        if USE_CUDA:
-            self.backend = CUDABackend()
+    BACKENDS = ("cuda", "coral", "onnx", "tflite")
+
+    def __init__(self, backend=None, num_threads=None, optimization_level="all", use_xnnpack=True, max_batch_size=1, batch_delay=0.005, native_int8=True,
+                 profile=None, metadata_path=None):
+        # backend is one of BACKENDS, or None to pick the first one available in that order.
+        # num_threads, optimization_level and use_xnnpack only apply to the CPU backends.
+        # max_batch_size above 1 runs concurrent inference requests through a BatchScheduler, which waits
+        # at most batch_delay seconds for a batch to fill up. This only pays off with several threads calling
+        # inference() or inference_batch() at once; a single caller just waits batch_delay on every frame, which is
+        # why pushback.py does not expose it.
+        # native_int8 lets the Coral backend hand its int8 outputs to the quantized decoder without dequantizing them.
+        # profile picks one of the input resolution profiles in the model metadata (models/pushback_lite.json by default).
+        if backend is not None and backend not in Model.BACKENDS:
+            raise Exception("Invalid argument: Backend not accepted")
+
+        # Input resolution, anchors, classes and output layout all come from the model metadata
+        self.metadata = ModelMetadata.load(metadata_path, profile)
+        self.input_resolution_yolov3_HW = self.metadata.input_resolution
+        self.output_shapes = self.metadata.output_shapes
+        print("Using model profile", self.metadata.profile, "with a {}x{} input".format(*self.input_resolution_yolov3_HW))
+
+        if backend == "cuda" or (backend is None and USE_CUDA):
+            self.backend = CUDABackend(max_batch_size, self.metadata.model_path(".onnx"), self.input_resolution_yolov3_HW,
+                                       self.metadata.engine_path(max_batch_size))
             print("Using CUDA for model inferencing")
-        elif USE_CORAL:
-            self.backend = CoralBackend()
+        elif backend == "coral" or (backend is None and USE_CORAL):
+            self.backend = CoralBackend(native_int8, self.metadata.model_path(".tflite"), self.input_resolution_yolov3_HW)
             print("Using Coral Edge TPU for model inferencing")
+        elif backend == "onnx" or (backend is None and USE_ONNXRUNTIME):
+            self.backend = ONNXRuntimeBackend(num_threads, optimization_level, self.metadata.model_path(".onnx"), max_batch_size,
+                                              self.input_resolution_yolov3_HW)
+            print("Using ONNX Runtime on the CPU for model inferencing")
+        elif backend == "tflite" or (backend is None and USE_TFLITE):
+            self.backend = TFLiteBackend(num_threads, use_xnnpack, self.metadata.model_path(".tflite"), self.input_resolution_yolov3_HW)
+            print("Using TFLite on the CPU for model inferencing")
         else:
-            print("No backend found! Make sure you have CUDA or Coral installed based on your device")
+            print("No backend found! Make sure you have CUDA, Coral, ONNX Runtime or TFLite installed based on your device")
+            exit(-1)
+
+        # Raw output index of each output scale, resolved from the first inference since backends never reorder their outputs
+        self.output_order = None
+        self.output_quantization = None
+
+        # The pre and post processors keep their precomputed state between frames, so only create them once
+        self.preprocessor = PreprocessYOLO(self.input_resolution_yolov3_HW)
+        self.postprocessor = PostprocessYOLO(
+            yolo_masks=self.metadata.masks,
+            yolo_anchors=self.metadata.anchors,
+            obj_threshold=self.metadata.obj_threshold,
+            nms_threshold=self.metadata.nms_threshold,
+            yolo_input_resolution=self.input_resolution_yolov3_HW,
+            num_classes=len(self.metadata.classes),
+        )
+
+        self.scheduler = None
+        if max_batch_size > 1:
+            self.scheduler = BatchScheduler(self.backend, max_batch_size, batch_delay)
+            self.scheduler.start()
+            print("Batching up to", self.scheduler.max_batch_size, "images per inference")
 
     def inference(self, inputImage):
         # Perform inference on the given image and return the bounding boxes, scores, and classes of detected objects.
+        if self.scheduler is not None:
+            return self.inference_batch([inputImage])[0]
+        image_raw, image = self.preprocess(inputImage)
+        return self.detect(inputImage, image_raw, image)
 
-        # Define input resolution and create preprocessor
-        input_resolution_yolov3_HW = (320, 320)
-        preprocessor = PreprocessYOLO(input_resolution_yolov3_HW)
+    def inference_batch(self, inputImages):
+        # Perform inference on several images (frames or tiles) and return a list of (output, detections), one per image.
+        # With a scheduler, the images share batches with each other and with requests from other threads.
+        if self.scheduler is None:
+            return [self.inference(inputImage) for inputImage in inputImages]
 
-        # Process the image and get original shape
-        image_raw, image = preprocessor.process(inputImage, self.backend.dtype)
-        shape_orig_WH = image_raw.size
+        futures = [self.scheduler.submit(lambda slot, inputImage=inputImage: self.preprocessor.process_into(inputImage, slot))
+                   for inputImage in inputImages]
+        return [self.postprocess(inputImage, inputImage, future.result()) for inputImage, future in zip(inputImages, futures)]
 
-        # Define output shapes for post-processing
-        output_shapes = [(1, 10, 10, 21), (1, 20, 20, 21)]
+    def preprocess(self, inputImage):
+        # Resize and normalize the image straight into the backend's input buffer
+        image = self.backend.write_input(lambda buffer: self.preprocessor.process_into(inputImage, buffer))
+        return inputImage, image
+
+    def detect(self, inputImage, image_raw, image):
+        # Run the backend on a preprocessed image and post-process the outputs into detections
 
         # Set the input and perform inference
         outputs = self.backend.inference(image)
 
-        # Sort tensors from smallest to largest
-        outputs = sorted(outputs, key=lambda o: o.size)
+        return self.postprocess(inputImage, image_raw, outputs)
+
+    def postprocess(self, inputImage, image_raw, outputs):
+        # Turn the raw backend outputs of a single image into detections
+
+        # Get original shape
+        shape_orig_WH = (image_raw.shape[1], image_raw.shape[0])
+
+        # Match the raw outputs to the output scales of the metadata once, keeping the quantization of int8 outputs with their tensor
+        if self.output_order is None:
+            self.output_order = self.metadata.output_order(outputs, self.backend.output_names)
+            quantization = self.backend.output_quantization
+            if quantization is not None:
+                self.output_quantization = [quantization[i] for i in self.output_order]
 
         # Reshape the outputs for post-processing
-        outputs = [output.reshape(shape) for output, shape in zip(outputs, output_shapes)]
-
-        # Define arguments for post-processing
-        postprocessor_args = {
-            "yolo_masks": [(3, 4, 5), (0, 1, 2)],
-            "yolo_anchors": [
-            (10, 14),
-            (23, 27),
-            (37, 58),
-            (81, 82),
-            (135, 169),
-            (344, 319),
-            ],
-            "obj_threshold": [0.5, 0.5],  # Different thresholds for each class label (Green, Red, Blue)
-            "nms_threshold": 0.5,
-            "yolo_input_resolution": input_resolution_yolov3_HW,
-        }
+        outputs = [outputs[i].reshape(shape) for i, shape in zip(self.output_order, self.output_shapes)]
 
         # Perform post-processing
-        postprocessor = PostprocessYOLO(**postprocessor_args)
-        boxes, classes, scores = postprocessor.process(outputs, (shape_orig_WH))
+        boxes, classes, scores = self.postprocessor.process(outputs, (shape_orig_WH), self.output_quantization)
 
         Detections = []
 
@@ -71,27 +129,26 @@ class Model:
             return inputImage, Detections
 
         # Draw bounding boxes and return detected objects
-        obj_detected_img = Model.draw_bboxes(image_raw, boxes, scores, classes, ALL_CATEGORIES, Detections)
-        return np.array(obj_detected_img), Detections
+        obj_detected_img = Model.draw_bboxes(image_raw, boxes, scores, classes, self.metadata.classes, Detections)
+        return obj_detected_img, Detections
 
     @staticmethod
-    def draw_bboxes(image_raw, bboxes, confidences, categories, all_categories, Detections, bbox_color="white"):
-        # Draw bounding boxes on the original image and return it.
+    def draw_bboxes(image_raw, bboxes, confidences, categories, all_categories, Detections):
+        # Draw bounding boxes on the original image (numpy array in HWC format) and return it.
 
-        # Create drawing context
-        draw = ImageDraw.Draw(image_raw)
+        image_height, image_width = image_raw.shape[:2]
 
         # Draw each bounding box
         for box, score, category in zip(bboxes, confidences, categories):
             x_coord, y_coord, width, height = box
             left = max(0, np.floor(x_coord + 0.5).astype(int))
             top = max(0, np.floor(y_coord + 0.5).astype(int))
-            right = min(image_raw.width, np.floor(x_coord + width + 0.5).astype(int))
-            bottom = min(image_raw.height, np.floor(y_coord + height + 0.5).astype(int))
+            right = min(image_width, np.floor(x_coord + width + 0.5).astype(int))
+            bottom = min(image_height, np.floor(y_coord + height + 0.5).astype(int))
 
             # Draw the rectangle and text
-            # draw.rectangle(((left, top), (right, bottom)), outline=bbox_color)
-            # draw.text((left, top - 12), "{0} {1:.2f}".format(all_categories[category], score), fill=bbox_color)
+            # cv2.rectangle(image_raw, (int(left), int(top)), (int(right), int(bottom)), (255, 255, 255))
+            # cv2.putText(image_raw, "{0} {1:.2f}".format(all_categories[category], score), (int(left), int(top) - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255))
 
             # Create and store the raw detection object
             raw_detection = rawDetection(int(left), int(top), [x_coord, y_coord], int(width), int(height), score,
@@ -102,8 +159,9 @@ class Model:
 
 
 class rawDetection:
-    def __init__(self, x: int, y: int, center: [], width: int, height: int, prob: float, classID: int):
+    def __init__(self, x: int, y: int, center: [], width: int, height: int, prob: float, classID: int, trackID: int = -1, age: int = 0):
         # Class to store information about a detected object.
+        # trackID and age are filled in by the tracker, -1 means the detection is not tracked
 
         self.x = x
         self.y = y
@@ -112,3 +170,5 @@ class rawDetection:
         self.Height = height
         self.Prob = prob
         self.ClassID = classID
+        self.TrackID = trackID
+        self.Age = age
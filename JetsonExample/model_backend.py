@@ -4,6 +4,8 @@ import numpy as np
 
 USE_CUDA = 0
 USE_CORAL = 0
+USE_ONNXRUNTIME = 0
+USE_TFLITE = 0
 
 try:
     import pycuda.driver as cuda
@@ -20,6 +22,22 @@ try:
 except ImportError:
     print("Coral not found")
 
+try:
+    import onnxruntime as ort
+    USE_ONNXRUNTIME = 1
+except ImportError:
+    print("ONNX Runtime not found")
+
+try:
+    # Prefer the standalone runtime, fall back to the interpreter bundled with full TensorFlow
+    try:
+        from tflite_runtime.interpreter import Interpreter as TFLiteInterpreter, OpResolverType
+    except ImportError:
+        from tensorflow.lite.python.interpreter import Interpreter as TFLiteInterpreter, OpResolverType
+    USE_TFLITE = 1
+except ImportError:
+    print("TFLite not found")
+
 class ModelBackend(ABC):
 
     @property
@@ -27,14 +45,48 @@ class ModelBackend(ABC):
     def dtype(self):
         pass
 
+    @property
+    @abstractmethod
+    def input_buffer(self):
+        # Preallocated (1, height, width, 3) array that preprocessing writes into, inference(input_buffer) avoids any copy
+        pass
+
     @abstractmethod
     def inference(self, image):
+        # image is a (batch, height, width, 3) array with batch in batch_sizes
+        # Returns the raw outputs, each holding the results of the whole batch in image order
         pass
 
+    @property
+    def batch_sizes(self):
+        # Batch sizes inference() accepts
+        return (1,)
+
+    @property
+    def output_quantization(self):
+        # None if inference() returns float outputs, otherwise the (scale, zero point) of each int8 output
+        return None
+
+    @property
+    def output_names(self):
+        # Names of the outputs inference() returns, in that order, or None if the backend does not know them
+        return None
+
+    def write_input(self, fill):
+        # Run fill(buffer) on the buffer inference() reads the next image from and return what to pass to inference()
+        return fill(self.input_buffer)
+
+    @staticmethod
+    def check_input_resolution(input_shape, input_resolution, model_file_path):
+        # Make sure a model with a fixed (batch, height, width, 3) input was exported for the expected profile
+        if input_resolution is not None and tuple(input_shape[1:3]) != tuple(input_resolution):
+            raise Exception("Model {} expects a {}x{} input, but the profile uses {}x{}".format(
+                model_file_path, input_shape[1], input_shape[2], input_resolution[0], input_resolution[1]))
+
 class CUDABackend(ModelBackend):
 
     @staticmethod
-    def get_engine(onnx_file_path, engine_file_path=""):
+    def get_engine(onnx_file_path, engine_file_path="", max_batch_size=1, input_resolution=(320, 320)):
         TRT_LOGGER = trt.Logger()
         # Attempts to load a pre-existing TensorRT engine, otherwise builds and returns a new one.
 
@@ -48,7 +100,7 @@ class CUDABackend(ModelBackend):
                     trt.Runtime(TRT_LOGGER) as runtime:
 
                 config.max_workspace_size = 1 << 28  # Set maximum workspace size to 256MiB
-                builder.max_batch_size = 1
+                builder.max_batch_size = 1  # Explicit batch networks take their batch size from the optimization profile instead
 
                 # Check if ONNX file exists
                 if not os.path.exists(onnx_file_path):
@@ -64,7 +116,15 @@ class CUDABackend(ModelBackend):
                         return None
 
                 # Set input shape for the network
-                network.get_input(0).shape = [1, 320, 320, 3]
+                height, width = input_resolution
+                if max_batch_size == 1:
+                    network.get_input(0).shape = [1, height, width, 3]
+                else:
+                    # Dynamic batch dimension, any batch from 1 to max_batch_size can be run
+                    network.get_input(0).shape = [-1, height, width, 3]
+                    profile = builder.create_optimization_profile()
+                    profile.set_shape(network.get_input(0).name, (1, height, width, 3), (max_batch_size, height, width, 3), (max_batch_size, height, width, 3))
+                    config.add_optimization_profile(profile)
 
                 # Build and serialize the network, then create and return the engine
                 plan = builder.build_serialized_network(network, config)
@@ -80,13 +140,22 @@ class CUDABackend(ModelBackend):
         else:
             return build_engine()
 
-    def __init__(self):
-        current_folder_path = os.path.dirname(os.path.abspath(__file__))
-        onnx_file_path = os.path.join(current_folder_path, "models/pushback_lite.onnx")  # If you change the onnx file to your own model, adjust the file name here
-        engine_file_path = os.path.join(current_folder_path, "models/pushback_lite.trt")  # This should match the .onnx file name
+    def __init__(self, max_batch_size=1, onnx_file_path=None, input_resolution=(320, 320), engine_file_path=None):
+        # max_batch_size above 1 builds a separate engine with a dynamic batch dimension
+        # input_resolution (HW) is fixed when the engine is built, so each resolution needs its own engine_file_path,
+        # see ModelMetadata.engine_path. It defaults to the ONNX file's name with a .trt extension.
+        if onnx_file_path is None:
+            current_folder_path = os.path.dirname(os.path.abspath(__file__))
+            onnx_file_path = os.path.join(current_folder_path, "models/pushback_lite.onnx")
+        if engine_file_path is None:
+            engine_file_path = os.path.splitext(onnx_file_path)[0]
+            if max_batch_size > 1:
+                engine_file_path += "_b{}".format(max_batch_size)
+            engine_file_path += ".trt"
+        self.max_batch_size = max_batch_size
 
         # Get the TensorRT engine
-        self.engine = CUDABackend.get_engine(onnx_file_path, engine_file_path)
+        self.engine = CUDABackend.get_engine(onnx_file_path, engine_file_path, max_batch_size, input_resolution)
 
         # Create an execution context
         self.context = self.engine.create_execution_context()
@@ -94,22 +163,55 @@ class CUDABackend(ModelBackend):
         # Allocate buffers for input and output
         self.inputs, self.outputs, self.bindings, self.stream = cuda_common.allocate_buffers(self.engine)
 
+        # View of the page-locked input buffer in the network input shape for a single image
+        self.__input_shape = (1, input_resolution[0], input_resolution[1], 3)
+        self.__input_buffer = self.inputs[0].host[:trt.volume(self.__input_shape)].reshape(self.__input_shape)
+        self.__output_bindings = [i for i in range(self.engine.num_bindings) if not self.engine.binding_is_input(i)]
+        self.__output_names = [self.engine.get_binding_name(i) for i in self.__output_bindings]
+
     def inference(self, image):
-        self.inputs[0].host = image
+        batch = image.shape[0]
+        if self.max_batch_size > 1:
+            self.context.set_binding_shape(0, (batch,) + self.__input_shape[1:])
+
+        # Copy into the page-locked buffer rather than replacing it, unless the image was already written there
+        host = self.inputs[0].host
+        if not np.may_share_memory(image, host):
+            np.copyto(host[:image.size], image.reshape(-1))
         trt_outputs = cuda_common.do_inference_v2(self.context, bindings=self.bindings, inputs=self.inputs,
                                              outputs=self.outputs, stream=self.stream)
-        
+
+        if self.max_batch_size > 1:
+            # The host buffers are sized for the largest batch, only keep the part this batch filled
+            trt_outputs = [output[:trt.volume(self.context.get_binding_shape(binding))]
+                           for output, binding in zip(trt_outputs, self.__output_bindings)]
+
         return trt_outputs
+
+    @property
+    def batch_sizes(self):
+        return tuple(range(1, self.max_batch_size + 1))
     
     @property
     def dtype(self):
         return np.float32
+
+    @property
+    def input_buffer(self):
+        return self.__input_buffer
+
+    @property
+    def output_names(self):
+        return self.__output_names
     
 class CoralBackend(ModelBackend):
     
-    def __init__(self):
-        current_folder_path = os.path.dirname(os.path.abspath(__file__))
-        tflite_file_path = os.path.join(current_folder_path, "models/pushback_lite.tflite")
+    def __init__(self, native_int8=True, tflite_file_path=None, input_resolution=None):
+        # native_int8 writes the input straight into the interpreter's input tensor and returns the raw int8
+        # outputs for the quantized decoder, instead of copying the input and dequantizing every output
+        if tflite_file_path is None:
+            current_folder_path = os.path.dirname(os.path.abspath(__file__))
+            tflite_file_path = os.path.join(current_folder_path, "models/pushback_lite.tflite")
 
         devices = list_edge_tpus()
         if len(devices) == 0:
@@ -120,12 +222,47 @@ class CoralBackend(ModelBackend):
       
         self.interpreter.allocate_tensors()
 
+        input_details = self.interpreter.get_input_details()[0]
+        ModelBackend.check_input_resolution(input_details["shape"], input_resolution, tflite_file_path)
+        self.__input_buffer = np.zeros(input_details["shape"], dtype=input_details["dtype"])
+        self.__input_index = input_details["index"]
+
+        # Output details don't change between frames, so only look them up once
+        self.__output_details = self.interpreter.get_output_details()
+        self.native_int8 = native_int8 and all(details["dtype"] in (np.int8, np.uint8) and details["quantization"][0] != 0
+                                               for details in self.__output_details)
+        self.__output_quantization = None
+        if self.native_int8:
+            # uint8 outputs are shifted onto int8 codes, which moves their zero point down by 128
+            self.__output_quantization = [(float(details["quantization"][0]),
+                                           int(details["quantization"][1]) - (128 if details["dtype"] == np.uint8 else 0))
+                                          for details in self.__output_details]
+
+    def write_input(self, fill):
+        if not self.native_int8:
+            return fill(self.__input_buffer)
+
+        # Fill the interpreter's own input tensor, the view must be released before invoke()
+        tensor = self.interpreter.tensor(self.__input_index)()
+        fill(tensor)
+        del tensor
+        return None
+
     def inference(self, image):
-        coral_common.set_input(self.interpreter, image)
+        # image is None if write_input() already placed it in the input tensor
+        if image is not None:
+            coral_common.set_input(self.interpreter, image)
         self.interpreter.invoke()
-        output_details = self.interpreter.get_output_details()
-        outputs = [self.dequantize(details, coral_common.output_tensor(self.interpreter, i)) for i, details in enumerate(output_details)]
 
+        if not self.native_int8:
+            return [self.dequantize(details, self.interpreter.get_tensor(details["index"])) for details in self.__output_details]
+
+        outputs = []
+        for details in self.__output_details:
+            output = self.interpreter.get_tensor(details["index"])
+            if output.dtype == np.uint8:
+                output = np.bitwise_xor(output, 0x80).view(np.int8)
+            outputs.append(output)
         return outputs
 
     def quantize(self, details, tensor):
@@ -144,4 +281,139 @@ class CoralBackend(ModelBackend):
     
     @property
     def dtype(self):
-        return np.int8
\ No newline at end of file
+        return np.int8
+
+    @property
+    def input_buffer(self):
+        return self.__input_buffer
+
+    @property
+    def output_names(self):
+        return [details["name"] for details in self.__output_details]
+
+    @property
+    def output_quantization(self):
+        return self.__output_quantization
+
+
+class ONNXRuntimeBackend(ModelBackend):
+    # Runs the ONNX model on the CPU, for devices without CUDA or a Coral and as a reference backend for testing
+
+    GRAPH_OPTIMIZATION_LEVELS = {
+        "disable": "ORT_DISABLE_ALL",
+        "basic": "ORT_ENABLE_BASIC",
+        "extended": "ORT_ENABLE_EXTENDED",
+        "all": "ORT_ENABLE_ALL",
+    }
+
+    def __init__(self, num_threads=None, optimization_level="all", onnx_file_path=None, max_batch_size=1, input_resolution=None):
+        # num_threads sets the intra-op thread count, None lets ONNX Runtime use every core
+        # optimization_level is one of "disable", "basic", "extended" or "all"
+        # max_batch_size above 1 is only used if the model has a dynamic batch dimension
+        # input_resolution (HW) sizes a model with a dynamic input size, or is checked against a fixed one
+        if onnx_file_path is None:
+            current_folder_path = os.path.dirname(os.path.abspath(__file__))
+            onnx_file_path = os.path.join(current_folder_path, "models/pushback_lite.onnx")  # Same model the CUDA backend builds its engine from
+
+        if optimization_level not in ONNXRuntimeBackend.GRAPH_OPTIMIZATION_LEVELS:
+            raise Exception("Invalid argument: Graph optimization level not accepted")
+
+        if not os.path.exists(onnx_file_path):
+            print("ONNX file {} not found.".format(onnx_file_path))
+            exit(-1)
+
+        options = ort.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, ONNXRuntimeBackend.GRAPH_OPTIMIZATION_LEVELS[optimization_level])
+
+        self.session = ort.InferenceSession(onnx_file_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+        model_input = self.session.get_inputs()[0]
+        self.__input_name = model_input.name
+        self.__output_names = [output.name for output in self.session.get_outputs()]
+        # Dynamic dimensions are fixed to 1 for the batch of the single image buffer and to the profile for the image size
+        defaults = [1] + list(input_resolution or (320, 320)) + [3]
+        input_shape = [dim if isinstance(dim, int) and dim > 0 else default for dim, default in zip(model_input.shape, defaults)]
+        ModelBackend.check_input_resolution(input_shape, input_resolution, onnx_file_path)
+        self.__input_buffer = np.zeros(input_shape, dtype=np.float32)
+        dynamic_batch = not (isinstance(model_input.shape[0], int) and model_input.shape[0] > 0)
+        self.__batch_sizes = tuple(range(1, max_batch_size + 1)) if dynamic_batch else (input_shape[0],)
+
+    def inference(self, image):
+        if image.shape[0] > 1:
+            # Batches are fed as they are, ONNX Runtime reads contiguous arrays without copying
+            return self.session.run(self.__output_names, {self.__input_name: np.ascontiguousarray(image, dtype=np.float32)})
+        if not np.may_share_memory(image, self.__input_buffer):
+            np.copyto(self.__input_buffer, image.reshape(self.__input_buffer.shape))
+        return self.session.run(self.__output_names, {self.__input_name: self.__input_buffer})
+
+    @property
+    def batch_sizes(self):
+        return self.__batch_sizes
+
+    @property
+    def dtype(self):
+        return np.float32
+
+    @property
+    def input_buffer(self):
+        return self.__input_buffer
+
+    @property
+    def output_names(self):
+        return self.__output_names
+
+
+class TFLiteBackend(ModelBackend):
+    # Runs a TFLite model on the CPU, optionally through the XNNPACK delegate.
+    # The model must be a plain (not Edge TPU compiled) TFLite model, float or int8 quantized.
+
+    def __init__(self, num_threads=None, use_xnnpack=True, tflite_file_path=None, input_resolution=None):
+        # num_threads sets the number of interpreter threads, None lets TFLite decide
+        # use_xnnpack applies the default XNNPACK delegate, turning it off runs the builtin kernels only
+        if tflite_file_path is None:
+            current_folder_path = os.path.dirname(os.path.abspath(__file__))
+            tflite_file_path = os.path.join(current_folder_path, "models/pushback_lite.tflite")
+
+        if not os.path.exists(tflite_file_path):
+            print("TFLite file {} not found.".format(tflite_file_path))
+            exit(-1)
+
+        op_resolver = OpResolverType.AUTO if use_xnnpack else OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        self.interpreter = TFLiteInterpreter(model_path=tflite_file_path, num_threads=num_threads,
+                                             experimental_op_resolver_type=op_resolver)
+        self.interpreter.allocate_tensors()
+
+        input_details = self.interpreter.get_input_details()[0]
+        ModelBackend.check_input_resolution(input_details["shape"], input_resolution, tflite_file_path)
+        self.__input_index = input_details["index"]
+        self.__input_buffer = np.zeros(input_details["shape"], dtype=input_details["dtype"])
+        self.__output_details = self.interpreter.get_output_details()
+
+    def inference(self, image):
+        self.interpreter.set_tensor(self.__input_index, image.reshape(self.__input_buffer.shape))
+        self.interpreter.invoke()
+        outputs = [self.dequantize(details, self.interpreter.get_tensor(details["index"])) for details in self.__output_details]
+
+        return outputs
+
+    def dequantize(self, details, tensor):
+        scale, zero_point = details["quantization"]
+        if scale == 0:
+            return tensor
+        tensor = ((tensor.astype(np.float32) - zero_point) * scale)
+        return tensor
+
+    @property
+    def dtype(self):
+        return self.__input_buffer.dtype.type
+
+    @property
+    def input_buffer(self):
+        return self.__input_buffer
+
+    @property
+    def output_names(self):
+        return [details["name"] for details in self.__output_details]
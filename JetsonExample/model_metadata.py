@@ -0,0 +1,129 @@
+import json
+import os
+from data_processing import ALL_CATEGORIES
+
+
+class ModelMetadata:
+    # Describes a YOLO model: class list, anchors, the output scales and the input resolution profiles it was exported for.
+    # It is read from a JSON sidecar next to the model files (models/pushback_lite.json), e.g.
+    #
+    # {
+    #     "classes": ["BallBlue", "BallRed"],
+    #     "anchors": [[10, 14], [23, 27], [37, 58], [81, 82], [135, 169], [344, 319]],
+    #     "outputs": [{"mask": [3, 4, 5], "stride": 32}, {"mask": [0, 1, 2], "stride": 16}],
+    #     "obj_threshold": [0.5, 0.5],
+    #     "nms_threshold": 0.5,
+    #     "default_profile": "320",
+    #     "profiles": {
+    #         "320": {"input_resolution": [320, 320], "model": "pushback_lite"},
+    #         "416": {"input_resolution": [416, 416], "model": "pushback_lite_416"}
+    #     }
+    # }
+    #
+    # "outputs" lists the output scales in the order the post-processing uses them. Each scale may give the "name" of
+    # the model output holding it, or its "index" among the model outputs; scales without either are matched to the
+    # model outputs by size. Each profile names the model files (without extension) exported at its resolution, several
+    # profiles may share a model with a dynamic input size.
+    DEFAULT = {
+        "classes": ALL_CATEGORIES,
+        "anchors": [[10, 14], [23, 27], [37, 58], [81, 82], [135, 169], [344, 319]],
+        "outputs": [{"mask": [3, 4, 5], "stride": 32}, {"mask": [0, 1, 2], "stride": 16}],
+        "obj_threshold": [0.5, 0.5],  # Different thresholds for each class label (Blue, Red)
+        "nms_threshold": 0.5,
+        "default_profile": "320",
+        "profiles": {
+            "320": {"input_resolution": [320, 320], "model": "pushback_lite"},
+        },
+    }
+
+    def __init__(self, data, profile=None):
+        # data is the parsed sidecar, profile the name of the resolution profile to use (None for the default one)
+        self.classes = list(data["classes"])
+        self.anchors = [tuple(anchor) for anchor in data["anchors"]]
+        self.masks = [tuple(output["mask"]) for output in data["outputs"]]
+        self.strides = [int(output["stride"]) for output in data["outputs"]]
+        self.output_names = [output.get("name") for output in data["outputs"]]
+        self.output_indices = [output.get("index") for output in data["outputs"]]
+        self.obj_threshold = list(data.get("obj_threshold", [0.5] * len(self.classes)))
+        self.nms_threshold = float(data.get("nms_threshold", 0.5))
+        self.profiles = data["profiles"]
+
+        if profile is None:
+            profile = str(data.get("default_profile", next(iter(self.profiles))))
+        if profile not in self.profiles:
+            raise Exception("Invalid argument: Model profile not accepted, expected one of " + ", ".join(self.profiles))
+        if len(self.obj_threshold) != len(self.classes):
+            raise Exception("Invalid argument: Expected one object threshold per class")
+        if any(index >= len(self.anchors) for mask in self.masks for index in mask):
+            raise Exception("Invalid argument: Output mask refers to a missing anchor")
+
+        self.profile = profile
+        self.default_profile = profile == str(data.get("default_profile", next(iter(self.profiles))))
+        self.model_name = self.profiles[profile]["model"]
+        self.input_resolution = tuple(self.profiles[profile]["input_resolution"])  # HW order
+        for stride in self.strides:
+            if self.input_resolution[0] % stride != 0 or self.input_resolution[1] % stride != 0:
+                raise Exception("Invalid argument: Input resolution of profile " + profile + " is not a multiple of stride " + str(stride))
+
+        # Shape of each output for a single image, in the order of "outputs"
+        channels = len(self.masks[0]) * (5 + len(self.classes))
+        self.output_shapes = [(1, self.input_resolution[0] // stride, self.input_resolution[1] // stride, channels)
+                              for stride in self.strides]
+
+    @staticmethod
+    def default_path():
+        current_folder_path = os.path.dirname(os.path.abspath(__file__))
+        return os.path.join(current_folder_path, "models/pushback_lite.json")
+
+    @staticmethod
+    def load(path=None, profile=None):
+        # Read the sidecar at path, falling back to the built-in description of the PushBack model if there is none
+        if path is None:
+            path = ModelMetadata.default_path()
+        if not os.path.exists(path):
+            print("Model metadata {} not found, using the built-in PushBack model description".format(path))
+            return ModelMetadata(ModelMetadata.DEFAULT, profile)
+        with open(path) as f:
+            return ModelMetadata(json.load(f), profile)
+
+    def model_path(self, extension):
+        # Path of this profile's model file with the given extension, e.g. ".onnx"
+        current_folder_path = os.path.dirname(os.path.abspath(__file__))
+        return os.path.join(current_folder_path, "models", self.model_name + extension)
+
+    def engine_path(self, max_batch_size=1):
+        # Path of the serialized TensorRT engine for this profile, <model>.trt like before there were profiles.
+        # Engines are built for one input resolution, so profiles sharing the default profile's model or each other's
+        # get their resolution appended, e.g. <model>_416x416.trt.
+        path = os.path.splitext(self.model_path(".onnx"))[0]
+        shared = sum(1 for profile in self.profiles.values() if profile["model"] == self.model_name) > 1
+        if shared and not self.default_profile:
+            path += "_{}x{}".format(self.input_resolution[0], self.input_resolution[1])
+        if max_batch_size > 1:
+            path += "_b{}".format(max_batch_size)
+        return path + ".trt"
+
+    def output_order(self, outputs, names=None):
+        # Return the index of the raw backend output (of a single image) holding each scale in "outputs". Scales are
+        # found by the "index" or "name" given in the metadata, names being the backend's output names, and by size
+        # otherwise. Only needs to run once per backend since its outputs never change order.
+        sizes = [output.size for output in outputs]
+        volumes = [shape[0] * shape[1] * shape[2] * shape[3] for shape in self.output_shapes]
+        order = list(self.output_indices)
+        for scale, name in enumerate(self.output_names):
+            if order[scale] is None and name is not None:
+                if names is None or name not in names:
+                    raise Exception("Model output " + name + " not found, the model has outputs " + str(names))
+                order[scale] = list(names).index(name)
+        for scale, index in enumerate(order):
+            if index is not None and (index < 0 or index >= len(sizes) or sizes[index] != volumes[scale]):
+                raise Exception("Model output " + str(index) + " does not match the stride " + str(self.strides[scale]) +
+                                " output of profile " + self.profile)
+        # Scales the metadata does not place are matched by size among the remaining outputs
+        for scale, index in enumerate(order):
+            if index is None:
+                matches = [i for i, size in enumerate(sizes) if size == volumes[scale] and i not in order]
+                if len(matches) == 0:
+                    raise Exception("Model outputs with sizes " + str(sizes) + " do not match the metadata of profile " + self.profile)
+                order[scale] = matches[0]
+        return order
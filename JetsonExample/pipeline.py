@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import deque
+
+
+class FrameQueue:
+    # Bounded queue connecting two pipeline stages.
+    # DROP_OLDEST keeps only the newest items (a slow consumer never works on stale frames),
+    # BLOCK applies back-pressure to the producer until the consumer catches up.
+    DROP_OLDEST = "latest"
+    BLOCK = "block"
+
+    def __init__(self, maxsize=1, policy=DROP_OLDEST):
+        if policy not in (FrameQueue.DROP_OLDEST, FrameQueue.BLOCK):
+            raise Exception("Invalid argument: Queue policy not accepted")
+        if maxsize < 1:
+            raise Exception("Invalid argument: Queue size must be at least 1")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.__items = deque()
+        self.__closed = False
+        self.__cond = threading.Condition()
+
+    def put(self, item):
+        # Add an item, either evicting the oldest entries or waiting for room depending on the policy
+        # Returns False if the queue was closed before the item could be added
+        with self.__cond:
+            if self.policy == FrameQueue.BLOCK:
+                while len(self.__items) >= self.maxsize and not self.__closed:
+                    self.__cond.wait()
+            else:
+                while len(self.__items) >= self.maxsize:
+                    self.__items.popleft()
+                    self.dropped += 1
+            if self.__closed:
+                return False
+            self.__items.append(item)
+            self.__cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        # Remove and return the oldest item, or None if the queue is closed or the timeout expired
+        with self.__cond:
+            if not self.__cond.wait_for(lambda: self.__items or self.__closed, timeout):
+                return None
+            if not self.__items:
+                return None
+            item = self.__items.popleft()
+            self.__cond.notify_all()
+            return item
+
+    def close(self):
+        # Wake up every producer and consumer waiting on this queue so their stages can exit
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+
+    def __len__(self):
+        with self.__cond:
+            return len(self.__items)
+
+
+class PipelineStage:
+    # A single worker thread that takes items from its input queue, runs them through work()
+    # and hands the result to its output queue. A stage without an input queue is a source
+    # (work() is called with None), a stage without an output queue is a sink.
+    # work() may return None to drop the item.
+    def __init__(self, name, work, input_queue=None, output_queue=None):
+        self.name = name
+        self.__work = work
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.processed = 0
+        self.busyTime = 0.0
+        self.__started = False
+        self.__thread = None
+
+    def start(self):
+        self.__started = True
+        self.__thread = threading.Thread(target=self.__run, name=self.name, args=())
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __run(self):
+        while self.__started:
+            item = None
+            if self.input_queue is not None:
+                item = self.input_queue.get()
+                if item is None:
+                    break  # Input queue was closed
+
+            start_time = time.time()
+            result = self.__work(item)
+            self.busyTime += time.time() - start_time
+            self.processed += 1
+
+            if self.output_queue is not None and result is not None:
+                if not self.output_queue.put(result):
+                    break  # Output queue was closed
+
+        print("Pipeline stage", self.name, "stopped.")
+
+    def stop(self):
+        self.__started = False
+
+    def join(self, timeout=None):
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
+    def isAlive(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+
+class Pipeline:
+    # Chains a list of (name, work) stages together with bounded queues and runs each on its own thread.
+    # policies gives the drop policy of each queue between consecutive stages (len(stages) - 1 entries);
+    # a single string applies the same policy to every queue.
+    def __init__(self, stages, policies=FrameQueue.DROP_OLDEST, queue_size=1):
+        if isinstance(policies, str):
+            policies = [policies] * (len(stages) - 1)
+        if len(policies) != len(stages) - 1:
+            raise Exception("Invalid argument: Expected one queue policy per stage connection")
+
+        self.queues = [FrameQueue(queue_size, policy) for policy in policies]
+        self.stages = []
+        for i, (name, work) in enumerate(stages):
+            input_queue = self.queues[i - 1] if i > 0 else None
+            output_queue = self.queues[i] if i < len(self.queues) else None
+            self.stages.append(PipelineStage(name, work, input_queue, output_queue))
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def isAlive(self):
+        # The pipeline is only healthy while every stage is still running
+        return all(stage.isAlive() for stage in self.stages)
+
+    def stop(self, timeout=2.0):
+        for stage in self.stages:
+            stage.stop()
+        for queue in self.queues:
+            queue.close()
+        for stage in self.stages:
+            stage.join(timeout)
+
+    def getStats(self):
+        # Per-stage processed counts and average busy time, plus dropped items per queue
+        outData = {}
+        for stage in self.stages:
+            average = stage.busyTime / stage.processed if stage.processed > 0 else 0.0
+            outData[stage.name] = {'processed': stage.processed, 'avgTime': average}
+            if stage.output_queue is not None:
+                outData[stage.name]['dropped'] = stage.output_queue.dropped
+        return outData
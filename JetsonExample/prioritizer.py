@@ -0,0 +1,84 @@
+import numpy as np
+
+
+class DetectionPrioritizer:
+    # Ranks the detections of an AIRecord and keeps the best ones that fit into one reply to the V5 Brain.
+    # policy is a list of criteria applied in order, later ones break ties of earlier ones:
+    #   distance   -- closest to the robot first, detections without a valid depth last
+    #   confidence -- most probable first
+    #   class      -- in the order of class_priority, classes not listed last
+    #   heading    -- closest to straight ahead of the camera first
+    # At most max_detections are kept, and no more than fit into budget_bytes (if set) of the reply packet.
+    POLICIES = ["distance", "confidence", "class", "heading"]
+
+    def __init__(self, policy=("distance",), class_priority=None, max_detections=50, budget_bytes=None,
+                 screen_center_x=320, focal_length=610.98):
+        # screen_center_x and focal_length (pixels) give the angle of a detection from the camera axis for "heading"
+        policy = list(policy)
+        if len(policy) == 0:
+            raise Exception("Invalid argument: Priority policy needs at least one criterion")
+        for criterion in policy:
+            if criterion not in DetectionPrioritizer.POLICIES:
+                raise Exception("Invalid argument: Priority policy not accepted, expected one of " + ", ".join(DetectionPrioritizer.POLICIES))
+        if max_detections < 0:
+            raise Exception("Invalid argument: Maximum number of detections must not be negative")
+        self.policy = policy
+        self.class_priority = list(class_priority or [])
+        self.max_detections = max_detections
+        self.budget_bytes = budget_bytes
+        self.screen_center_x = screen_center_x
+        self.focal_length = focal_length
+
+    @staticmethod
+    def budget_from_time(budget_ms, baud_rate=115200):
+        # Bytes sent within budget_ms at baud_rate, a byte takes 10 bits on the wire
+        return int(budget_ms / 1000.0 * baud_rate / 10)
+
+    def capacity(self, fixed_bytes, detection_bytes):
+        # Number of detections that fit, for a packet of fixed_bytes plus detection_bytes per detection
+        if self.budget_bytes is None:
+            return self.max_detections
+        return max(0, min(self.max_detections, (self.budget_bytes - fixed_bytes) // detection_bytes))
+
+    def keys(self, detections, position):
+        # One sort key array per criterion of the policy, smaller is better
+        count = len(detections)
+        values = np.array([(det.probability, det.classID, det.depth, det.mapLocattion.x, det.mapLocattion.y,
+                            det.screenLocation.x + det.screenLocation.width / 2.0) for det in detections], dtype=np.float64).reshape(count, 6)
+        keys = []
+        for criterion in self.policy:
+            if criterion == "distance":
+                distance = np.hypot(values[:, 3] - position.x, values[:, 4] - position.y)
+                keys.append(np.where(values[:, 2] > 0, distance, np.inf))
+            elif criterion == "confidence":
+                keys.append(-values[:, 0])
+            elif criterion == "class":
+                rank = np.full(count, len(self.class_priority), dtype=np.float64)
+                for i, classID in enumerate(self.class_priority):
+                    rank[values[:, 1] == classID] = i
+                keys.append(rank)
+            else:
+                keys.append(np.abs(np.arctan2(values[:, 5] - self.screen_center_x, self.focal_length)))
+        return keys
+
+    def select(self, detections, position, limit=None):
+        # Indices of the detections to send, best first. limit caps the count further, e.g. to what fits into a packet.
+        count = len(detections)
+        limit = self.max_detections if limit is None else min(limit, self.max_detections)
+        if count == 0 or limit <= 0:
+            return np.zeros(0, dtype=int)
+        keys = self.keys(detections, position)
+        if len(keys) == 1:
+            key = keys[0]
+            if limit < count:
+                # Only the kept detections need to be sorted
+                top = np.argpartition(key, limit - 1)[:limit]
+                return top[np.argsort(key[top], kind="stable")]
+            return np.argsort(key, kind="stable")
+        # lexsort sorts by its last key first
+        return np.lexsort(keys[::-1])[:limit]
+
+    def prioritize(self, record, fixed_bytes, detection_bytes):
+        # Copy of the AIRecord keeping only the detections that fit into the reply, best first
+        order = self.select(record.detections, record.position, self.capacity(fixed_bytes, detection_bytes))
+        return type(record)(record.position, [record.detections[i] for i in order])
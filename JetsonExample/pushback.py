@@ -4,25 +4,40 @@ import numpy as np
 import cv2
 import time
 import os
+import argparse
+import json
+import platform
+import subprocess
 from glob import glob
 
 from V5MapPosition import MapPosition
 
 import V5Comm
 from V5Comm import V5SerialComms
+from prioritizer import DetectionPrioritizer
 from V5Position import Position
 from V5Position import V5GPS
+from filter import FILTERS
 from V5Web import V5WebData
 from V5Web import Statistics
 
-from model import Model, rawDetection
+from model import Model
+from tracker import MultiObjectTracker
+from change_detector import ChangeDetector
+from registration import Registration
+from depth_estimator import DepthEstimator
+from pipeline import Pipeline, FrameQueue
 
 
 class Camera:
     # Class handles Camera object instantiation and data requests.
-    def __init__(self):
+    # playback_file replays a RealSense .bag recording instead of opening the camera
+    def __init__(self, playback_file=None):
         self.pipeline = rs.pipeline()  # Initialize RealSense pipeline
         self.config = rs.config()
+        self.playback_file = playback_file
+        if playback_file is not None:
+            self.config.enable_device_from_file(playback_file, repeat_playback=True)
         # Enable depth stream at 640x480 in z16 encoding at 30fps
         self.config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
         # Enable color stream at 640x480 in rgb8 encoding at 30fps
@@ -33,22 +48,212 @@ class Camera:
         # Obtain depth sensor and calculate depth scale
         depth_sensor = self.profile.get_device().first_depth_sensor()
         self.depth_scale = depth_sensor.get_depth_scale()
-        self.profile.get_device().query_sensors()[1].set_option(rs.option.auto_exposure_priority, 0.0)
+        if self.playback_file is None:
+            self.profile.get_device().query_sensors()[1].set_option(rs.option.auto_exposure_priority, 0.0)
+        else:
+            # Hand out recorded frames as fast as they are consumed instead of at the recorded rate
+            self.profile.get_device().as_playback().set_real_time(False)
 
     def get_frames(self):
         return self.pipeline.wait_for_frames()  # Wait and fetch frames from the pipeline
 
+    def get_latest_frames(self):
+        # Wait for a frameset, then drain any newer ones already queued so the caller always gets the freshest images
+        frames = self.pipeline.wait_for_frames()
+        while True:
+            newer = self.pipeline.poll_for_frames()
+            if not newer:
+                break
+            frames = newer
+        # Keep the frameset alive outside of the RealSense frame pool so it can be handed to another thread
+        frames.keep()
+        return frames
+
     def stop(self):
         self.pipeline.stop()  # Stop the pipeline when finished
 
+    @staticmethod
+    def capture_time(frames):
+        # When the frameset was captured, in seconds on the time.monotonic() clock the GPS pose history uses.
+        # Global and system time stamps are host wall clock milliseconds and are moved onto that clock; the camera's
+        # own hardware clock cannot be, and recordings play back long after they were captured, so then (or if the
+        # result is not within the last second) the time the frames arrived has to do.
+        now = time.monotonic()
+        if frames.get_frame_timestamp_domain() in (rs.timestamp_domain.global_time, rs.timestamp_domain.system_time):
+            capture_time = now - (time.time() - frames.get_timestamp() / 1000.0)
+            if now - 1.0 <= capture_time <= now:
+                return capture_time
+        return now
+
+
+class SyntheticCamera:
+    # Feeds still images with a synthetic depth image through a RealSense software device,
+    # so the rest of the program receives genuine RealSense framesets without a camera attached.
+    # Used by the benchmark mode, mirrors the interface of Camera.
+    WIDTH = 640
+    HEIGHT = 480
+    FOCAL_LENGTH = 610.98  # Same focal length in pixels as MapPosition.REALDIST
+    CAMERA_HEIGHT = 0.3  # Height of the virtual camera above the floor in meters
+    MAX_DEPTH = 6.0  # Depth of everything above the horizon in meters
+
+    def __init__(self, image_paths):
+        if len(image_paths) == 0:
+            raise Exception("Invalid argument: No images to play back")
+        self.image_paths = image_paths
+        self.depth_scale = 0.001
+        self.frame_number = 0
+
+    def start(self):
+        # Load every image up front so file access is not part of the measurements
+        self.color_images = []
+        for path in self.image_paths:
+            image = cv2.imread(path)
+            if image is None:
+                raise Exception("Could not read image " + path)
+            image = cv2.resize(image, (SyntheticCamera.WIDTH, SyntheticCamera.HEIGHT), interpolation=cv2.INTER_AREA)
+            self.color_images.append(np.ascontiguousarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)))
+        self.depth_image = SyntheticCamera.floor_depth(self.depth_scale)
+
+        intrinsics = rs.intrinsics()
+        intrinsics.width = SyntheticCamera.WIDTH
+        intrinsics.height = SyntheticCamera.HEIGHT
+        intrinsics.ppx = SyntheticCamera.WIDTH / 2
+        intrinsics.ppy = SyntheticCamera.HEIGHT / 2
+        intrinsics.fx = SyntheticCamera.FOCAL_LENGTH
+        intrinsics.fy = SyntheticCamera.FOCAL_LENGTH
+        intrinsics.model = rs.distortion.none
+        intrinsics.coeffs = [0, 0, 0, 0, 0]
+        identity = rs.extrinsics()
+        identity.rotation = [1, 0, 0, 0, 1, 0, 0, 0, 1]
+        identity.translation = [0, 0, 0]
+
+        self.device = rs.software_device()
+        self.depth_sensor = self.device.add_sensor("Depth")
+        self.color_sensor = self.device.add_sensor("Color")
+        self.depth_profile = self.depth_sensor.add_video_stream(
+            SyntheticCamera.video_stream(rs.stream.depth, rs.format.z16, 2, 0, intrinsics)).as_video_stream_profile()
+        self.color_profile = self.color_sensor.add_video_stream(
+            SyntheticCamera.video_stream(rs.stream.color, rs.format.rgb8, 3, 1, intrinsics)).as_video_stream_profile()
+        self.depth_profile.register_extrinsics_to(self.color_profile, identity)
+        self.color_profile.register_extrinsics_to(self.depth_profile, identity)
+        self.depth_sensor.add_read_only_option(rs.option.depth_units, self.depth_scale)
+        self.device.create_matcher(rs.matchers.default)
+
+        self.syncer = rs.syncer()
+        self.depth_sensor.open(self.depth_profile)
+        self.color_sensor.open(self.color_profile)
+        self.depth_sensor.start(self.syncer)
+        self.color_sensor.start(self.syncer)
+        # Processing reads the stream calibration through profile.get_stream()
+        self.profile = self
+
+    def get_stream(self, stream):
+        return self.depth_profile if stream == rs.stream.depth else self.color_profile
+
+    @staticmethod
+    def video_stream(stream, format, bpp, uid, intrinsics):
+        video_stream = rs.video_stream()
+        video_stream.type = stream
+        video_stream.index = 0
+        video_stream.uid = uid
+        video_stream.width = SyntheticCamera.WIDTH
+        video_stream.height = SyntheticCamera.HEIGHT
+        video_stream.fps = 30
+        video_stream.bpp = bpp
+        video_stream.fmt = format
+        video_stream.intrinsics = intrinsics
+        return video_stream
+
+    @staticmethod
+    def floor_depth(depth_scale):
+        # Depth image of a flat floor seen by a level camera, in z16 units
+        rows = np.arange(SyntheticCamera.HEIGHT, dtype=np.float64) - SyntheticCamera.HEIGHT / 2 + 0.5
+        with np.errstate(divide="ignore"):
+            depth = np.where(rows > 0, SyntheticCamera.CAMERA_HEIGHT * SyntheticCamera.FOCAL_LENGTH / rows, SyntheticCamera.MAX_DEPTH)
+        depth = np.minimum(depth, SyntheticCamera.MAX_DEPTH) / depth_scale
+        return np.ascontiguousarray(np.repeat(depth.astype(np.uint16)[:, None], SyntheticCamera.WIDTH, axis=1))
+
+    def get_frames(self):
+        # Push the next image and the synthetic depth into the software device and return the matched frameset.
+        # The matcher can release a lone frame before it has seen both streams, in that case push another pair.
+        while True:
+            self.push_frames()
+            frames = self.syncer.wait_for_frames()
+            if frames.get_depth_frame() and frames.get_color_frame():
+                return frames
+
+    def push_frames(self):
+        color_image = self.color_images[self.frame_number % len(self.color_images)]
+        timestamp = self.frame_number * 1000.0 / 30
+        for sensor, profile, pixels in ((self.depth_sensor, self.depth_profile, self.depth_image),
+                                        (self.color_sensor, self.color_profile, color_image)):
+            frame = rs.software_video_frame()
+            frame.pixels = pixels
+            frame.bpp = pixels.itemsize * (pixels.shape[2] if pixels.ndim == 3 else 1)
+            frame.stride = frame.bpp * SyntheticCamera.WIDTH
+            frame.timestamp = timestamp
+            frame.domain = rs.timestamp_domain.hardware_clock
+            frame.frame_number = self.frame_number
+            frame.profile = profile
+            sensor.on_video_frame(frame)
+        self.frame_number += 1
+
+    def get_latest_frames(self):
+        frames = self.get_frames()
+        frames.keep()
+        return frames
+
+    def stop(self):
+        self.depth_sensor.stop()
+        self.color_sensor.stop()
+        self.depth_sensor.close()
+        self.color_sensor.close()
+
+
+class InferredDetections:
+    # Detections of a frame the model ran on, kept so the frames skipped after it can reuse them. They are recorded as
+    # soon as the detector is done; depths and confidences are filled in once that frame's depth has been computed,
+    # which in the pipelined mode happens later, on the depth stage's thread.
+    def __init__(self, detections):
+        self.detections = detections
+        self.depths = None
+        self.confidences = None
+
 
 class Processing:
     # Class to handle camera data processing, preparing for inference, and running inference on camera image.
-    def __init__(self, depth_scale, profile):
+    # Every detector result goes through a MultiObjectTracker, so detections keep the same track ID across frames.
+    # detection_options control how often the model runs:
+    #   detect_interval -- run the model on every Nth frame and move the last detections with a constant velocity tracker in between
+    #   confidence_trigger -- run the model early once the least confident tracked detection is below this probability
+    #   motion_trigger -- run the model early once a tracked box was extrapolated further than this many pixels
+    #   motion_gate -- skip frames that barely differ from the last frame the model ran on and reuse its detections,
+    #                  tuned by pixel_threshold, area_threshold, depth_threshold and max_skip (see ChangeDetector)
+    #   align_depth -- resample every depth image onto the color image's pixel grid, instead of mapping each detection
+    #   min_depth_confidence -- depth confidence (see DepthEstimator) below which a detection counts as having no depth
+    def __init__(self, depth_scale, profile, model_options=None, detection_options=None):
         self.depth_scale = depth_scale
         self.align_to = rs.stream.color
         self.align = rs.align(self.align_to)  # Align depth frames to color stream
-        self.model = Model()  # Initialize the object detection model
+        self.model = Model(**(model_options or {}))  # Initialize the object detection model
+        detection_options = detection_options or {}
+        self.detect_interval = detection_options.get("detect_interval", 1)
+        self.confidence_trigger = detection_options.get("confidence_trigger", 0.0)
+        self.motion_trigger = detection_options.get("motion_trigger", None)
+        if self.detect_interval < 1:
+            raise Exception("Invalid argument: Detection interval must be at least 1")
+        self.tracker = MultiObjectTracker()
+        self.frames_since_inference = 0
+        self.inference_count = 0
+        self.tracked_count = 0
+
+        self.change_detector = None
+        if detection_options.get("motion_gate", False):
+            self.change_detector = ChangeDetector(detection_options.get("pixel_threshold", 12), detection_options.get("area_threshold", 0.01),
+                                                  detection_options.get("depth_threshold", None), depth_scale,
+                                                  detection_options.get("max_skip", 30))
+        self.skipped_count = 0
+        self.last_inference = None  # InferredDetections of the last frame that was not skipped
         self.HUE = 0
         self.SATURATION = 0
         self.VALUE = 0
@@ -56,6 +261,11 @@ class Processing:
         self.color_intrin = profile.get_stream(rs.stream.color).as_video_stream_profile().get_intrinsics()
         self.depth_to_color_extrin =  profile.get_stream(rs.stream.depth).as_video_stream_profile().get_extrinsics_to( profile.get_stream(rs.stream.color))
         self.color_to_depth_extrin =  profile.get_stream(rs.stream.color).as_video_stream_profile().get_extrinsics_to( profile.get_stream(rs.stream.depth))
+        # Color to depth pixel mapping, precomputed from the intrinsics and extrinsics above
+        self.registration = Registration(self.depth_intrin, self.color_intrin, self.color_to_depth_extrin, depth_scale)
+        self.align_depth = detection_options.get("align_depth", False)
+        self.depth_estimator = DepthEstimator(depth_scale)
+        self.min_depth_confidence = detection_options.get("min_depth_confidence", 0.0)
 
     def process_image(self, image):
         # Enhances the image by shifting the hue and adjusting saturation and brightness.
@@ -87,41 +297,28 @@ class Processing:
         else:
             self.VALUE = (100 - abs(newHSV.v)) / 100
 
-    def project_color_to_depth(self, depth_data, pixel):
-        row, col = pixel
-        depth_pixel = tuple(map(int, rs.rs2_project_color_pixel_to_depth_pixel(depth_data, 
-                            self.depth_scale, 0.05, 3, self.depth_intrin, self.color_intrin, self.color_to_depth_extrin, 
-                            self.depth_to_color_extrin, [row, col])))
-        return depth_pixel
-
-    def get_depth(self, detection: rawDetection, depth_img):
-        # Compute the bounding box indices for the detection
-        height = detection.Height
-        width = detection.Width
-
-        low_limit_y = 45
-        high_limit_y = 55
-        low_limit_x = 45
-        high_limit_x = 55
-        # Calculate the indices of 10% of the detection.
-        top = int(detection.y) + height * low_limit_y // 100
-        bottom = int(detection.y) + height * high_limit_y // 100
-        left = int(detection.x) + width * low_limit_x // 100
-        right = int(detection.x) + width * high_limit_x // 100
-
-        # Extract depth values and scale them
-        top_left = self.project_color_to_depth(self.depth_frame_aligned.get_data(), (top, left))
-        bottom_right = self.project_color_to_depth(self.depth_frame_aligned.get_data(), (bottom, right))
-
-        r1, c1 = top_left
-        r2, c2 = bottom_right
-        depth_img = depth_img[r1:r2, c1:c2]
-        depth_img = depth_img * self.depth_scale
-        # Filter non-zero depth values
-        depth_img = depth_img[depth_img != 0]
-        # Compute and return mean depth value
-        meanDepth = np.nanmean(depth_img)
-        return meanDepth
+    def get_depths(self, detections, depth_img):
+        # Depth in meters and depth confidence of every detection, 0 for both where the depth could not be measured
+        # Each detection's depth is the median of the valid depth pixels in the central 10% of its box
+        count = len(detections)
+        if count == 0:
+            return self.depth_estimator.estimate(depth_img, np.zeros((0, 4), dtype=int))
+        boxes = np.array([[detection.x, detection.y, detection.Width, detection.Height] for detection in detections], dtype=np.float32)
+
+        low_limit = 0.45
+        high_limit = 0.55
+        # Calculate the corners of 10% of every detection
+        corners = np.empty((count, 2, 2), dtype=np.float32)  # (left, top), (right, bottom)
+        corners[:, 0] = boxes[:, :2] + boxes[:, 2:] * low_limit
+        corners[:, 1] = boxes[:, :2] + boxes[:, 2:] * high_limit
+
+        # Find the matching depth pixels of all corners at once, an aligned depth image already shares the color image's pixel grid
+        if not self.align_depth:
+            corners = self.registration.color_to_depth(corners.reshape(-1, 2), depth_image=depth_img).reshape(count, 2, 2)
+        corners = np.rint(np.nan_to_num(corners)).astype(int)
+        corners[:, 1] = np.maximum(corners[:, 1], corners[:, 0] + 1)  # At least one pixel, even for tiny boxes
+        rois = np.stack([corners[:, 0, 1], corners[:, 0, 0], corners[:, 1, 1], corners[:, 1, 0]], axis=1)
+        return self.depth_estimator.estimate(depth_img, rois)
 
     def align_frames(self, frames):
         # Align depth frames to color frames
@@ -136,36 +333,99 @@ class Processing:
 
     def process_frames(self, frames):
         # Align frames and extract color and depth images
-        # Apply a color map to the depth image
         self.align_frames(frames)
         depth_image = np.asanyarray(self.depth_frame_aligned.get_data())
         color_image = np.asanyarray(self.color_frame_aligned.get_data())
+        if self.align_depth:
+            depth_image = self.registration.align(depth_image)
         # apply color correction to image
         color_image = self.process_image(color_image)
-        depthImage = cv2.normalize(depth_image, None, alpha=0.01, beta=255, norm_type=cv2.NORM_MINMAX, dtype=cv2.CV_8U)
-        depth_map = cv2.applyColorMap(depthImage, cv2.COLORMAP_JET)
-
-        return depth_image, color_image, depth_map
-
-    def detect_objects(self, color_image):
-        # Perform object detection and return results using the Model class in model.py
-        output, detections = self.model.inference(color_image)
-        return output, detections
-
-    def compute_detections(self, v5, detections, depth_image):
+        # The dashboard's color mapped depth preview is built by V5WebData, only when a client asks for it
+
+        return depth_image, color_image
+
+    def detect_objects(self, color_image, timestamp=None):
+        # Perform object detection and return results using the Model class in model.py, tagged with track IDs
+        # With a detection interval above 1, frames in between get the tracker's extrapolated detections instead
+        if timestamp is None:
+            timestamp = time.time()
+        if self.detect_interval == 1 or self.needs_inference(timestamp):
+            output, detections = self.model.inference(color_image)
+            self.tracker.update(detections, timestamp, (color_image.shape[1], color_image.shape[0]))
+            self.frames_since_inference = 0
+            self.inference_count += 1
+            self.last_inference = InferredDetections(detections)
+            return output, detections
+
+        self.frames_since_inference += 1
+        self.tracked_count += 1
+        detections = self.tracker.predict(timestamp)
+        self.last_inference = InferredDetections(detections)
+        return color_image, detections
+
+    def needs_inference(self, timestamp):
+        # Run the model every detect_interval frames, or earlier if the tracked detections became unreliable
+        if self.tracker.timestamp is None or self.frames_since_inference + 1 >= self.detect_interval:
+            return True
+        if self.tracker.min_confidence() < self.confidence_trigger:
+            return True
+        return self.motion_trigger is not None and self.tracker.displacement(timestamp) > self.motion_trigger
+
+    def scene_changed(self, color_image, depth_image=None):
+        # Returns False if the frame is close enough to the last inferred one that its detections can be reused
+        if self.change_detector is None:
+            return True
+        if self.last_inference is None:
+            self.change_detector.reset()
+        return self.change_detector.changed(color_image, depth_image)
+
+    def reuse_detections(self, v5, inferred, depth_image, capture_time=None):
+        # AIRecord of the inferred frame (InferredDetections) with the current robot position and map positions computed from it.
+        # If that frame's depths are unknown, e.g. because the pipeline dropped the frame before its depth stage, the
+        # reused boxes are measured in this frame's depth image instead, which barely differs from that frame.
+        self.skipped_count += 1
+        if inferred.depths is None:
+            return self.compute_detections(v5, inferred.detections, depth_image, capture_time=capture_time, inferred=inferred)
+        return self.compute_detections(v5, inferred.detections, None, depths=inferred.depths, confidences=inferred.confidences,
+                                       capture_time=capture_time)
+
+    def skip_ratio(self):
+        total_frames = self.inference_count + self.tracked_count + self.skipped_count
+        return self.skipped_count / total_frames if total_frames > 0 else 0.0
+
+    def compute_detections(self, v5, detections, depth_image, depths=None, confidences=None, capture_time=None, inferred=None):
         # Create AIRecord and compute detections with depth and image data.
         # Each AIRecord contains the ClassID, Probablity, and depth information for each detection
         # In addition to the detection's camera image and map position information.
-        aiRecord = V5Comm.AIRecord(v5.get_v5Pos(), [])
-        for detection in detections:
-            depth = self.get_depth(detection, depth_image)
+        # depths and confidences give the depth and depth confidence of every detection when they are already known,
+        # depth_image is not used then
+        # capture_time (see Camera.capture_time) projects the detections from where the robot was when the frame was
+        # taken instead of where it is once inference is done, which matters while the robot turns
+        # inferred is the InferredDetections of this frame, that keeps the computed depths for the frames skipped after it
+        aiRecord = V5Comm.AIRecord(v5.get_v5Pos(capture_time), [])
+        if depths is None:
+            depths, confidences = self.get_depths(detections, depth_image)
+            if inferred is not None:
+                inferred.depths = depths
+                inferred.confidences = confidences
+        elif confidences is None:
+            confidences = np.ones(len(depths), dtype=np.float32)
+        # A depth the estimator is not confident about counts as no depth at all
+        depths = np.where(confidences >= self.min_depth_confidence, depths, 0.0)
+        # Field positions of all detections at once, from the detection centers and depths
+        screenPoints = np.array([[detection.Center[0], detection.Center[1], depth] for detection, depth in zip(detections, depths)], dtype=np.float64)
+        mapLocations = v5.v5Map.computeMapLocations(screenPoints, aiRecord.position).tolist()
+        for detection, depth, confidence, mapPos in zip(detections, depths, confidences.tolist(), mapLocations):
             imageDet = V5Comm.ImageDetection(
                 int(detection.x),
                 int(detection.y),
                 int(detection.Width),
                 int(detection.Height),
             )
-            mapPos = v5.v5Map.computeMapLocation(detection, depth, aiRecord.position)
+            # A detection without a valid depth has no map position, (0, 0, 0) for the dashboard. It is not sent to the
+            # Brain at all (see MainApp.set_v5), which would take (0, 0, 0) for an object in the middle of the field.
+            if depth <= 0:
+                mapPos = (0.0, 0.0, 0.0)
             mapDet = V5Comm.MapDetection(mapPos[0], mapPos[1], mapPos[2])
             detect = V5Comm.Detection(
                 int(detection.ClassID),
@@ -173,6 +433,9 @@ class Processing:
                 float(depth),
                 imageDet,
                 mapDet,
+                int(detection.TrackID),
+                int(detection.Age),
+                confidence,
             )
             aiRecord.detections.append(detect)
         return aiRecord
@@ -192,7 +455,7 @@ class Rendering:
                 self.cpu_temp_path = thermal_zone + "/temp"
 
     def set_images(self, output, depth_image):
-        # Update web data with color and depth images
+        # Update web data with the color and raw depth images, their previews are only encoded when the dashboard asks for them
         self.web_data.setColorImage(output)
         self.web_data.setDepthImage(depth_image)
 
@@ -200,9 +463,10 @@ class Rendering:
         # Update web data with detection information
         self.web_data.setDetectionData(aiRecord)
     
-    def set_stats(self, stats, v5Pos, start_time, invoke_time, run_time):
-        # Set the statistics for FPS, invoke time, run time, and CPU temp
+    def set_stats(self, stats, v5Pos, start_time, invoke_time, run_time, skip_ratio=0.0):
+        # Set the statistics for FPS, invoke time, run time, skipped frames, and CPU temp
         stats.fps = 1.0 / (time.time() - start_time)
+        stats.skipRatio = skip_ratio
         stats.gpsConnected = v5Pos.isConnected()
         stats.invokeTime = invoke_time
         stats.runTime = time.time() - run_time
@@ -222,34 +486,151 @@ class Rendering:
             cv2.destroyAllWindows()
 
 
+class FrameData:
+    # Carries everything produced for a single camera frame from one pipeline stage to the next
+    def __init__(self, frames, start_time):
+        self.frames = frames
+        self.start_time = start_time
+        self.capture_time = None  # time.monotonic() seconds the frames were captured at, to look up the robot position
+        self.depth_image = None
+        self.color_image = None
+        self.output = None
+        self.detections = None
+        self.invoke_time = 0
+        self.skipped = False  # The model did not run, the detections of the last inferred frame are reused
+        self.inferred = None  # InferredDetections this frame produced, or reuses if it was skipped
+        self.aiRecord = None
+
+
+class BenchmarkApp:
+    # Runs every stage of a frame without the V5 Brain, GPS or web dashboard attached and reports per stage latency.
+    # Serial packet building and web encoding are timed as well, without sending anything.
+    STAGES = ["capture", "process", "inference", "depth", "packet", "web"]
+
+    def __init__(self, camera, model_options=None, detection_options=None, preview_scale=1.0):
+        print("Starting Initialization...")
+        self.camera = camera
+        self.preview_scale = preview_scale
+        self.camera.start()
+        self.processing = Processing(self.camera.depth_scale, self.camera.profile, model_options, detection_options)
+        self.v5Map = MapPosition()
+        # Fixed robot pose at the center of the field facing forward
+        self.position = Position(1, Position.STATUS_CONNECTED, 0, 0, 0, 0, 0, 0)
+        print("Initialized")
+
+    def get_v5Pos(self, timestamp=None):
+        return self.position
+
+    def run(self, frame_count, warmup=10):
+        # Process warmup + frame_count frames and return the report for the last frame_count of them
+        timings = {stage: [] for stage in BenchmarkApp.STAGES}
+        total_detections = 0
+        print("\nStarting Benchmark")
+        try:
+            start_time = time.perf_counter()
+            for i in range(warmup + frame_count):
+                if i == warmup:
+                    start_time = time.perf_counter()
+                times = [time.perf_counter()]
+                frames = self.camera.get_frames()
+                times.append(time.perf_counter())
+                depth_image, color_image = self.processing.process_frames(frames)
+                times.append(time.perf_counter())
+                if self.processing.scene_changed(color_image, depth_image):
+                    output, detections = self.processing.detect_objects(color_image)
+                    times.append(time.perf_counter())
+                    aiRecord = self.processing.compute_detections(self, detections, depth_image, inferred=self.processing.last_inference)
+                else:
+                    output = color_image
+                    times.append(time.perf_counter())
+                    aiRecord = self.processing.reuse_detections(self, self.processing.last_inference, depth_image)
+                times.append(time.perf_counter())
+                V5Comm.V5SerialPacket(V5Comm.MAP_PACKET_TYPE, aiRecord).to_Serial()
+                times.append(time.perf_counter())
+                # A dashboard client asking for both previews of every frame, the worst case
+                V5WebData.encodeImageElement(output, True, self.preview_scale)
+                V5WebData.encodeImageElement(V5WebData.colorizeDepth(depth_image, self.preview_scale), False)
+                json.dumps(aiRecord.to_JSON())
+                times.append(time.perf_counter())
+
+                if i >= warmup:
+                    total_detections += len(aiRecord.detections)
+                    for stage, begin, end in zip(BenchmarkApp.STAGES, times, times[1:]):
+                        timings[stage].append(end - begin)
+            elapsed = time.perf_counter() - start_time
+        finally:
+            self.camera.stop()
+
+        return self.report(timings, elapsed, frame_count, total_detections)
+
+    def report(self, timings, elapsed, frame_count, total_detections):
+        # Machine readable summary, latencies in milliseconds
+        def summary(samples):
+            samples = np.asarray(samples) * 1000.0
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            mean = float(np.mean(samples))
+            return {'mean_ms': mean, 'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99),
+                    'fps': 1000.0 / mean if mean > 0 else 0.0}
+
+        outData = {}
+        outData['frames'] = frame_count
+        outData['fps'] = frame_count / elapsed
+        outData['detectionsPerFrame'] = total_detections / frame_count
+        total_frames = self.processing.inference_count + self.processing.tracked_count + self.processing.skipped_count
+        outData['inferenceRatio'] = self.processing.inference_count / total_frames if total_frames > 0 else 0.0
+        outData['skipRatio'] = self.processing.skip_ratio()
+        outData['backend'] = type(self.processing.model.backend).__name__
+        outData['profile'] = self.processing.model.metadata.profile
+        outData['stages'] = {stage: summary(samples) for stage, samples in timings.items()}
+        outData['stages']['total'] = summary(np.sum([timings[stage] for stage in BenchmarkApp.STAGES], axis=0))
+        outData['device'] = {'machine': platform.machine(), 'node': platform.node(), 'python': platform.python_version()}
+        try:
+            outData['commit'] = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                                        cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            outData['commit'] = None
+        outData['timestamp'] = time.time()
+        return outData
+
+
 class MainApp:
-    def __init__(self):
+    def __init__(self, model_options=None, detection_options=None, preview_scale=1.0, priority_options=None, brain_port=None, gps_port=None,
+                 telemetry_file="filtered_data_simple.txt", gps_filter="mean"):
         # Initialize various components including camera, processing, and rendering
+        # model_options are passed on to Model, e.g. to select the backend, detection_options to Processing
+        # preview_scale shrinks the dashboard's color and depth previews
+        # priority_options are passed on to DetectionPrioritizer, which picks the detections sent to the V5 Brain
+        # brain_port and gps_port are serial device paths, e.g. of V5Simulator.py, found by their USB description when None
+        # telemetry_file receives the filtered GPS positions, None turns the log off, gps_filter names the GPS filter
         print("Starting Initialization...")
         self.camera = Camera()
         self.camera.start()
-        self.processing = Processing(self.camera.depth_scale, self.camera.profile)
+        self.processing = Processing(self.camera.depth_scale, self.camera.profile, model_options, detection_options)
 
-        self.v5 = V5SerialComms()
+        self.v5 = V5SerialComms(brain_port, prioritizer=DetectionPrioritizer(**(priority_options or {})))
         self.v5Map = MapPosition()
-        self.v5Pos = V5GPS()
-        self.v5Web = V5WebData(self.v5Map, self.v5Pos, self.processing)
+        self.v5Pos = V5GPS(gps_port, telemetry_file, gps_filter)
+        self.v5Web = V5WebData(self.v5Map, self.v5Pos, self.processing, previewScale=preview_scale, v5Comms=self.v5)
         self.stats = Statistics(0, 0, 0, 640, 480, 0, False)
         self.rendering = Rendering(self.v5Web)
 
         time.sleep(1)
         print("Initialized")
 
-    def get_v5Pos(self):
+    def get_v5Pos(self, timestamp=None):
         # Return V5Position object if GPS is connected but default values if not connected
+        # With a timestamp (time.monotonic() seconds) the position the robot had at that time
         if self.v5Pos is None:
             return Position(0, 0, 0, 0, 0, 0, 0, 0)
+        if timestamp is not None:
+            return self.v5Pos.getPositionAt(timestamp)
         return self.v5Pos.getPosition()
 
     def set_v5(self, aiRecord):
         # Set detection data to the Brain if it is connected but does not set any data if None
+        # Detections without a valid depth are left out, their map position means nothing to the Brain's findTarget
         if self.v5 is not None:
-            self.v5.setDetectionData(aiRecord)
+            self.v5.setDetectionData(V5Comm.AIRecord(aiRecord.position, [detection for detection in aiRecord.detections if detection.depth > 0]))
 
     def run(self):
         # Start main loop: capture frames, process, detect objects, compute detections, render and display
@@ -262,20 +643,197 @@ class MainApp:
             while True:
                 start_time = time.time()  # start time of the loop
                 frames = self.camera.get_frames()
-                depth_image, color_image, depth_map = self.processing.process_frames(frames)
+                capture_time = Camera.capture_time(frames)
+                depth_image, color_image = self.processing.process_frames(frames)
                 invoke_time = time.time()
-                output, detections = self.processing.detect_objects(color_image)
-                invoke_time = time.time() - invoke_time
-                aiRecord = self.processing.compute_detections(self, detections, depth_image)
+                if self.processing.scene_changed(color_image, depth_image):
+                    output, detections = self.processing.detect_objects(color_image, start_time)
+                    invoke_time = time.time() - invoke_time
+                    aiRecord = self.processing.compute_detections(self, detections, depth_image, capture_time=capture_time,
+                                                                  inferred=self.processing.last_inference)
+                else:
+                    output = color_image
+                    invoke_time = 0
+                    aiRecord = self.processing.reuse_detections(self, self.processing.last_inference, depth_image, capture_time)
                 self.set_v5(aiRecord)
-                self.rendering.set_images(output, depth_map)
+                self.rendering.set_images(output, depth_image)
                 self.rendering.set_detection_data(aiRecord)
-                self.rendering.set_stats(self.stats, self.v5Pos, start_time, invoke_time, run_time)
+                self.rendering.set_stats(self.stats, self.v5Pos, start_time, invoke_time, run_time, self.processing.skip_ratio())
                 # self.rendering.display_output(output)
         finally:
             self.camera.stop()
 
+    def capture_stage(self, _):
+        # Pipeline source: grab the freshest frameset from the camera
+        frames = self.camera.get_latest_frames()
+        data = FrameData(frames, time.time())
+        data.capture_time = Camera.capture_time(frames)
+        return data
+
+    def preprocess_stage(self, data):
+        # Align and color correct the frames
+        data.depth_image, data.color_image = self.processing.process_frames(data.frames)
+        return data
+
+    def inference_stage(self, data):
+        # Resize into the backend's input buffer and run the model. The network input is written on this stage,
+        # since the backend owns a single input buffer that must not change while the model reads it.
+        # The detections are recorded here, so a skipped frame reuses those of the last inferred frame even while
+        # that frame still waits for the depth stage or was dropped from its queue
+        if not self.processing.scene_changed(data.color_image, data.depth_image):
+            data.skipped = True
+            data.output = data.color_image
+            data.inferred = self.processing.last_inference
+            return data
+        invoke_time = time.time()
+        data.output, data.detections = self.processing.detect_objects(data.color_image, data.start_time)
+        data.invoke_time = time.time() - invoke_time
+        data.inferred = self.processing.last_inference
+        return data
+
+    def depth_stage(self, data):
+        # Compute depth and field position of every detection, or only the field positions for a skipped frame
+        if data.skipped:
+            data.aiRecord = self.processing.reuse_detections(self, data.inferred, data.depth_image, data.capture_time)
+        else:
+            data.aiRecord = self.processing.compute_detections(self, data.detections, data.depth_image, capture_time=data.capture_time,
+                                                               inferred=data.inferred)
+        return data
+
+    def publish_stage(self, data):
+        # Send results to the V5 Brain and the web dashboard
+        self.set_v5(data.aiRecord)
+        self.rendering.set_images(data.output, data.depth_image)
+        self.rendering.set_detection_data(data.aiRecord)
+        # FPS is measured between consecutive published frames, since several frames are in flight at once
+        last_publish = self.last_publish
+        self.last_publish = time.time()
+        self.rendering.set_stats(self.stats, self.v5Pos, last_publish, data.invoke_time, self.run_time, self.processing.skip_ratio())
+        return None
+
+    def run_pipelined(self, policies=FrameQueue.DROP_OLDEST, queue_size=1):
+        # Same work as run(), but capture, preprocess, inference, depth/map and publish each run on their own thread,
+        # connected by bounded queues so the camera, CPU and accelerator are busy at the same time.
+        # policies is a single queue policy or a list of 4, one per queue between consecutive stages.
+        self.v5.start()
+        self.v5Pos.start()
+        self.v5Web.start()
+        self.run_time = time.time()
+        self.last_publish = time.time()
+        pipeline = Pipeline([
+            ("capture", self.capture_stage),
+            ("preprocess", self.preprocess_stage),
+            ("inference", self.inference_stage),
+            ("depth", self.depth_stage),
+            ("publish", self.publish_stage),
+        ], policies, queue_size)
+        print("\nStarting Pipelined Loop")
+        try:
+            pipeline.start()
+            while pipeline.isAlive():
+                time.sleep(0.5)
+        finally:
+            pipeline.stop()
+            self.camera.stop()
+
 
 if __name__ == "__main__":
-    app = MainApp()  # Create the main application
-    app.run()  # Run the application
+    parser = argparse.ArgumentParser(description="VEX AI Jetson/Raspberry Pi object detection")
+    parser.add_argument("--pipeline", action="store_true", help="run capture, preprocess, inference, depth and publish on separate threads")
+    parser.add_argument("--queue-policy", nargs="+", default=[FrameQueue.DROP_OLDEST], choices=[FrameQueue.DROP_OLDEST, FrameQueue.BLOCK],
+                        help="drop policy of the pipeline queues, either one for all queues or one per queue")
+    parser.add_argument("--queue-size", type=int, default=1, help="capacity of each pipeline queue")
+    parser.add_argument("--profile", default=None, help="input resolution profile from the model metadata, e.g. 256, 320 or 416")
+    parser.add_argument("--model-metadata", default=None, help="model metadata file, models/pushback_lite.json by default")
+    parser.add_argument("--backend", choices=Model.BACKENDS, default=None, help="inference backend, picks the first available one by default")
+    parser.add_argument("--threads", type=int, default=None, help="number of CPU threads used by the onnx and tflite backends")
+    parser.add_argument("--graph-optimization", choices=["disable", "basic", "extended", "all"], default="all",
+                        help="graph optimization level of the onnx backend")
+    parser.add_argument("--no-xnnpack", action="store_true", help="disable the XNNPACK delegate of the tflite backend")
+    parser.add_argument("--no-native-int8", action="store_true", help="dequantize the coral outputs instead of decoding them as int8")
+    parser.add_argument("--detect-interval", type=int, default=1, help="run the model every N frames and track the detections in between")
+    parser.add_argument("--confidence-trigger", type=float, default=0.0,
+                        help="with --detect-interval, run the model early when a tracked detection is less confident than this")
+    parser.add_argument("--motion-trigger", type=float, default=None,
+                        help="with --detect-interval, run the model early when a tracked box moved more than this many pixels")
+    parser.add_argument("--motion-gate", action="store_true", help="skip inference on frames that barely changed since the last inferred frame")
+    parser.add_argument("--motion-threshold", type=int, default=12, help="with --motion-gate, gray level change that counts a pixel as changed")
+    parser.add_argument("--motion-area", type=float, default=0.01, help="with --motion-gate, fraction of changed pixels that triggers inference")
+    parser.add_argument("--depth-threshold", type=float, default=None,
+                        help="with --motion-gate, depth change in meters that counts a pixel as changed (depth is ignored by default)")
+    parser.add_argument("--max-skip", type=int, default=30, help="with --motion-gate, largest number of frames skipped in a row")
+    parser.add_argument("--min-depth-confidence", type=float, default=0.0,
+                        help="depth confidence (0 to 1) below which a detection has no depth and is not sent to the V5 Brain")
+    parser.add_argument("--align-depth", action="store_true", help="resample every depth image onto the color image, cheaper than rs.align")
+    parser.add_argument("--priority", nargs="+", default=["distance"], choices=DetectionPrioritizer.POLICIES,
+                        help="order of the detections sent to the V5 Brain, later criteria break ties of earlier ones")
+    parser.add_argument("--class-priority", nargs="+", type=int, default=None, help="class IDs in order of importance for --priority class")
+    parser.add_argument("--max-detections", type=int, default=50, help="largest number of detections sent to the V5 Brain per reply")
+    parser.add_argument("--reply-budget-ms", type=float, default=None,
+                        help="send only as many detections as fit into this many milliseconds of the 115200 baud link per reply")
+    parser.add_argument("--brain-port", default=None, help="serial device of the V5 Brain, e.g. /dev/ttyACM1, found automatically by default")
+    parser.add_argument("--gps-port", default=None, help="serial device of the GPS sensor, found automatically by default")
+    parser.add_argument("--gps-filter", choices=list(FILTERS.keys()), default="mean",
+                        help="GPS smoothing: 10 sample moving average, exponential average or constant velocity Kalman filter")
+    parser.add_argument("--telemetry-file", default="filtered_data_simple.txt", help="file the filtered GPS positions are logged to")
+    parser.add_argument("--no-telemetry", action="store_true", help="do not log the filtered GPS positions")
+    parser.add_argument("--preview-scale", type=float, default=1.0, help="scale of the dashboard's color and depth previews, e.g. 0.5")
+    parser.add_argument("--benchmark", action="store_true", help="measure throughput headless, without camera, V5 Brain or GPS, and print a JSON report")
+    parser.add_argument("--benchmark-input", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "*.jpg"),
+                        help="RealSense .bag recording, image directory or image glob pattern to benchmark with")
+    parser.add_argument("--benchmark-frames", type=int, default=300, help="number of measured frames")
+    parser.add_argument("--benchmark-output", default=None, help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    model_options = {
+        "backend": args.backend,
+        "num_threads": args.threads,
+        "optimization_level": args.graph_optimization,
+        "use_xnnpack": not args.no_xnnpack,
+        "native_int8": not args.no_native_int8,
+        "profile": args.profile,
+        "metadata_path": args.model_metadata,
+    }
+
+    detection_options = {
+        "detect_interval": args.detect_interval,
+        "confidence_trigger": args.confidence_trigger,
+        "motion_trigger": args.motion_trigger,
+        "motion_gate": args.motion_gate,
+        "pixel_threshold": args.motion_threshold,
+        "area_threshold": args.motion_area,
+        "depth_threshold": args.depth_threshold,
+        "max_skip": args.max_skip,
+        "align_depth": args.align_depth,
+        "min_depth_confidence": args.min_depth_confidence,
+    }
+
+    priority_options = {
+        "policy": args.priority,
+        "class_priority": args.class_priority,
+        "max_detections": args.max_detections,
+        "budget_bytes": None if args.reply_budget_ms is None else DetectionPrioritizer.budget_from_time(args.reply_budget_ms),
+    }
+
+    if args.benchmark:
+        if args.benchmark_input.endswith(".bag"):
+            camera = Camera(args.benchmark_input)
+        elif os.path.isdir(args.benchmark_input):
+            camera = SyntheticCamera(sorted(glob(os.path.join(args.benchmark_input, "*.jpg")) + glob(os.path.join(args.benchmark_input, "*.png"))))
+        else:
+            camera = SyntheticCamera(sorted(glob(args.benchmark_input)))
+        report = BenchmarkApp(camera, model_options, detection_options, args.preview_scale).run(args.benchmark_frames)
+        if args.benchmark_output is not None:
+            with open(args.benchmark_output, "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+        exit(0)
+
+    app = MainApp(model_options, detection_options, args.preview_scale, priority_options, args.brain_port, args.gps_port,
+                  None if args.no_telemetry else args.telemetry_file, args.gps_filter)  # Create the main application
+    if args.pipeline:
+        policies = args.queue_policy[0] if len(args.queue_policy) == 1 else args.queue_policy
+        app.run_pipelined(policies, args.queue_size)  # Run the application with pipelined stages
+    else:
+        app.run()  # Run the application
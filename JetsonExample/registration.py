@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+
+
+class Registration:
+    # Maps color image pixels to depth image pixels using the camera intrinsics and the color to depth extrinsics.
+    # A color pixel seen at depth z lands on the depth pixel project(R * ray * z + t), where ray is the pixel's viewing
+    # direction in the color camera. R * ray is fixed for every color pixel and is computed once here, so mapping any
+    # number of pixels at any depth is a few vectorized operations instead of a search along the ray per pixel.
+    #
+    # The intrinsics only need width, height, ppx, ppy, fx and fy, and the extrinsics rotation (column major, as
+    # RealSense reports it) and translation in meters, so plain objects work as well as pyrealsense2's.
+    # Lens distortion is ignored, the RealSense depth stream has none and the color stream's is negligible.
+    def __init__(self, depth_intrin, color_intrin, color_to_depth_extrin, depth_scale=0.001, nominal_depth=1.0):
+        # depth_scale converts raw depth image values to meters
+        # nominal_depth (meters) is assumed for pixels without a valid depth reading
+        self.depth_scale = depth_scale
+        self.nominal_depth = nominal_depth
+        self.color_size = (color_intrin.width, color_intrin.height)  # WH
+        self.depth_size = (depth_intrin.width, depth_intrin.height)  # WH
+        self.color_focal = np.array([color_intrin.fx, color_intrin.fy], dtype=np.float32)
+        self.color_center = np.array([color_intrin.ppx, color_intrin.ppy], dtype=np.float32)
+        self.depth_focal = np.array([depth_intrin.fx, depth_intrin.fy], dtype=np.float32)
+        self.depth_center = np.array([depth_intrin.ppx, depth_intrin.ppy], dtype=np.float32)
+        self.rotation = np.asarray(color_to_depth_extrin.rotation, dtype=np.float32).reshape(3, 3).T
+        self.translation = np.asarray(color_to_depth_extrin.translation, dtype=np.float32)
+
+        # Viewing direction of every color pixel, rotated into the depth camera
+        xs = (np.arange(self.color_size[0], dtype=np.float32) - self.color_center[0]) / self.color_focal[0]
+        ys = (np.arange(self.color_size[1], dtype=np.float32) - self.color_center[1]) / self.color_focal[1]
+        rays = np.empty((self.color_size[1], self.color_size[0], 3), dtype=np.float32)
+        rays[..., 0] = xs[None, :]
+        rays[..., 1] = ys[:, None]
+        rays[..., 2] = 1.0
+        rotated_rays = rays @ self.rotation.T
+        # Kept per component, full frame maps are built with in-place operations on these
+        self.ray_x = np.ascontiguousarray(rotated_rays[..., 0])
+        self.ray_y = np.ascontiguousarray(rotated_rays[..., 1])
+        self.ray_z = np.ascontiguousarray(rotated_rays[..., 2])
+
+        # Full frame maps for a scene at the nominal depth, the starting point of align()
+        self.map_x, self.map_y = self.depth_map(nominal_depth)
+
+    def project(self, points):
+        # Depth image pixel (x, y) of points (..., 3) given in the depth camera's frame
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return points[..., :2] / points[..., 2:3] * self.depth_focal + self.depth_center
+
+    def color_to_depth(self, pixels, depths=None, depth_image=None):
+        # Depth image pixels (N, 2) of color image pixels (N, 2), both as (x, y).
+        # depths gives the depth in meters of each pixel (or one for all). Without it the depth is looked up in
+        # depth_image: pixels are mapped at the nominal depth first, then again at the depth found there.
+        pixels = np.asarray(pixels, dtype=np.float32).reshape(-1, 2)
+        rays = np.empty((len(pixels), 3), dtype=np.float32)
+        rays[:, :2] = (pixels - self.color_center) / self.color_focal
+        rays[:, 2] = 1.0
+        rays = rays @ self.rotation.T
+
+        if depths is None:
+            depths = np.full(len(pixels), self.nominal_depth, dtype=np.float32)
+            if depth_image is not None:
+                depths = self.sample_depth(depth_image, self.project(rays * depths[:, None] + self.translation))
+        depths = np.broadcast_to(np.asarray(depths, dtype=np.float32), (len(pixels),))
+        return self.project(rays * depths[:, None] + self.translation)
+
+    def sample_depth(self, depth_image, depth_pixels):
+        # Depth in meters at depth_pixels (N, 2), the nominal depth where the reading is missing or out of the image
+        columns = np.clip(np.rint(depth_pixels[:, 0]), 0, self.depth_size[0] - 1).astype(int)
+        rows = np.clip(np.rint(depth_pixels[:, 1]), 0, self.depth_size[1] - 1).astype(int)
+        depths = depth_image[rows, columns].astype(np.float32) * self.depth_scale
+        depths[depths <= 0] = self.nominal_depth
+        return depths
+
+    def depth_map(self, depth):
+        # cv2.remap maps (x and y, each (H, W) in color image size) that pull depth pixels into the color image for a
+        # scene at depth, given in meters as a single value or per color pixel.
+        # Dividing R * ray * z + t by z gives R * ray + t / z, so only the inverse depth is needed per pixel.
+        inverse_depth = np.reciprocal(np.asarray(depth, dtype=np.float32))
+        tx, ty, tz = self.translation
+        z = self.ray_z + tz * inverse_depth
+        map_x = self.ray_x + tx * inverse_depth
+        map_x /= z
+        map_x *= self.depth_focal[0]
+        map_x += self.depth_center[0]
+        map_y = self.ray_y + ty * inverse_depth
+        map_y /= z
+        map_y *= self.depth_focal[1]
+        map_y += self.depth_center[1]
+        return map_x, map_y
+
+    def align(self, depth_image, refine=True):
+        # Depth image resampled onto the color image's pixel grid, a much cheaper stand-in for rs.align.
+        # The first pass assumes the nominal depth everywhere; with refine every pixel is mapped again at the depth
+        # the first pass found, which removes most of the parallax error for objects away from the nominal depth.
+        aligned = cv2.remap(depth_image, self.map_x, self.map_y, cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        if refine:
+            depth = aligned.astype(np.float32)
+            depth *= self.depth_scale
+            depth[aligned == 0] = self.nominal_depth
+            map_x, map_y = self.depth_map(depth)
+            aligned = cv2.remap(depth_image, map_x, map_y, cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        return aligned
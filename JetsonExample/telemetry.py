@@ -0,0 +1,119 @@
+import atexit
+from collections import deque
+import os
+import threading
+
+
+class TelemetryLogger:
+    # CSV log for samples produced on time critical threads, like the GPS reader.
+    # log() only appends the row to an in-memory ring buffer; a background thread formats everything buffered and
+    # writes it with one call every flush_interval seconds, so a slow SD card never stalls the producer. When the
+    # buffer is full the oldest row is dropped and counted instead of blocking. Once the file reaches max_bytes it is
+    # renamed to <path>.1 (older ones shift up to <path>.<backups>) and a new file is started.
+    def __init__(self, path, capacity=4096, flush_interval=0.5, max_bytes=10 * 1024 * 1024, backups=3, enabled=True):
+        if capacity <= 0:
+            raise Exception("Invalid argument: Telemetry buffer capacity must be positive")
+        if max_bytes <= 0:
+            raise Exception("Invalid argument: Telemetry file size limit must be positive")
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.enabled = enabled
+        self.__rows = deque(maxlen=capacity)
+        self.__lock = threading.Lock()
+        self.__write_lock = threading.Lock()  # Held while writing, flush() may be called from any thread
+        self.__file = None
+        self.__size = 0
+        self.logged = 0
+        self.dropped = 0
+        self.written = 0
+        self.bytes_written = 0
+        self.rotations = 0
+        self.__started = True
+        self.__wake = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, args=())
+        self.__thread.daemon = True
+        self.__thread.start()
+        atexit.register(self.close)  # Rows still queued at exit are written too
+
+    def log(self, *values):
+        # Queue one row, never blocks on the file
+        if not self.enabled:
+            return
+        with self.__lock:
+            if len(self.__rows) == self.__rows.maxlen:
+                self.dropped += 1
+            self.__rows.append(values)
+            self.logged += 1
+
+    def set_enabled(self, enabled):
+        # Switch logging on or off, rows already queued are still written
+        self.enabled = enabled
+
+    def __run(self):
+        while self.__started:
+            self.__wake.wait(self.flush_interval)
+            self.__wake.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                # The batch is lost, keep the producer going and try again with the next one
+                print("Could not write telemetry to ", self.path, ". Exception: ", e)
+
+    def flush(self):
+        # Write all queued rows now, in the order they were logged
+        with self.__write_lock:
+            with self.__lock:
+                rows = self.__rows
+                self.__rows = deque(maxlen=rows.maxlen)
+            if len(rows) == 0:
+                return
+            data = "".join([", ".join([str(value) for value in row]) + "\n" for row in rows])
+            if self.__file is not None and self.__size > 0 and self.__size + len(data) > self.max_bytes:
+                self.__rotate()
+            if self.__file is None:
+                self.__file = open(self.path, "a")
+                self.__size = self.__file.tell()
+            self.__file.write(data)
+            self.__file.flush()
+            self.__size += len(data)
+            self.written += len(rows)
+            self.bytes_written += len(data)
+
+    def __rotate(self):
+        # Shift <path>.1 ... to <path>.2 ..., the oldest falls off, and move the current file to <path>.1
+        self.__file.close()
+        self.__file = None
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                older = "{}.{}".format(self.path, i)
+                if os.path.exists(older):
+                    os.replace(older, "{}.{}".format(self.path, i + 1))
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+
+    def close(self):
+        # Stop the writer thread and write what is left
+        self.__started = False
+        self.__wake.set()
+        self.__thread.join()
+        self.flush()
+        with self.__write_lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+    def get_stats(self):
+        with self.__lock:
+            stats = {}
+            stats["enabled"] = self.enabled
+            stats["logged"] = self.logged
+            stats["queued"] = len(self.__rows)
+            stats["dropped"] = self.dropped
+            stats["written"] = self.written
+            stats["bytesWritten"] = self.bytes_written
+            stats["rotations"] = self.rotations
+            return stats
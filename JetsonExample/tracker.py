@@ -0,0 +1,267 @@
+import math
+import numpy as np
+from model import rawDetection
+
+# scipy's assignment solver is used when it is installed, otherwise the numpy implementation below
+try:
+    from scipy.optimize import linear_sum_assignment as scipy_linear_sum_assignment
+    USE_SCIPY = True
+except ImportError:
+    print("scipy not found, using the numpy assignment solver")
+    USE_SCIPY = False
+
+
+def box_iou(boxes1, boxes2):
+    # Pairwise IoU between two arrays of x, y, width, height boxes
+    x1 = np.maximum(boxes1[:, None, 0], boxes2[None, :, 0])
+    y1 = np.maximum(boxes1[:, None, 1], boxes2[None, :, 1])
+    x2 = np.minimum(boxes1[:, None, 0] + boxes1[:, None, 2], boxes2[None, :, 0] + boxes2[None, :, 2])
+    y2 = np.minimum(boxes1[:, None, 1] + boxes1[:, None, 3], boxes2[None, :, 1] + boxes2[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    union = (boxes1[:, 2] * boxes1[:, 3])[:, None] + (boxes2[:, 2] * boxes2[:, 3])[None, :] - intersection
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(union > 0, intersection / union, 0.0)
+
+
+def hungarian(cost):
+    # Minimum cost assignment of a (rows, columns) cost matrix with rows <= columns, shortest augmenting path method.
+    # Written with plain lists since the groups solved here are small, where numpy's per call overhead dominates.
+    # Returns the assigned column of every row.
+    rows, columns = cost.shape
+    cost = cost.tolist()
+    u = [0.0] * (rows + 1)
+    v = [0.0] * (columns + 1)
+    match = [0] * (columns + 1)  # Row (1-based) assigned to each column, 0 for none; column 0 is the virtual start
+    way = [0] * (columns + 1)
+
+    for row in range(1, rows + 1):
+        match[0] = row
+        column = 0
+        minimum = [math.inf] * (columns + 1)
+        used = [False] * (columns + 1)
+        while True:
+            used[column] = True
+            current_row = match[column]
+            row_cost = cost[current_row - 1]
+            row_potential = u[current_row]
+            delta = math.inf
+            next_column = 0
+            for j in range(1, columns + 1):
+                if not used[j]:
+                    reduced = row_cost[j - 1] - row_potential - v[j]
+                    if reduced < minimum[j]:
+                        minimum[j] = reduced
+                        way[j] = column
+                    if minimum[j] < delta:
+                        delta = minimum[j]
+                        next_column = j
+            for j in range(columns + 1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    minimum[j] -= delta
+            column = next_column
+            if match[column] == 0:
+                break
+        # Flip the augmenting path
+        while column != 0:
+            previous = way[column]
+            match[column] = match[previous]
+            column = previous
+
+    assignment = np.zeros(rows, dtype=int)
+    for j in range(1, columns + 1):
+        if match[j] != 0:
+            assignment[match[j] - 1] = j - 1
+    return assignment
+
+
+def linear_assignment(cost, max_cost):
+    # Optimal one to one pairing of rows and columns that minimizes the total cost.
+    # Pairs with a cost above max_cost (including infinite costs) are never returned.
+    # Returns the matched row and column indices.
+    if cost.size == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    # Forbidden pairs get a cost no valid assignment can reach, so they are only picked when nothing else is left
+    bounded = np.where(cost <= max_cost, cost, max_cost * 2 + 1.0)
+
+    if USE_SCIPY:
+        rows, columns = scipy_linear_sum_assignment(bounded)
+    else:
+        rows, columns = [], []
+        # Rows and columns only compete within groups connected by allowed pairs, which are usually tiny,
+        # so each group is solved on its own and single pairs need no solver at all
+        for group_rows, group_columns in connected_groups(cost <= max_cost):
+            if len(group_rows) == 1 and len(group_columns) == 1:
+                rows.append(group_rows)
+                columns.append(group_columns)
+            elif len(group_rows) <= len(group_columns):
+                rows.append(group_rows)
+                columns.append(group_columns[hungarian(bounded[np.ix_(group_rows, group_columns)])])
+            else:
+                columns.append(group_columns)
+                rows.append(group_rows[hungarian(bounded[np.ix_(group_rows, group_columns)].T)])
+        if len(rows) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        rows, columns = np.concatenate(rows), np.concatenate(columns)
+
+    valid = cost[rows, columns] <= max_cost
+    return rows[valid], columns[valid]
+
+
+def connected_groups(allowed):
+    # Split a (rows, columns) matrix of allowed pairs into groups of rows and columns linked by allowed pairs.
+    # Rows and columns without any allowed pair are left out.
+    rows, columns = allowed.shape
+    row_labels = np.arange(rows)
+    while True:
+        # Every column takes the smallest label of its rows and every row the smallest label of its columns until stable
+        column_labels = np.where(allowed, row_labels[:, None], rows).min(axis=0)
+        new_row_labels = np.minimum(row_labels, np.where(allowed, column_labels[None, :], rows).min(axis=1))
+        if np.array_equal(new_row_labels, row_labels):
+            break
+        row_labels = new_row_labels
+
+    linked_rows = allowed.any(axis=1)
+    groups = []
+    for label in np.unique(row_labels[linked_rows]):
+        groups.append((np.flatnonzero(linked_rows & (row_labels == label)), np.flatnonzero(column_labels == label)))
+    return groups
+
+
+class MultiObjectTracker:
+    # Follows detections across frames and gives every object a persistent track ID.
+    # Each detector result is associated with the existing tracks by an optimal assignment on IoU (with a center distance
+    # fallback for fast objects), unmatched detections start new tracks and tracks that went unmatched for more than
+    # max_misses detector runs are removed. Every track keeps a smoothed box and a constant pixel velocity, which
+    # predict() uses to move the tracks forward on frames without inference.
+    def __init__(self, min_iou=0.1, max_match_distance=1.0, max_misses=5, box_smoothing=0.7, velocity_smoothing=0.5):
+        # min_iou is the lowest IoU between a track and a detection that can be matched on overlap alone
+        # max_match_distance is the largest center movement for a match without overlap, relative to the box size
+        # max_misses is the number of detector runs a track survives without a matching detection
+        # box_smoothing and velocity_smoothing weight new measurements against the track state (1 keeps only the newest)
+        self.min_iou = min_iou
+        self.max_match_distance = max_match_distance
+        self.max_misses = max_misses
+        self.box_smoothing = box_smoothing
+        self.velocity_smoothing = velocity_smoothing
+
+        self.boxes = np.zeros((0, 4), dtype=np.float32)  # Smoothed x, y, width, height at timestamp
+        self.velocities = np.zeros((0, 2), dtype=np.float32)  # Pixels per second
+        self.classes = np.zeros(0, dtype=int)
+        self.probs = np.zeros(0, dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int32)
+        self.ages = np.zeros(0, dtype=np.int32)  # Detector runs since the track was born
+        self.misses = np.zeros(0, dtype=np.int32)  # Detector runs since the track was last matched
+        self.next_id = 1
+        self.timestamp = None
+        self.image_size = (640, 480)  # WH
+
+    def update(self, detections, timestamp, image_size=None):
+        # Associate a fresh detector result taken at timestamp (seconds) with the tracks.
+        # Returns the detections with their TrackID and Age set.
+        if image_size is not None:
+            self.image_size = image_size
+        boxes = np.array([[d.Center[0], d.Center[1], d.Width, d.Height] for d in detections], dtype=np.float32).reshape(-1, 4)
+        classes = np.array([d.ClassID for d in detections], dtype=int)
+        probs = np.array([d.Prob for d in detections], dtype=np.float32)
+
+        dt = timestamp - self.timestamp if self.timestamp is not None else 0.0
+        predicted = self.predicted_boxes(timestamp)
+        tracks, matched = linear_assignment(self.association_cost(predicted, boxes, classes), 1.0 + self.max_match_distance)
+
+        # Matched tracks: blend the detection into the predicted state and re-estimate the velocity
+        if len(tracks) > 0:
+            if dt > 0:
+                measured = (self.centers(boxes[matched]) - self.centers(self.boxes[tracks])) / dt
+                self.velocities[tracks] = self.velocity_smoothing * measured + (1 - self.velocity_smoothing) * self.velocities[tracks]
+            self.boxes[tracks] = self.box_smoothing * boxes[matched] + (1 - self.box_smoothing) * predicted[tracks]
+            self.probs[tracks] = probs[matched]
+        unmatched_tracks = np.ones(len(self.ids), dtype=bool)
+        unmatched_tracks[tracks] = False
+        self.boxes[unmatched_tracks] = predicted[unmatched_tracks]
+        self.misses += unmatched_tracks
+        self.misses[tracks] = 0
+        self.ages += 1
+
+        # Unmatched detections start new tracks
+        track_of_detection = np.full(len(boxes), -1)
+        track_of_detection[matched] = tracks
+        births = np.flatnonzero(track_of_detection < 0)
+        if len(births) > 0:
+            track_of_detection[births] = len(self.ids) + np.arange(len(births))
+            new_ids = (self.next_id + np.arange(len(births))) % 0x7FFFFFFF
+            self.next_id = (self.next_id + len(births)) % 0x7FFFFFFF
+            self.boxes = np.concatenate((self.boxes, boxes[births]))
+            self.velocities = np.concatenate((self.velocities, np.zeros((len(births), 2), dtype=np.float32)))
+            self.classes = np.concatenate((self.classes, classes[births]))
+            self.probs = np.concatenate((self.probs, probs[births]))
+            self.ids = np.concatenate((self.ids, new_ids.astype(np.int32)))
+            self.ages = np.concatenate((self.ages, np.ones(len(births), dtype=np.int32)))
+            self.misses = np.concatenate((self.misses, np.zeros(len(births), dtype=np.int32)))
+
+        # Tag every detection with the track it belongs to
+        for detection, track_id, age in zip(detections, self.ids[track_of_detection].tolist(), self.ages[track_of_detection].tolist()):
+            detection.TrackID = track_id
+            detection.Age = age
+
+        # Remove tracks that were missed too often
+        alive = self.misses <= self.max_misses
+        if not np.all(alive):
+            self.boxes, self.velocities, self.classes, self.probs = self.boxes[alive], self.velocities[alive], self.classes[alive], self.probs[alive]
+            self.ids, self.ages, self.misses = self.ids[alive], self.ages[alive], self.misses[alive]
+
+        self.timestamp = timestamp
+        return detections
+
+    def association_cost(self, track_boxes, boxes, classes):
+        # Cost of pairing each track with each detection: 1 - IoU for overlapping boxes, or 1 plus the center distance
+        # relative to the track's box size for boxes that moved apart. Infinite for different classes or gated pairs.
+        iou = box_iou(track_boxes, boxes)
+        distance = np.linalg.norm(self.centers(track_boxes)[:, None, :] - self.centers(boxes)[None, :, :], axis=-1)
+        distance /= np.maximum(np.maximum(track_boxes[:, 2], track_boxes[:, 3]), 1.0)[:, None]
+        cost = np.where(iou >= self.min_iou, 1.0 - iou, 1.0 + distance)
+        cost[(self.classes[:, None] != classes[None, :]) | ((iou < self.min_iou) & (distance > self.max_match_distance))] = np.inf
+        return cost
+
+    @staticmethod
+    def centers(boxes):
+        return boxes[:, :2] + boxes[:, 2:] / 2
+
+    def predicted_boxes(self, timestamp):
+        # Track boxes moved to timestamp with their velocity
+        boxes = self.boxes.copy()
+        if self.timestamp is not None:
+            boxes[:, :2] += self.velocities * max(0.0, timestamp - self.timestamp)
+        return boxes
+
+    def displacement(self, timestamp):
+        # Largest distance in pixels any track has been extrapolated by at timestamp
+        if self.timestamp is None or len(self.boxes) == 0:
+            return 0.0
+        return float(np.max(np.linalg.norm(self.velocities, axis=-1))) * max(0.0, timestamp - self.timestamp)
+
+    def min_confidence(self):
+        visible = self.probs[self.misses == 0]
+        return float(np.min(visible)) if len(visible) > 0 else 1.0
+
+    def predict(self, timestamp):
+        # Return the tracks seen by the last detector run moved to timestamp as rawDetections, clipped to the image
+        if self.timestamp is None:
+            return []
+        visible = self.misses == 0
+        boxes = self.predicted_boxes(timestamp)[visible]
+        image_width, image_height = self.image_size
+        boxes[:, 0] = np.clip(boxes[:, 0], -boxes[:, 2] / 2, image_width - boxes[:, 2] / 2)
+        boxes[:, 1] = np.clip(boxes[:, 1], -boxes[:, 3] / 2, image_height - boxes[:, 3] / 2)
+
+        detections = []
+        for (x_coord, y_coord, width, height), category, prob, track_id, age in zip(
+                boxes, self.classes[visible], self.probs[visible], self.ids[visible], self.ages[visible]):
+            # Same rounding as Model.draw_bboxes
+            left = max(0, int(np.floor(x_coord + 0.5)))
+            top = max(0, int(np.floor(y_coord + 0.5)))
+            detections.append(rawDetection(left, top, [x_coord, y_coord], int(width), int(height), prob, int(category),
+                                           int(track_id), int(age)))
+        return detections
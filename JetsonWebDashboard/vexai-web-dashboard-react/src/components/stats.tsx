@@ -6,6 +6,7 @@ import DeviceThermostatIcon from "@mui/icons-material/DeviceThermostat";
 import AutofpsSelectIcon from "@mui/icons-material/AutofpsSelect";
 import VideocamIcon from "@mui/icons-material/Videocam";
 import TimerIcon from "@mui/icons-material/Timer";
+import SkipNextIcon from "@mui/icons-material/SkipNext";
 import { useAppSelector } from "../state/hooks";
 
 /**
@@ -95,6 +96,16 @@ const Stats = () => {
               ).toFixed(1)}ms`}</Typography>
             </ListItem>
           </Tooltip>
+          {response.stats.skipRatio !== undefined && (
+            <Tooltip title="Skipped Frames" placement="right">
+              <ListItem disablePadding sx={{ paddingBottom: "7px" }}>
+                <SkipNextIcon sx={{ color: "white" }} fontSize="small" />
+                <Typography variant="caption" sx={{ color: "white" }}>
+                  {`${(response.stats.skipRatio * 100).toFixed(0)}%`}
+                </Typography>
+              </ListItem>
+            </Tooltip>
+          )}
           <Tooltip title="Run Time" placement="right">
             <ListItem disablePadding sx={{ paddingBottom: "7px" }}>
               <TimerIcon sx={{ color: "white" }} fontSize="small" />
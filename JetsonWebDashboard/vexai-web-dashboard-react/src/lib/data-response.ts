@@ -89,6 +89,7 @@ export interface Stats {
   videoHeight?: number;
   runTime?: number;
   gpsConnected?: boolean;
+  skipRatio?: number;
   cpuTempurature?: number;
 }
 
@@ -471,6 +472,7 @@ const typeMap: any = {
       { json: "VideoHeight", js: "videoHeight", typ: u(undefined, 0) },
       { json: "RunTime", js: "runTime", typ: u(undefined, 0) },
       { json: "GPSConnected", js: "gpsConnected", typ: u(undefined, true) },
+      { json: "SkipRatio", js: "skipRatio", typ: u(undefined, 3.14) },
       { json: "CPUTempurature", js: "cpuTempurature", typ: u(undefined, 0) },
     ],
     false
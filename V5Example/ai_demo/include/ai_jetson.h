@@ -63,6 +63,8 @@ typedef struct {
   float           depth;            // The depth of this object in meters from the camera
   IMAGE_DETECTION   screenLocation;   // The screen coordinates of this object
   MAP_DETECTION     mapLocation;      // The field coordinates of this object
+  int32_t         trackID;          // Stays the same for this object across frames, -1 if the object is not tracked
+  int32_t         age;              // Number of detector runs this object has been tracked for
 } DETECTION_OBJECT;
 
 // The AI_RECORD contains information about the map location of the robot and objects on map
@@ -74,6 +76,30 @@ typedef struct {
 
 
 #define	MAP_POS_SIZE	(sizeof(int32_t) + sizeof(POS_RECORD))
+/// Bytes per detection in a MAP_PACKET_TYPE payload, a DETECTION_OBJECT without trackID and age.
+/// TRACKED_PACKET_TYPE payloads carry the whole DETECTION_OBJECT.
+#define	MAP_DETECTION_SIZE	(sizeof(DETECTION_OBJECT) - 2 * sizeof(int32_t))
+
+/// Compact packet (COMPACT_PACKET_TYPE) payload: uint8_t detection count, uint8_t flags and a POS_RECORD,
+/// followed by one COMPACT_DETECTION per detection, each followed by a COMPACT_SCREEN if COMPACT_SCREEN_BOXES is set.
+#define COMPACT_HEADER_SIZE   (2 * sizeof(uint8_t) + sizeof(POS_RECORD))
+#define COMPACT_SCREEN_BOXES  0x01
+
+/// Quantized DETECTION_OBJECT
+typedef struct __attribute__((__packed__)) {
+  uint8_t     classID;          // The class ID of the object
+  uint8_t     probability;      // Probability in 1/255 steps (255 == 100%)
+  uint16_t    depth;            // Depth in millimeters from the camera
+  int16_t     x, y, z;          // Field coordinates in millimeters
+  uint16_t    trackID;          // Track ID, 0xFFFF if the object is not tracked
+  uint8_t     age;              // Number of detector runs this object has been tracked for, saturates at 255
+} COMPACT_DETECTION;
+
+/// Screen box of a COMPACT_DETECTION, in pixels
+typedef struct __attribute__((__packed__)) {
+  int16_t     x, y;
+  int16_t     width, height;
+} COMPACT_SCREEN;
 
 // packet from V5
 typedef struct __attribute__((__packed__)) _map_packet {
@@ -103,6 +129,9 @@ namespace ai {
         int32_t    get_total(void);
         int32_t    get_data( AI_RECORD *map );
         void       request_map();
+        void       request_compact( bool compact, bool screenBoxes );
+        void       request_tracks( bool tracks );
+        bool       tracks_requested(void);
 
 
       private:
@@ -115,6 +144,14 @@ namespace ai {
         };
 
         #define   MAP_PACKET_TYPE     0x0001
+        #define   COMPACT_PACKET_TYPE 0x0002
+        #define   TRACKED_PACKET_TYPE 0x0003
+
+        // Capability flags sent with every request, they select the packet the Jetson replies with
+        #define   CAPABILITY_MAP            0x01
+        #define   CAPABILITY_COMPACT        0x02
+        #define   CAPABILITY_SCREEN_BOXES   0x04
+        #define   CAPABILITY_TRACKS         0x08
 
         enum class jetson_state {
             kStateSyncWait1   = 0,
@@ -141,6 +178,7 @@ namespace ai {
         uint32_t      calc_crc32;
         uint32_t      last_packet_time;
         uint32_t      total_data_received;
+        uint8_t       capabilities;
         
         union {
           AI_RECORD  map;
@@ -153,6 +191,7 @@ namespace ai {
         uint32_t      last_payload_length;
 
         bool          parse( uint8_t data );
+        bool          parse_compact( AI_RECORD *map );
 
         static int    receive_task( void *arg );
 
@@ -124,11 +124,23 @@ void moveToPosition(double target_x, double target_y, double target_theta = -1)
 }
 
 // Function to find the target object based on type and return its record
+// If track IDs were requested (jetson_comms.request_tracks), once a target is picked the same tracked object is
+// returned for as long as the Jetson still reports it, so the robot does not switch between similar objects at
+// about the same distance
 DETECTION_OBJECT findTarget(OBJECT type){
     DETECTION_OBJECT target;
     static AI_RECORD local_map;
+    static int32_t lastTrackID = -1;
     jetson_comms.get_data(&local_map);
     double lowestDist = 1000000;
+    if (!jetson_comms.tracks_requested())
+        lastTrackID = -1;
+    // Keep following the previous target if it is still tracked
+    for(int i = 0; i < local_map.detectionCount; i++) {
+        if (lastTrackID >= 0 && local_map.detections[i].trackID == lastTrackID && local_map.detections[i].classID == (int) type) {
+            return local_map.detections[i];
+        }
+    }
     // Iterate through detected objects to find the closest target of the specified type
     for(int i = 0; i < local_map.detectionCount; i++) {
         double distance = distanceTo(local_map.detections[i].mapLocation.x, local_map.detections[i].mapLocation.y);
@@ -137,6 +149,7 @@ DETECTION_OBJECT findTarget(OBJECT type){
             lowestDist = distance;
         }
     }
+    lastTrackID = lowestDist < 1000000 ? target.trackID : -1;
     return target;
 }
 
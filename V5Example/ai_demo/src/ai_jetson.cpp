@@ -27,6 +27,7 @@ using namespace ai;
 //
 jetson::jetson() {
     state = jetson_state::kStateSyncWait1;
+    capabilities = CAPABILITY_MAP;
 
     thread t1 = thread( receive_task, static_cast<void *>(this) );
     t1.setPriority(thread::threadPriorityHigh);
@@ -255,7 +256,11 @@ jetson::parse( uint8_t data ) {
           memcpy(&newMap, &payload.bytes[0], MAP_POS_SIZE);
           if(newMap.detectionCount > MAX_DETECTIONS)
             newMap.detectionCount = MAX_DETECTIONS;
-          memcpy(&newMap.detections, &payload.bytes[MAP_POS_SIZE], sizeof(DETECTION_OBJECT) * newMap.detectionCount);
+          // detections in this packet have no track ID and age
+          for( int32_t i = 0; i < newMap.detectionCount; i++ ) {
+            memcpy(&newMap.detections[i], &payload.bytes[MAP_POS_SIZE + MAP_DETECTION_SIZE * i], MAP_DETECTION_SIZE);
+            newMap.detections[i].trackID = -1;
+          }
 
 
           // lock access to last_map and copy data
@@ -263,6 +268,33 @@ jetson::parse( uint8_t data ) {
           memcpy( &last_map, &newMap, sizeof(AI_RECORD));
           maplock.unlock();
         }
+        else
+        if( payload_type == TRACKED_PACKET_TYPE ) {
+          AI_RECORD newMap;
+          // Same as the map packet with the track ID and age of every detection
+          memset(&newMap, 0, sizeof(newMap));
+          memcpy(&newMap, &payload.bytes[0], MAP_POS_SIZE);
+          if(newMap.detectionCount > MAX_DETECTIONS)
+            newMap.detectionCount = MAX_DETECTIONS;
+          memcpy(&newMap.detections, &payload.bytes[MAP_POS_SIZE], sizeof(DETECTION_OBJECT) * newMap.detectionCount);
+
+          maplock.lock();
+          memcpy( &last_map, &newMap, sizeof(AI_RECORD));
+          maplock.unlock();
+        }
+        else
+        if( payload_type == COMPACT_PACKET_TYPE ) {
+          AI_RECORD newMap;
+          // Expand the quantized payload into a AI_RECORD
+          if( parse_compact( &newMap ) ) {
+            maplock.lock();
+            memcpy( &last_map, &newMap, sizeof(AI_RECORD));
+            maplock.unlock();
+          }
+          else {
+            errors++;
+          }
+        }
 
         // timestamp this packet
         last_packet_time = timer.system();
@@ -285,6 +317,95 @@ jetson::parse( uint8_t data ) {
     return bRecall;
 }
 
+/*---------------------------------------------------------------------------*/
+/** @brief  Expand a compact packet payload into a map record                */
+/*---------------------------------------------------------------------------*/
+//
+// returns false if the payload is shorter than its detection count requires
+//
+bool
+jetson::parse_compact( AI_RECORD *map ) {
+    uint8_t   count = payload.bytes[0];
+    uint8_t   flags = payload.bytes[1];
+    uint32_t  stride = sizeof(COMPACT_DETECTION) + ((flags & COMPACT_SCREEN_BOXES) ? sizeof(COMPACT_SCREEN) : 0);
+
+    if( COMPACT_HEADER_SIZE + stride * count > payload_length )
+      return false;
+
+    memset(map, 0, sizeof(AI_RECORD));
+    memcpy(&map->pos, &payload.bytes[2], sizeof(POS_RECORD));
+    map->detectionCount = count > MAX_DETECTIONS ? MAX_DETECTIONS : count;
+
+    uint8_t *p = &payload.bytes[COMPACT_HEADER_SIZE];
+    for( int32_t i = 0; i < map->detectionCount; i++, p += stride ) {
+      COMPACT_DETECTION compact;
+      DETECTION_OBJECT  *det = &map->detections[i];
+
+      // copy out first, the packed fields are not aligned
+      memcpy(&compact, p, sizeof(COMPACT_DETECTION));
+      det->classID = compact.classID;
+      det->probability = compact.probability / 255.0f;
+      det->depth = compact.depth / 1000.0f;
+      det->mapLocation.x = compact.x / 1000.0f;
+      det->mapLocation.y = compact.y / 1000.0f;
+      det->mapLocation.z = compact.z / 1000.0f;
+      det->trackID = compact.trackID == 0xFFFF ? -1 : compact.trackID;
+      det->age = compact.age;
+
+      if( flags & COMPACT_SCREEN_BOXES ) {
+        COMPACT_SCREEN screen;
+        memcpy(&screen, p + sizeof(COMPACT_DETECTION), sizeof(COMPACT_SCREEN));
+        det->screenLocation.x = screen.x;
+        det->screenLocation.y = screen.y;
+        det->screenLocation.width = screen.width;
+        det->screenLocation.height = screen.height;
+      }
+    }
+
+    return true;
+}
+
+/*---------------------------------------------------------------------------*/
+/** @brief  Select the packet format the Jetson replies with                 */
+/*---------------------------------------------------------------------------*/
+//
+// The compact packet quantizes the detections (millimeters, 1/255 probability)
+// and is about a third of the size, screen boxes are optional in it
+//
+void
+jetson::request_compact( bool compact, bool screenBoxes ) {
+    capabilities = CAPABILITY_MAP | (capabilities & CAPABILITY_TRACKS);
+    if( compact ) {
+      capabilities |= CAPABILITY_COMPACT;
+      if( screenBoxes )
+        capabilities |= CAPABILITY_SCREEN_BOXES;
+    }
+}
+
+/*---------------------------------------------------------------------------*/
+/** @brief  Ask for the track ID and age of every detection                  */
+/*---------------------------------------------------------------------------*/
+//
+// Full packets then use TRACKED_PACKET_TYPE, 8 bytes more per detection than
+// MAP_PACKET_TYPE, compact packets always carry the track IDs.
+// Off by default, a Jetson running older code only answers the plain map request.
+//
+void
+jetson::request_tracks( bool tracks ) {
+    if( tracks )
+      capabilities |= CAPABILITY_TRACKS;
+    else
+      capabilities &= ~CAPABILITY_TRACKS;
+}
+
+/*---------------------------------------------------------------------------*/
+/** @brief  Check if the requested packets carry track IDs                   */
+/*---------------------------------------------------------------------------*/
+bool
+jetson::tracks_requested() {
+    return (capabilities & (CAPABILITY_TRACKS | CAPABILITY_COMPACT)) != 0;
+}
+
 /*---------------------------------------------------------------------------*/
 /** @brief  Send request to the Jetson to ask for next packet                */
 /*---------------------------------------------------------------------------*/
@@ -306,8 +427,10 @@ jetson::request_map() {
 
       // This is arbitary message at the moment
       // just using ASCII for convienience and debug porposes
+      // the last two digits are the capability flags
       //
-      static char msg[] = "AA55CC3301\r\n"; 
+      char msg[16];
+      snprintf( msg, sizeof(msg), "AA55CC33%02X\r\n", capabilities );
 
       // send
       fwrite( msg, 1, strlen(msg), fp );